@@ -0,0 +1,305 @@
+"""Banco de pruebas de rendimiento de Pick & Restore.
+
+Genera un árbol de directorios sintético y reproducible (misma semilla, mismo
+árbol) y mide por separado el escaneo, la búsqueda de duplicados, el poblado
+del árbol de la interfaz (Qt offscreen), el filtro, las consultas de marcados,
+la detección de tipos por contenido y la exportación. Para cada fase da el
+tiempo, el rendimiento y el RSS pico de esa fase (en Linux; en otros sistemas
+es el pico acumulado del proceso hasta ese momento y se marca con «*»).
+
+    python benchmark.py --archivos 100000 --profundidad 4 --ramas 8
+    python benchmark.py --arbol /tmp/arbol_bench --json resultados.json
+
+Con --arbol el árbol se conserva y se reutiliza mientras no cambien sus
+parámetros; sin él se genera en una carpeta temporal que se borra al final.
+Solo se borra y regenera una carpeta --arbol vacía o creada por el banco.
+Las cachés del sistema no se vacían: las cifras son con caché caliente.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+from busqueda import Consulta
+from deteccion import DetectorTipos
+from nucleo import (AlmacenResultados, IndiceEscaneo, MotorEscaneo, BuscadorDuplicados, MotorExportacion,
+                    formato_tamano)
+
+MARCA_ARBOL = ".benchmark_arbol.json"
+
+
+def generar_arbol(raiz, profundidad=3, ramas=6, archivos=20000, mediana=16 * 1024, dispersion=1.5,
+                  tamano_maximo=16 * 1024 * 1024, proporcion_duplicados=0.1, proporcion_vacios=0.02, semilla=1):
+    """Crea en raiz un árbol sintético y devuelve sus parámetros.
+
+    Hay `ramas` subcarpetas por carpeta hasta `profundidad` niveles y los
+    archivos se reparten al azar entre todas ellas. Los tamaños siguen una
+    lognormal de mediana `mediana` recortada a tamano_maximo; una fracción de
+    los archivos son copias exactas de otros y otra fracción está vacía.
+    """
+    parametros = {'profundidad': profundidad, 'ramas': ramas, 'archivos': archivos, 'mediana': mediana,
+                  'dispersion': dispersion, 'tamano_maximo': tamano_maximo,
+                  'proporcion_duplicados': proporcion_duplicados, 'proporcion_vacios': proporcion_vacios,
+                  'semilla': semilla}
+    azar = random.Random(semilla)
+    carpetas = [raiz]
+    nivel = [raiz]
+    for _ in range(profundidad):
+        siguiente = []
+        for carpeta in nivel:
+            for i in range(ramas):
+                siguiente.append(os.path.join(carpeta, f"d{i:03d}"))
+        carpetas += siguiente
+        nivel = siguiente
+    for carpeta in carpetas:
+        os.makedirs(carpeta, exist_ok=True)
+
+    # Contenido a partir de un bloque aleatorio fijo; una cabecera con el
+    # número de archivo hace distinto cada original
+    bloque = azar.randbytes(1 << 20)
+    originales = []
+    for numero in range(archivos):
+        ruta = os.path.join(azar.choice(carpetas), f"f{numero:07d}{azar.choice(('.jpg', '.txt', '.pdf', '.docx', '.bin'))}")
+        sorteo = azar.random()
+        if sorteo < proporcion_vacios:
+            contenido = b''
+        elif sorteo < proporcion_vacios + proporcion_duplicados and originales:
+            with open(azar.choice(originales), 'rb') as f:
+                contenido = f.read()
+        else:
+            tamano = max(1, min(tamano_maximo, int(azar.lognormvariate(math.log(mediana), dispersion))))
+            cabecera = f"{numero:016d}".encode()
+            contenido = cabecera + bloque * (tamano // len(bloque)) + bloque[:tamano % len(bloque)]
+            contenido = contenido[:tamano]
+            originales.append(ruta)
+        with open(ruta, 'wb') as f:
+            f.write(contenido)
+    with open(os.path.join(raiz, MARCA_ARBOL), 'w', encoding='utf-8') as f:
+        json.dump(parametros, f)
+    return parametros
+
+
+def preparar_arbol(raiz, parametros):
+    """Reutiliza raiz si ya contiene un árbol con los mismos parámetros.
+
+    Si no, la regenera, pero solo si está vacía o lleva la marca de un árbol
+    del banco: con cualquier otra carpeta lanza ValueError sin tocarla.
+    """
+    marca = os.path.join(raiz, MARCA_ARBOL)
+    try:
+        with open(marca, encoding='utf-8') as f:
+            if json.load(f) == parametros:
+                return False
+    except (OSError, ValueError):
+        pass
+    if os.path.isdir(raiz):
+        if not os.path.isfile(marca) and os.listdir(raiz):
+            raise ValueError(f"{raiz} no está vacía y no es un árbol del banco ({MARCA_ARBOL}); no se borra")
+        shutil.rmtree(raiz)
+    generar_arbol(raiz, **parametros)
+    return True
+
+
+def reiniciar_rss_pico():
+    """Lleva el RSS pico al RSS actual (Linux); devuelve False si el sistema no lo permite."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def rss_pico():
+    """RSS máximo del proceso desde el último reinicio (o desde que empezó), en bytes, o None."""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux da KiB; macOS, bytes
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+
+class Banco:
+    """Ejecuta las fases y acumula sus mediciones."""
+
+    def __init__(self):
+        self.mediciones = []
+
+    def medir(self, fase, funcion, elementos=None, bytes_=None):
+        """Ejecuta funcion(), anota su duración y devuelve su resultado.
+
+        elementos y bytes_ pueden ser números o funciones que reciben el
+        resultado, para fases cuyo volumen solo se conoce al terminar.
+        """
+        # Sin reinicio, el pico incluye el de las fases anteriores
+        por_fase = reiniciar_rss_pico()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        segundos = time.perf_counter() - inicio
+        pico = rss_pico()
+        if callable(elementos):
+            elementos = elementos(resultado)
+        if callable(bytes_):
+            bytes_ = bytes_(resultado)
+        self.mediciones.append({'fase': fase, 'segundos': segundos, 'elementos': elementos, 'bytes': bytes_,
+                                'rss_pico': pico, 'rss_acumulado': not por_fase})
+        return resultado
+
+    def imprimir(self, salida=sys.stdout):
+        salida.write(f"{'fase':<28}{'segundos':>10}{'elem/s':>14}{'bytes/s':>14}{'RSS pico':>14}\n")
+        for m in self.mediciones:
+            segundos = max(m['segundos'], 1e-9)
+            por_segundo = f"{m['elementos'] / segundos:,.0f}" if m['elementos'] is not None else "-"
+            bytes_por_segundo = formato_tamano(m['bytes'] / segundos) if m['bytes'] is not None else "-"
+            pico = formato_tamano(m['rss_pico']) if m['rss_pico'] is not None else "-"
+            if m['rss_pico'] is not None and m['rss_acumulado']:
+                pico += "*"
+            salida.write(f"{m['fase']:<28}{m['segundos']:>10.3f}{por_segundo:>14}{bytes_por_segundo:>14}{pico:>14}\n")
+        if any(m['rss_pico'] is not None and m['rss_acumulado'] for m in self.mediciones):
+            salida.write("* pico acumulado del proceso desde el inicio, no solo de esa fase\n")
+
+
+def escanear(raiz, hilos, indice=None):
+    registros = []
+    for lote in MotorEscaneo(num_hilos=hilos, indice=indice).escanear([raiz]):
+        registros.extend(lote)
+    return registros
+
+
+def almacenar(registros):
+    almacen = AlmacenResultados()
+    for registro in registros:
+        almacen.anadir(registro)
+    return almacen
+
+
+def fases_interfaz(banco, registros, grupos, tamano_lote):
+    """Poblado del árbol y consultas de marcados sobre la interfaz real."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from interfaz import GestorArchivos
+    except ImportError as e:
+        print(f"Fases de interfaz omitidas: {e}", file=sys.stderr)
+        return
+    app = QApplication.instance() or QApplication(sys.argv)
+    gestor = GestorArchivos()
+    gestor.resize(1200, 800)
+    gestor.show()
+    n = len(registros)
+
+    def poblar():
+        # Igual que el escaneo en streaming: lotes y eventos entre medias
+        gestor.limpiar_archivos()
+        for inicio in range(0, n, tamano_lote):
+            gestor.anexar_archivos(registros[inicio:inicio + tamano_lote])
+            app.processEvents()
+
+    def agrupar():
+        gestor.aplicar_duplicados(grupos)
+        app.processEvents()
+
+    banco.medir("poblado árbol", poblar, n)
+    banco.medir("agrupar duplicados", agrupar, sum(len(g) for g in grupos))
+    # Sin índices ordenados la consulta recorre las columnas y pide construirlos en segundo plano
+    consulta = Consulta("tipo:pdf >64KB arch*")
+    banco.medir("filtrar (sin índices)", lambda: gestor.filtrar(consulta), n)
+    banco.medir("índices de búsqueda (fondo)", lambda: gestor.modelo.indice.preparar_en_segundo_plano().join(), n)
+    banco.medir("filtrar", lambda: gestor.filtrar(Consulta("f00 tipo:jpg,pdf <1MB")), n)
+    banco.medir("marcar coincidentes", lambda: gestor.marcar_coincidentes(True), n)
+    banco.medir("quitar filtro", lambda: gestor.filtrar(None), n)
+    banco.medir("marcar todo", lambda: gestor.marcar_todo(True), n)
+    banco.medir("contar marcados", gestor.contar_marcados, 1)
+    banco.medir("registros marcados", gestor.obtener_registros_marcados, len)
+    banco.medir("desmarcar todo", lambda: gestor.marcar_todo(False), n)
+    gestor.close()
+
+
+def main(argv=None):
+    analizador = argparse.ArgumentParser(description="Banco de pruebas de rendimiento de Pick & Restore.")
+    analizador.add_argument('--arbol', help="carpeta donde generar (y conservar) el árbol sintético")
+    analizador.add_argument('--archivos', type=int, default=20000)
+    analizador.add_argument('--profundidad', type=int, default=3)
+    analizador.add_argument('--ramas', type=int, default=6, help="subcarpetas por carpeta")
+    analizador.add_argument('--mediana', type=int, default=16 * 1024, help="tamaño mediano en bytes")
+    analizador.add_argument('--dispersion', type=float, default=1.5, help="sigma de la lognormal de tamaños")
+    analizador.add_argument('--tamano-maximo', type=int, default=16 * 1024 * 1024)
+    analizador.add_argument('--duplicados', type=float, default=0.1, help="fracción de archivos duplicados")
+    analizador.add_argument('--vacios', type=float, default=0.02, help="fracción de archivos de 0 bytes")
+    analizador.add_argument('--semilla', type=int, default=1)
+    analizador.add_argument('--hilos', type=int, help="hilos del motor de escaneo")
+    analizador.add_argument('--lote', type=int, default=2000, help="tamaño de lote al poblar el árbol")
+    analizador.add_argument('--sin-interfaz', action='store_true', help="omitir las fases de Qt")
+    analizador.add_argument('--sin-exportar', action='store_true', help="omitir la exportación")
+    analizador.add_argument('--json', metavar='SALIDA', help="guardar parámetros y mediciones en JSON")
+    args = analizador.parse_args(argv)
+
+    parametros = {'profundidad': args.profundidad, 'ramas': args.ramas, 'archivos': args.archivos,
+                  'mediana': args.mediana, 'dispersion': args.dispersion, 'tamano_maximo': args.tamano_maximo,
+                  'proporcion_duplicados': args.duplicados, 'proporcion_vacios': args.vacios,
+                  'semilla': args.semilla}
+    temporal = tempfile.mkdtemp(prefix='pickrestore_bench_')
+    raiz = args.arbol or os.path.join(temporal, 'arbol')
+    banco = Banco()
+    try:
+        inicio = time.perf_counter()
+        try:
+            generado = preparar_arbol(raiz, parametros)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        if generado:
+            print(f"Árbol generado en {raiz} ({time.perf_counter() - inicio:.1f} s)", file=sys.stderr)
+
+        registros = banco.medir("escaneo", lambda: escanear(raiz, args.hilos), len,
+                                lambda r: sum(x.tamano for x in r))
+        indice = IndiceEscaneo(os.path.join(temporal, 'indice.sqlite'))
+        banco.medir("escaneo índice (frío)", lambda: escanear(raiz, args.hilos, indice), len)
+        banco.medir("escaneo índice (caliente)", lambda: escanear(raiz, args.hilos, indice), len)
+
+        almacen = banco.medir("almacén de resultados", lambda: almacenar(registros), len)
+        print(f"Almacén de resultados: {almacen.memoria() / max(len(almacen), 1):.1f} bytes por archivo",
+              file=sys.stderr)
+        # El peor caso: se lee la cabecera de todos los archivos, sin caché
+        banco.medir("tipos por contenido", lambda: DetectorTipos(todos=True).clasificar(almacen), len(almacen))
+        del almacen
+
+        grupos = banco.medir("duplicados", lambda: BuscadorDuplicados().agrupar(
+            [r.ruta for r in registros], [r.tamano for r in registros]), len(registros))
+
+        if not args.sin_interfaz:
+            fases_interfaz(banco, registros, grupos, args.lote)
+
+        if not args.sin_exportar:
+            destino = os.path.join(temporal, 'exportado')
+            informe = banco.medir("exportación", lambda: MotorExportacion().exportar(registros, destino),
+                                  lambda i: i.exitos, lambda i: i.bytes_copiados)
+            if informe.errores:
+                print(f"Exportación: {len(informe.errores)} errores", file=sys.stderr)
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    banco.imprimir()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'parametros': parametros, 'mediciones': banco.mediciones}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,396 @@
+"""Búsqueda y filtrado de los resultados de un escaneo.
+
+Una consulta es un texto con condiciones separadas por espacios, que deben
+cumplirse todas:
+
+    factura tipo:pdf >1MB dias:7 en:/Users/x
+
+    palabra          el nombre contiene la palabra (sin distinguir mayúsculas)
+    palabra*         el nombre empieza por la palabra
+    tipo:pdf,docx    extensión
+    >1MB  <=500KB    tamaño (también >=, < y =; B, KB, MB, GB, TB)
+    desde:2024-05-01 hasta:2024-05-31   fecha de modificación (días completos)
+    dias:7           modificados en los últimos 7 días
+    en:/Users/x      dentro de esa carpeta o de sus subcarpetas
+
+Los valores con espacios van entre comillas: en:"/Users/x/Mis documentos".
+Nombres y carpetas se comparan sin distinguir mayúsculas (también Ñ/ñ, Á/á).
+"""
+import os
+import re
+import time
+import heapq
+import shlex
+import bisect
+import operator
+import threading
+from array import array
+from itertools import repeat
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+UNIDADES = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+_TAMANO = re.compile(r'^(<=|>=|<|>|=)?(\d+(?:[.,]\d+)?)\s*([KMGT]?B)?$', re.IGNORECASE)
+
+
+def _dentro(carpeta, prefijo):
+    """True si carpeta (ya en casefold) es prefijo o está dentro de él."""
+    return carpeta == prefijo or carpeta.startswith(prefijo + os.sep) or carpeta.startswith(prefijo + '/')
+
+
+def _primera(n, condicion):
+    """Menor i en [0, n) con condicion(i) falsa, suponiendo que es monótona."""
+    bajo, alto = 0, n
+    while bajo < alto:
+        medio = (bajo + alto) // 2
+        if condicion(medio):
+            bajo = medio + 1
+        else:
+            alto = medio
+    return bajo
+
+
+class Consulta:
+    """Condiciones de búsqueda sobre nombre, tipo, tamaño, fecha y carpeta.
+
+    Lanza ValueError con un mensaje legible si el texto no se entiende.
+    """
+    __slots__ = ('textos', 'prefijos', 'extensiones', 'tamano_min', 'tamano_max', 'fecha_min', 'fecha_max',
+                 'carpetas')
+
+    def __init__(self, texto='', ahora=None):
+        self.textos = []
+        self.prefijos = []
+        self.extensiones = None
+        self.tamano_min = self.tamano_max = None
+        self.fecha_min = self.fecha_max = None
+        self.carpetas = []
+        # Sin escapes con barra invertida, para poder escribir rutas de Windows
+        lexico = shlex.shlex(texto, posix=True)
+        lexico.whitespace_split = True
+        lexico.escape = ''
+        try:
+            palabras = list(lexico)
+        except ValueError:
+            raise ValueError("Comillas sin cerrar") from None
+        for palabra in palabras:
+            self._anadir(palabra, time.time() if ahora is None else ahora)
+
+    def _anadir(self, palabra, ahora):
+        clave, separador, valor = palabra.partition(':')
+        clave = clave.lower()
+        if separador and clave == 'tipo':
+            extensiones = {'.' + e.strip().lstrip('.').lower() for e in valor.split(',') if e.strip()}
+            self.extensiones = extensiones if self.extensiones is None else self.extensiones & extensiones
+        elif separador and clave in ('tamano', 'tamaño'):
+            self._anadir_tamano(valor)
+        elif separador and clave in ('desde', 'hasta'):
+            try:
+                dia = datetime.strptime(valor, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Fecha no válida: {valor!r} (use AAAA-MM-DD)") from None
+            if clave == 'desde':
+                self._limitar_fecha(dia.timestamp(), None)
+            else:
+                self._limitar_fecha(None, (dia + timedelta(days=1)).timestamp() - 1e-6)
+        elif separador and clave == 'dias':
+            try:
+                dias = float(valor)
+            except ValueError:
+                raise ValueError(f"Número de días no válido: {valor!r}") from None
+            self._limitar_fecha(ahora - dias * 86400, None)
+        elif separador and clave == 'en':
+            if valor:
+                self.carpetas.append(valor.rstrip('/\\').casefold())
+        elif palabra[0] in '<>=':
+            self._anadir_tamano(palabra)
+        elif palabra.endswith('*'):
+            if palabra.rstrip('*'):
+                self.prefijos.append(palabra.rstrip('*'))
+        else:
+            self.textos.append(palabra)
+
+    def _anadir_tamano(self, valor):
+        coincidencia = _TAMANO.match(valor.strip())
+        if coincidencia is None:
+            raise ValueError(f"Tamaño no válido: {valor!r} (p. ej. >1MB)")
+        operador, numero, unidad = coincidencia.groups()
+        tamano = int(float(numero.replace(',', '.')) * UNIDADES[(unidad or '').upper()])
+        if operador == '>':
+            self._limitar_tamano(tamano + 1, None)
+        elif operador == '>=':
+            self._limitar_tamano(tamano, None)
+        elif operador == '<':
+            self._limitar_tamano(None, tamano - 1)
+        elif operador == '<=':
+            self._limitar_tamano(None, tamano)
+        else:
+            self._limitar_tamano(tamano, tamano)
+
+    def _limitar_tamano(self, minimo, maximo):
+        if minimo is not None:
+            self.tamano_min = minimo if self.tamano_min is None else max(self.tamano_min, minimo)
+        if maximo is not None:
+            self.tamano_max = maximo if self.tamano_max is None else min(self.tamano_max, maximo)
+
+    def _limitar_fecha(self, minimo, maximo):
+        if minimo is not None:
+            self.fecha_min = minimo if self.fecha_min is None else max(self.fecha_min, minimo)
+        if maximo is not None:
+            self.fecha_max = maximo if self.fecha_max is None else min(self.fecha_max, maximo)
+
+    def vacia(self):
+        return not (self.textos or self.prefijos or self.carpetas or self.extensiones is not None
+                    or self.tamano_min is not None or self.tamano_max is not None
+                    or self.fecha_min is not None or self.fecha_max is not None)
+
+
+class IndiceBusqueda:
+    """Índices en memoria para resolver una Consulta sobre un AlmacenResultados.
+
+    Cada condición da una máscara de bytes (1 = coincide) y las máscaras se
+    combinan como enteros grandes, en C. Tamaños y fechas se resuelven con
+    los números de archivo ordenados por valor: bisect da el rango y solo se
+    recorren los archivos que caen dentro (o fuera, si son menos). El prefijo
+    del nombre usa el mismo esquema con el orden alfabético de los nombres;
+    las subcadenas se buscan en el bloque de nombres del almacén y las
+    máscaras de los últimos TEXTOS_GUARDADOS textos se guardan (al afinar
+    una consulta no se vuelve a recorrer los nombres; si llegan archivos
+    nuevos, solo se buscan en ellos). Extensiones y carpetas se comprueban
+    con sus tablas, que son pequeñas.
+
+    filtrar_por_pasos hace lo mismo que filtrar en pasos de unos pocos ms,
+    para repartir una consulta sobre un millón de archivos entre varias
+    vueltas del bucle de eventos de la interfaz.
+
+    Los índices ordenados nunca se construyen en el hilo que consulta: hasta
+    que están listos, tamaño, fecha y prefijo se resuelven recorriendo la
+    columna entera con map (decenas de ms por millón de archivos) y se pide
+    construirlos en segundo plano (preparar_en_segundo_plano, que también
+    puede llamarse al terminar el escaneo). Se ordenan por trozos y se mezclan
+    con heapq.merge para no retener el GIL segundos seguidos. Los archivos
+    añadidos después se comprueban uno a uno hasta que son más del 10 % y
+    entonces se reconstruyen.
+    """
+    PROPORCION_RECONSTRUIR = 0.1
+    CLAVES = ('tamano', 'fecha', 'nombre')
+    TROZO_ORDEN = 1 << 16
+    TROZO_PASO = 1 << 18
+    TEXTOS_GUARDADOS = 8
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        # clave -> (números de archivo ordenados, valores en ese orden)
+        self._ordenados = {}
+        self._preparando = None
+        # texto en casefold -> máscara de los nombres que lo contienen
+        self._textos = OrderedDict()
+
+    def preparar(self, cancelado=lambda: False):
+        """Pliega los nombres y construye los índices ordenados que falten o hayan quedado viejos."""
+        for _ in self.almacen.trozos_plegados(cancelado=cancelado):
+            pass
+        for clave in self.CLAVES:
+            n = len(self.almacen)
+            if self._ordenado(clave, n) is None and not cancelado():
+                ordenado = self._construir(clave, n, cancelado)
+                if ordenado is not None:
+                    self._ordenados[clave] = ordenado
+
+    def preparar_en_segundo_plano(self):
+        """Lanza preparar() en un hilo si no está ya en marcha; devuelve ese hilo."""
+        if self._preparando is None or not self._preparando.is_alive():
+            self._preparando = threading.Thread(target=self.preparar, daemon=True, name="indice-busqueda")
+            self._preparando.start()
+        return self._preparando
+
+    def filtrar(self, consulta):
+        """Máscara bytearray de los archivos actuales, o None si la consulta no filtra."""
+        pasos = self.filtrar_por_pasos(consulta)
+        while True:
+            try:
+                next(pasos)
+            except StopIteration as fin:
+                return fin.value
+
+    def filtrar_por_pasos(self, consulta):
+        """Generador con el trabajo de filtrar: None entre paso y paso y, al final, la máscara como valor de retorno.
+
+        Con yield from se obtiene la misma máscara que con filtrar.
+        """
+        if consulta.vacia():
+            return None
+        n = len(self.almacen)
+        almacen = self.almacen
+        mascaras = []
+        if consulta.extensiones is not None:
+            numeros = {i for i, extension in enumerate(almacen.extensiones) if extension in consulta.extensiones}
+            mascaras.append((yield from self._por_trozos(numeros.__contains__, almacen.tipos, n)))
+        if consulta.carpetas:
+            numeros = {i for i, carpeta in enumerate(almacen.carpetas)
+                       if all(_dentro(carpeta.casefold(), prefijo) for prefijo in consulta.carpetas)}
+            mascaras.append((yield from self._por_trozos(numeros.__contains__, almacen.padres, n)))
+        if consulta.tamano_min is not None or consulta.tamano_max is not None:
+            mascaras.append(self._rango('tamano', consulta.tamano_min, consulta.tamano_max, n))
+            yield
+        if consulta.fecha_min is not None or consulta.fecha_max is not None:
+            mascaras.append(self._rango('fecha', consulta.fecha_min, consulta.fecha_max, n))
+            yield
+        for texto in consulta.textos:
+            mascaras.append((yield from self._con_texto(texto, n)))
+        for prefijo in consulta.prefijos:
+            mascaras.append(self._prefijo(prefijo, n))
+            yield
+        if any(self._ordenado(clave, n) is None for clave in self._claves_usadas(consulta)):
+            self.preparar_en_segundo_plano()
+        resultado = int.from_bytes(mascaras[0], 'little')
+        for mascara in mascaras[1:]:
+            resultado &= int.from_bytes(mascara, 'little')
+        return bytearray(resultado.to_bytes(n, 'little'))
+
+    def _por_trozos(self, funcion, columna, n):
+        """bytes(map(funcion, columna[:n])) en pasos de TROZO_PASO archivos."""
+        partes = []
+        for inicio in range(0, n, self.TROZO_PASO):
+            partes.append(bytes(map(funcion, columna[inicio:min(n, inicio + self.TROZO_PASO)])))
+            yield
+        return b''.join(partes)
+
+    def _con_texto(self, texto, n):
+        """Máscara de los nombres que contienen texto, guardada para las consultas siguientes."""
+        clave = texto.casefold()
+        guardada = self._textos.pop(clave, None)
+        if guardada is not None and len(guardada) <= n:
+            mascara = guardada + bytearray(n - len(guardada))
+            desde = len(guardada)
+        else:
+            mascara, desde = bytearray(n), 0
+        if desde < n:
+            yield from self.almacen.marcar_nombres(texto, mascara, desde)
+        self._textos[clave] = mascara
+        if len(self._textos) > self.TEXTOS_GUARDADOS:
+            self._textos.popitem(last=False)
+        return mascara
+
+    def coincide(self, consulta, archivo):
+        """Comprueba un solo archivo (los que llegan con un filtro ya aplicado)."""
+        almacen = self.almacen
+        if consulta.extensiones is not None and almacen.tipo(archivo) not in consulta.extensiones:
+            return False
+        tamano = almacen.tamanos[archivo]
+        if ((consulta.tamano_min is not None and tamano < consulta.tamano_min)
+                or (consulta.tamano_max is not None and tamano > consulta.tamano_max)):
+            return False
+        fecha = almacen.fechas[archivo]
+        if ((consulta.fecha_min is not None and fecha < consulta.fecha_min)
+                or (consulta.fecha_max is not None and fecha > consulta.fecha_max)):
+            return False
+        if consulta.carpetas:
+            carpeta = almacen.carpeta(archivo).casefold()
+            if not all(_dentro(carpeta, prefijo) for prefijo in consulta.carpetas):
+                return False
+        if consulta.textos or consulta.prefijos:
+            nombre = almacen.nombre(archivo).casefold()
+            if not all(texto.casefold() in nombre for texto in consulta.textos):
+                return False
+            if not all(nombre.startswith(prefijo.casefold()) for prefijo in consulta.prefijos):
+                return False
+        return True
+
+    @staticmethod
+    def _claves_usadas(consulta):
+        if consulta.tamano_min is not None or consulta.tamano_max is not None:
+            yield 'tamano'
+        if consulta.fecha_min is not None or consulta.fecha_max is not None:
+            yield 'fecha'
+        if consulta.prefijos:
+            yield 'nombre'
+
+    def _ordenado(self, clave, n):
+        """Índice ordenado de clave si está al día para n archivos, o None."""
+        ordenado = self._ordenados.get(clave)
+        if ordenado is None or n - len(ordenado[0]) > self.PROPORCION_RECONSTRUIR * n:
+            return None
+        return ordenado
+
+    def _construir(self, clave, n, cancelado):
+        if clave == 'nombre':
+            valores = []
+            for _, _, trozo in self.almacen.trozos_plegados(n, cancelado):
+                valores += trozo.split(b'\0')
+            if cancelado():
+                return None
+        else:
+            valores = (self.almacen.tamanos if clave == 'tamano' else self.almacen.fechas)[:n]
+        clave_de = valores.__getitem__
+        trozos = []
+        for inicio in range(0, n, self.TROZO_ORDEN):
+            if cancelado():
+                return None
+            trozos.append(sorted(range(inicio, min(n, inicio + self.TROZO_ORDEN)), key=clave_de))
+        archivos = array('q', heapq.merge(*trozos, key=clave_de) if len(trozos) > 1 else (trozos or [[]])[0])
+        if clave == 'nombre':
+            return archivos, None
+        # Por trozos también: un solo array(map(...)) de un millón retiene el GIL
+        ordenados = array(valores.typecode)
+        for inicio in range(0, n, self.TROZO_ORDEN):
+            if cancelado():
+                return None
+            ordenados.extend(map(clave_de, archivos[inicio:inicio + self.TROZO_ORDEN]))
+        return archivos, ordenados
+
+    def _rango(self, clave, minimo, maximo, n):
+        ordenado = self._ordenado(clave, n)
+        if ordenado is None:
+            columna = (self.almacen.tamanos if clave == 'tamano' else self.almacen.fechas)[:n]
+            if minimo is None:
+                return bytearray(map(operator.le, columna, repeat(maximo)))
+            if maximo is None:
+                return bytearray(map(operator.ge, columna, repeat(minimo)))
+            return bytearray(map(operator.and_, map(operator.ge, columna, repeat(minimo)),
+                                 map(operator.le, columna, repeat(maximo))))
+        archivos, valores = ordenado
+        bajo = 0 if minimo is None else bisect.bisect_left(valores, minimo)
+        alto = len(valores) if maximo is None else bisect.bisect_right(valores, maximo)
+        return self._mascara(archivos, bajo, alto, n, clave, minimo, maximo)
+
+    def _prefijo(self, prefijo, n):
+        buscado = prefijo.casefold().encode('utf-8', 'surrogatepass')
+        ordenado = self._ordenado('nombre', n)
+        if ordenado is None:
+            mascara = bytearray(n)
+            for primero, ultimo, trozo in self.almacen.trozos_plegados(n):
+                mascara[primero:ultimo] = bytes(map(bytes.startswith, trozo.split(b'\0'), repeat(buscado)))
+            return mascara
+        archivos, _ = ordenado
+        largo = len(buscado)
+        nombre_plegado = self.almacen.nombre_plegado
+
+        def clave(posicion):
+            return nombre_plegado(archivos[posicion])[:largo]
+
+        bajo = _primera(len(archivos), lambda posicion: clave(posicion) < buscado)
+        alto = _primera(len(archivos), lambda posicion: clave(posicion) <= buscado)
+        return self._mascara(archivos, bajo, alto, n, 'nombre', buscado, None)
+
+    def _mascara(self, archivos, bajo, alto, n, clave, minimo, maximo):
+        """Máscara con archivos[bajo:alto] más los añadidos después de indexar."""
+        if alto - bajo <= len(archivos) // 2:
+            mascara = bytearray(n)
+            for archivo in archivos[bajo:alto]:
+                mascara[archivo] = 1
+        else:
+            # Es más corto recorrer lo que queda fuera
+            mascara = bytearray(b'\x01') * n
+            for archivo in archivos[:bajo]:
+                mascara[archivo] = 0
+            for archivo in archivos[alto:]:
+                mascara[archivo] = 0
+        almacen = self.almacen
+        for archivo in range(len(archivos), n):
+            if clave == 'nombre':
+                mascara[archivo] = almacen.nombre_plegado(archivo).startswith(minimo)
+            else:
+                valor = almacen.tamanos[archivo] if clave == 'tamano' else almacen.fechas[archivo]
+                mascara[archivo] = (minimo is None or valor >= minimo) and (maximo is None or valor <= maximo)
+        return mascara
@@ -0,0 +1,309 @@
+"""Tipo de un archivo según su contenido (números mágicos).
+
+Los archivos recuperados pierden a menudo su extensión o se quedan con una
+que no dice nada (FOUND.000/FILE0001.CHK tras chkdsk). detectar_tipo mira los
+primeros bytes y devuelve la extensión del formato; DetectorTipos lo aplica a
+muchos archivos leyendo solo su cabecera, en un grupo de hilos acotado y con
+una caché persistente por (ruta, tamaño, mtime).
+"""
+import re
+import sqlite3
+from itertools import compress
+from nucleo import RegistroTallado, SIN_DIAGNOSTICO, TablaPersistente, en_paralelo
+
+# Bytes que se leen de cada archivo
+LECTURA = 4096
+
+# (expresión que debe coincidir al principio, extensión); la primera gana
+FIRMAS = (
+    (re.compile(rb'\xff\xd8\xff'), '.jpg'),
+    (re.compile(rb'\x89PNG\r\n\x1a\n'), '.png'),
+    (re.compile(rb'GIF8[79]a'), '.gif'),
+    (re.compile(rb'%PDF-'), '.pdf'),
+    (re.compile(rb'BM.{4}\x00\x00\x00\x00.{4}[\x0c\x28\x34\x38\x40\x6c\x7c]\x00\x00\x00', re.DOTALL), '.bmp'),
+    (re.compile(rb'II\*\x00|MM\x00\*'), '.tif'),
+    (re.compile(rb'8BPS'), '.psd'),
+    (re.compile(rb'RIFF.{4}WEBP', re.DOTALL), '.webp'),
+    (re.compile(rb'RIFF.{4}WAVE', re.DOTALL), '.wav'),
+    (re.compile(rb'RIFF.{4}AVI ', re.DOTALL), '.avi'),
+    (re.compile(rb'.{4}ftypqt  ', re.DOTALL), '.mov'),
+    (re.compile(rb'.{4}ftyp(heic|heix|hevc|mif1|msf1)', re.DOTALL), '.heic'),
+    (re.compile(rb'.{4}ftypM4A ', re.DOTALL), '.m4a'),
+    (re.compile(rb'.{4}ftyp3g', re.DOTALL), '.3gp'),
+    (re.compile(rb'.{4}ftyp', re.DOTALL), '.mp4'),
+    (re.compile(rb'\x1aE\xdf\xa3.{0,64}webm', re.DOTALL), '.webm'),
+    (re.compile(rb'\x1aE\xdf\xa3'), '.mkv'),
+    (re.compile(rb'0&\xb2u\x8ef\xcf\x11'), '.wmv'),
+    (re.compile(rb'FLV\x01'), '.flv'),
+    (re.compile(rb'ID3[\x02-\x04]'), '.mp3'),
+    (re.compile(rb'fLaC'), '.flac'),
+    (re.compile(rb'OggS'), '.ogg'),
+    (re.compile(rb'MThd\x00\x00\x00\x06'), '.mid'),
+    (re.compile(rb'Rar!\x1a\x07'), '.rar'),
+    (re.compile(rb"7z\xbc\xaf'\x1c"), '.7z'),
+    (re.compile(rb'\x1f\x8b\x08'), '.gz'),
+    (re.compile(rb'BZh[1-9]1AY&SY'), '.bz2'),
+    (re.compile(rb'\xfd7zXZ\x00'), '.xz'),
+    (re.compile(rb'SQLite format 3\x00'), '.sqlite'),
+    (re.compile(rb'\{\\rtf'), '.rtf'),
+    (re.compile(rb'%!PS'), '.ps'),
+    (re.compile(rb'wOFF'), '.woff'),
+    (re.compile(rb'wOF2'), '.woff2'),
+)
+
+# Extensiones que comparten formato: un .jpeg detectado como .jpg o un .docx
+# detectado como .zip se quedan como están
+FAMILIAS = (
+    {'.jpg', '.jpeg', '.jpe', '.jfif'},
+    {'.tif', '.tiff', '.dng', '.nef', '.cr2', '.arw', '.orf', '.rw2', '.pef'},
+    {'.zip', '.docx', '.docm', '.dotx', '.xlsx', '.xlsm', '.xltx', '.pptx', '.pptm', '.ppsx', '.potx', '.odt',
+     '.ods', '.odp', '.odg', '.epub', '.jar', '.apk', '.aar', '.ipa', '.xpi', '.cbz', '.whl', '.nupkg', '.kmz',
+     '.3mf', '.vsix', '.appx', '.msix', '.xps', '.oxps'},
+    {'.mp4', '.m4v', '.m4a', '.m4b', '.mov', '.3gp', '.3g2', '.heic', '.heif', '.avif', '.f4v'},
+    {'.mkv', '.webm', '.mka', '.mk3d'},
+    {'.ogg', '.oga', '.ogv', '.opus', '.spx'},
+    {'.wmv', '.wma', '.asf'},
+    {'.doc', '.dot', '.xls', '.xlt', '.ppt', '.pps', '.pot', '.msg', '.msi', '.vsd', '.pub'},
+    {'.exe', '.dll', '.sys', '.scr', '.ocx', '.cpl', '.efi', '.mui', '.com', '.drv'},
+    {'.gz', '.tgz', '.svgz'},
+    {'.bz2', '.tbz', '.tbz2'},
+    {'.xz', '.txz'},
+    {'.sqlite', '.sqlite3', '.db', '.db3', '.sdb'},
+    {'.html', '.htm', '.xhtml'},
+    {'.xml', '.svg', '.xsl', '.xaml', '.plist', '.kml', '.gpx', '.rss', '.config', '.csproj', '.resx'},
+    {'.mid', '.midi'},
+    {'.psd', '.psb'},
+    {'.mp3', '.mp2'},
+)
+_FAMILIA = {extension: numero for numero, familia in enumerate(FAMILIAS) for extension in familia}
+
+# Extensiones que no dicen nada del contenido
+GENERICAS = {'', '.chk', '.tmp', '.temp', '.dat', '.bin', '.bak', '.old', '.file', '.raw', '.recovered', '.part',
+             '.crdownload', '.download'}
+_NUMERICA = re.compile(r'^\.\d+$')
+
+# Formatos sin firma (sobre todo de texto) que no merece la pena leer
+SIN_FIRMA = {'.txt', '.csv', '.tsv', '.log', '.md', '.json', '.css', '.js', '.ts', '.py', '.c', '.h', '.cpp',
+             '.hpp', '.cs', '.java', '.go', '.rs', '.rb', '.php', '.pl', '.sh', '.bat', '.cmd', '.ps1', '.ini',
+             '.cfg', '.conf', '.yml', '.yaml', '.toml', '.sql', '.srt', '.vtt', '.tex', '.lnk', '.url', '.inf',
+             '.reg', '.properties', '.gitignore'}
+
+# Extensiones que se dan por buenas sin leer el archivo (salvo con todos=True)
+CONOCIDAS = SIN_FIRMA | set(_FAMILIA) | {extension for _, extension in FIRMAS} | {'.txt'}
+
+# Lo que da _tipo_texto: solo sustituye a una extensión genérica
+_TEXTO = {'.txt', '.xml', '.html', '.svg'}
+
+_NO_CONTROL = bytes(range(0x20, 0x100)) + b'\t\n\r\f\x1b'
+
+
+def es_generica(tipo):
+    return tipo in GENERICAS or bool(_NUMERICA.match(tipo))
+
+
+def misma_familia(tipo, otro):
+    return tipo == otro or (tipo in _FAMILIA and _FAMILIA.get(otro) == _FAMILIA[tipo])
+
+
+def _tipo_zip(cabecera):
+    """Distingue por los nombres de las primeras entradas los formatos basados en ZIP."""
+    if cabecera[30:38] == b'mimetype':
+        for mime, extension in ((b'application/vnd.oasis.opendocument.text', '.odt'),
+                                (b'application/vnd.oasis.opendocument.spreadsheet', '.ods'),
+                                (b'application/vnd.oasis.opendocument.presentation', '.odp'),
+                                (b'application/epub+zip', '.epub')):
+            if cabecera.startswith(mime, 38):
+                return extension
+    for nombre, extension in ((b'word/', '.docx'), (b'xl/', '.xlsx'), (b'ppt/', '.pptx'),
+                              (b'AndroidManifest.xml', '.apk'), (b'META-INF/MANIFEST.MF', '.jar')):
+        if _nombre_local(cabecera, nombre):
+            return extension
+    return '.zip'
+
+
+def _nombre_local(cabecera, nombre):
+    # El nombre de una entrada va 30 bytes después de su cabecera local
+    posicion = cabecera.find(b'PK\x03\x04')
+    while posicion >= 0:
+        if cabecera.startswith(nombre, posicion + 30):
+            return True
+        posicion = cabecera.find(b'PK\x03\x04', posicion + 4)
+    return False
+
+
+def _tipo_ole(cabecera):
+    """Documento de Office antiguo si su directorio cae dentro de la cabecera leída."""
+    for flujo, extension in (('WordDocument', '.doc'), ('Workbook', '.xls'), ('Book', '.xls'),
+                             ('PowerPoint Document', '.ppt'), ('__substg1.0_', '.msg')):
+        if flujo.encode('utf-16-le') in cabecera:
+            return extension
+    return None
+
+
+def _tipo_ejecutable(cabecera):
+    desplazamiento = int.from_bytes(cabecera[0x3c:0x40], 'little')
+    if cabecera[desplazamiento:desplazamiento + 4] != b'PE\x00\x00':
+        return None
+    caracteristicas = int.from_bytes(cabecera[desplazamiento + 22:desplazamiento + 24], 'little')
+    # IMAGE_FILE_DLL
+    return '.dll' if caracteristicas & 0x2000 else '.exe'
+
+
+def _tipo_texto(cabecera):
+    """'.html', '.svg', '.xml' o '.txt' si parece texto (sin NUL y casi sin controles)."""
+    if b'\x00' in cabecera or len(cabecera.translate(None, _NO_CONTROL)) * 100 > len(cabecera):
+        return None
+    inicio = cabecera.lstrip(b'\xef\xbb\xbf \t\r\n')[:512].lower()
+    if inicio.startswith((b'<!doctype html', b'<html')):
+        return '.html'
+    if inicio.startswith(b'<svg') or (inicio.startswith(b'<?xml') and b'<svg' in cabecera[:1024].lower()):
+        return '.svg'
+    if inicio.startswith(b'<?xml'):
+        return '.xml'
+    return '.txt'
+
+
+def detectar_tipo(cabecera):
+    """Extensión que corresponde a los primeros bytes de un archivo, o None."""
+    if not cabecera:
+        return None
+    for firma, extension in FIRMAS:
+        if firma.match(cabecera):
+            return extension
+    if cabecera.startswith(b'PK\x03\x04'):
+        return _tipo_zip(cabecera)
+    if cabecera.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return _tipo_ole(cabecera)
+    if cabecera.startswith(b'MZ'):
+        return _tipo_ejecutable(cabecera)
+    return _tipo_texto(cabecera)
+
+
+class CacheTipos(TablaPersistente):
+    """Caché persistente (SQLite) del tipo detectado de cada archivo.
+
+    La clave es la ruta y el resultado solo vale mientras el tamaño y el mtime
+    sean los mismos; '' guarda que no se reconoció el formato.
+    """
+    NOMBRE = 'tipos_contenido.sqlite'
+    TABLA = 'tipos'
+    COLUMNAS = 'ruta TEXT PRIMARY KEY, tamano INTEGER, mtime REAL, tipo TEXT'
+
+    def consultar(self, archivos):
+        """{ruta: tipo} de los (ruta, tamano, mtime) guardados que siguen valiendo."""
+        rutas = [ruta for ruta, _, _ in archivos]
+        filas = self._conexion().execute(
+            f"SELECT ruta, tamano, mtime, tipo FROM tipos WHERE ruta IN ({','.join('?' * len(rutas))})", rutas)
+        claves = {ruta: (tamano, mtime) for ruta, tamano, mtime in archivos}
+        return {ruta: tipo for ruta, tamano, mtime, tipo in filas if claves.get(ruta) == (tamano, mtime)}
+
+    def registrar(self, ruta, tamano, mtime, tipo):
+        self._anotar((ruta, tamano, mtime, tipo or ''))
+
+    def invalidar(self):
+        self._borrar()
+
+
+class DetectorTipos:
+    """Corrige el tipo (extensión) de los archivos según su contenido.
+
+    Solo se leen los candidatos: archivos con extensión genérica o vacía
+    (es_generica) o desconocida, salvo los formatos sin firma de SIN_FIRMA;
+    con todos=True, cualquiera. De cada uno se leen LECTURA bytes en lotes
+    de LOTE archivos repartidos en `hilos` hilos (en_paralelo). Un formato
+    reconocido sustituye al tipo si no es de su misma familia; que parezca
+    texto solo cuenta si la extensión era genérica.
+    """
+    LOTE = 64
+
+    def __init__(self, hilos=8, cache=None, todos=False, diagnostico=None):
+        self.hilos = hilos
+        self.cache = cache
+        self.todos = todos
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+
+    def candidato(self, tipo):
+        return self.todos or es_generica(tipo) or tipo not in CONOCIDAS
+
+    @staticmethod
+    def tipo_nuevo(tipo, detectado):
+        """Tipo que debe tener un archivo de tipo `tipo`, o None si se queda igual."""
+        if detectado is None or misma_familia(detectado, tipo):
+            return None
+        if detectado in _TEXTO and not es_generica(tipo):
+            return None
+        return detectado
+
+    def clasificar(self, almacen, cancelado=lambda: False, progreso=None):
+        """{archivo: tipo nuevo} de los archivos de un AlmacenResultados."""
+        n = len(almacen)
+        numeros = {i for i, tipo in enumerate(almacen.extensiones) if self.candidato(tipo)}
+        archivos = [archivo for archivo in compress(range(n), map(numeros.__contains__, almacen.tipos[:n]))
+                    if archivo not in almacen.tallados]
+        lotes = ([(archivo, almacen.ruta(archivo), almacen.tamanos[archivo], almacen.fechas[archivo],
+                   almacen.tipo(archivo)) for archivo in archivos[inicio:inicio + self.LOTE]]
+                 for inicio in range(0, len(archivos), self.LOTE))
+        cambios = {}
+        hechos = 0
+        with self.diagnostico.fase("tipos por contenido"):
+            for lote, resultado in en_paralelo(self._detectar_lote, lotes, self.hilos, cancelado):
+                cambios.update(resultado)
+                hechos += len(lote)
+                if progreso:
+                    progreso(hechos, len(archivos))
+        self._terminar(len(cambios))
+        return cambios
+
+    def corregir(self, lotes, cancelado=lambda: False):
+        """Generador que entrega cada lote de RegistroArchivo con el tipo ya corregido.
+
+        Los lotes mantienen su orden; se leen varios a la vez.
+        """
+        def corregir_lote(lote):
+            elementos = [(registro, registro.ruta, registro.tamano, registro.fecha, registro.tipo)
+                         for registro in lote if not isinstance(registro, RegistroTallado)
+                         and self.candidato(registro.tipo)]
+            cambios = self._detectar_lote(elementos) if elementos else []
+            for registro, tipo in cambios:
+                registro.tipo = tipo
+            return len(cambios)
+
+        corregidos = 0
+        try:
+            for lote, cambiados in en_paralelo(corregir_lote, lotes, self.hilos, cancelado):
+                corregidos += cambiados
+                yield lote
+        finally:
+            self._terminar(corregidos)
+
+    def _terminar(self, reclasificados):
+        self.diagnostico.contar('tipos.reclasificados', reclasificados)
+        if self.cache is not None:
+            self.cache.guardar()
+
+    def _detectar_lote(self, elementos):
+        """[(clave, tipo nuevo)] de los elementos (clave, ruta, tamano, mtime, tipo) que cambian."""
+        guardados = {}
+        if self.cache is not None:
+            try:
+                guardados = self.cache.consultar([(ruta, tamano, fecha) for _, ruta, tamano, fecha, _ in elementos])
+            except sqlite3.Error as e:
+                self.diagnostico.error('tipos.cache', e)
+            self.diagnostico.contar('tipos.cache_aciertos', len(guardados))
+        cambios = []
+        for clave, ruta, tamano, fecha, tipo in elementos:
+            detectado = guardados.get(ruta)
+            if detectado is None:
+                try:
+                    with open(ruta, 'rb') as f:
+                        detectado = detectar_tipo(f.read(LECTURA))
+                except OSError as e:
+                    self.diagnostico.error('tipos', e)
+                    continue
+                self.diagnostico.contar('tipos.leidos')
+                if self.cache is not None:
+                    self.cache.registrar(ruta, tamano, fecha, detectado)
+            nuevo = self.tipo_nuevo(tipo, detectado or None)
+            if nuevo is not None:
+                cambios.append((clave, nuevo))
+        return cambios
@@ -0,0 +1,410 @@
+"""Recuperación de archivos borrados en volúmenes FAT16, FAT32 y exFAT.
+
+Lee en crudo (solo lectura) una imagen o un dispositivo: sector de arranque,
+FAT y clústeres de directorio, y enumera las entradas de directorio marcadas
+como borradas. Al borrar, FAT16/32 cambia el primer byte del nombre por 0xE5 y
+libera la cadena de clústeres en la FAT, pero conserva el clúster inicial y
+el tamaño; exFAT solo desmarca el bit «en uso» de las entradas y del mapa de
+bits. Los datos se recuperan suponiendo el archivo contiguo (lo normal en
+tarjetas y memorias USB), salvo en exFAT si la cadena de la FAT sigue intacta.
+
+La FAT se carga en un array de enteros de C y el mapa de bits de exFAT como
+bytes: una tarjeta con millones de clústeres ocupa unos pocos MiB y nunca se
+crea un objeto Python por clúster. Los resultados son RegistroBorrado, que se
+muestran y exportan como cualquier otro archivo encontrado.
+"""
+import os
+import sys
+import time
+from array import array
+from nucleo import RegistroBorrado, ReportadorProgreso, SIN_DIAGNOSTICO
+from tallado import FuenteCruda
+
+BORRADO = 0xE5
+ATRIBUTO_LFN = 0x0F
+ATRIBUTO_ETIQUETA = 0x08
+ATRIBUTO_DIRECTORIO = 0x10
+# Tipos de partición MBR que pueden contener FAT16, FAT32 o exFAT
+TIPOS_MBR = {0x01, 0x04, 0x06, 0x07, 0x0B, 0x0C, 0x0E}
+BLOQUE_FAT = 4 << 20
+
+
+def _entero(datos, inicio, n):
+    return int.from_bytes(datos[inicio:inicio + n], 'little')
+
+
+def _fecha_dos(fecha, hora=0):
+    """Marca de tiempo local de una fecha y hora en formato DOS (0.0 si no es válida)."""
+    try:
+        return time.mktime(((fecha >> 9) + 1980, (fecha >> 5) & 0x0F, fecha & 0x1F,
+                             hora >> 11, (hora >> 5) & 0x3F, (hora & 0x1F) * 2, 0, 0, -1))
+    except (OverflowError, ValueError):
+        return 0.0
+
+
+def _suma_lfn(nombre_corto):
+    """Suma de control del nombre 8.3 que guardan sus entradas de nombre largo."""
+    suma = 0
+    for byte in nombre_corto:
+        suma = (((suma & 1) << 7) + (suma >> 1) + byte) & 0xFF
+    return suma
+
+
+def _texto_utf16(datos):
+    texto = bytes(datos).decode('utf-16-le', 'replace')
+    fin = texto.find('\0')
+    return texto if fin < 0 else texto[:fin]
+
+
+class VolumenFat:
+    """Geometría, FAT y mapa de bits de un volumen FAT16, FAT32 o exFAT.
+
+    base es el desplazamiento del volumen dentro de la fuente. Lanza
+    ValueError si ahí no hay un sector de arranque reconocible.
+    """
+
+    def __init__(self, fuente, base=0):
+        self.fuente = fuente
+        self.base = base
+        arranque = fuente.leer(base, 512)
+        if len(arranque) < 512 or arranque[510:512] != b'\x55\xaa':
+            raise ValueError("sin firma de sector de arranque")
+        self.mapa_bits = None
+        self.raiz_fija = None
+        if arranque[3:11] == b'EXFAT   ':
+            self._leer_exfat(arranque)
+        else:
+            self._leer_fat(arranque)
+
+    def _leer_exfat(self, arranque):
+        self.tipo = 'exFAT'
+        bytes_sector = 1 << arranque[108]
+        self.bytes_cluster = bytes_sector << arranque[109]
+        self.clusters = _entero(arranque, 92, 4)
+        self.inicio_datos = self.base + _entero(arranque, 88, 4) * bytes_sector
+        self.raiz = _entero(arranque, 96, 4)
+        if not 9 <= arranque[108] <= 12 or not self.clusters or self.bytes_cluster > 32 << 20:
+            raise ValueError("sector de arranque exFAT no válido")
+        self.fin_cadena = 0xFFFFFFF7
+        self.mascara = 0xFFFFFFFF
+        self.fat = self._cargar_fat(self.base + _entero(arranque, 80, 4) * bytes_sector, 'I')
+        # El mapa de bits de asignación es una entrada 0x81 del directorio raíz
+        for entrada in self._entradas(self.cadena(self.raiz)):
+            if entrada[0] == 0x81:
+                tramos = self.tramos_contiguos(_entero(entrada, 20, 4), _entero(entrada, 24, 8))
+                self.mapa_bits = b''.join(self.fuente.leer(inicio, n) for inicio, n in tramos)
+                break
+            if entrada[0] == 0x00:
+                break
+
+    def _leer_fat(self, arranque):
+        bytes_sector = _entero(arranque, 11, 2)
+        sectores_cluster = arranque[13]
+        reservados = _entero(arranque, 14, 2)
+        num_fats = arranque[16]
+        entradas_raiz = _entero(arranque, 17, 2)
+        sectores_fat = _entero(arranque, 22, 2) or _entero(arranque, 36, 4)
+        sectores_total = _entero(arranque, 19, 2) or _entero(arranque, 32, 4)
+        if (bytes_sector not in (512, 1024, 2048, 4096) or not sectores_cluster
+                or sectores_cluster & (sectores_cluster - 1) or not reservados or not num_fats or not sectores_fat):
+            raise ValueError("sector de arranque FAT no válido")
+        sectores_raiz = -(-entradas_raiz * 32 // bytes_sector)
+        inicio_fat = self.base + reservados * bytes_sector
+        primer_sector_datos = reservados + num_fats * sectores_fat + sectores_raiz
+        self.bytes_cluster = bytes_sector * sectores_cluster
+        self.clusters = (sectores_total - primer_sector_datos) // sectores_cluster
+        self.inicio_datos = self.base + primer_sector_datos * bytes_sector
+        if self.clusters < 4085:
+            raise ValueError("FAT12 no está soportado")
+        if self.clusters < 65525:
+            self.tipo = 'FAT16'
+            self.raiz = 0
+            self.raiz_fija = (inicio_fat + num_fats * sectores_fat * bytes_sector, entradas_raiz * 32)
+            self.fin_cadena = 0xFFF7
+            self.mascara = 0xFFFF
+            self.fat = self._cargar_fat(inicio_fat, 'H')
+        else:
+            self.tipo = 'FAT32'
+            self.raiz = _entero(arranque, 44, 4)
+            # Los 4 bits altos de cada entrada FAT32 están reservados
+            self.fin_cadena = 0x0FFFFFF7
+            self.mascara = 0x0FFFFFFF
+            self.fat = self._cargar_fat(inicio_fat, 'I')
+
+    def _cargar_fat(self, desplazamiento, tipo):
+        """La FAT entera en un array de C, leída en bloques grandes."""
+        fat = array(tipo)
+        tamano = (self.clusters + 2) * fat.itemsize
+        for inicio in range(0, tamano, BLOQUE_FAT):
+            datos = self.fuente.leer(desplazamiento + inicio, min(BLOQUE_FAT, tamano - inicio))
+            fat.frombytes(datos[:len(datos) - len(datos) % fat.itemsize])
+            if len(datos) < min(BLOQUE_FAT, tamano - inicio):
+                break
+        if sys.byteorder == 'big':
+            fat.byteswap()
+        return fat
+
+    def valido(self, cluster):
+        return 2 <= cluster < self.clusters + 2
+
+    def desplazamiento(self, cluster):
+        return self.inicio_datos + (cluster - 2) * self.bytes_cluster
+
+    def cadena(self, cluster, maximo=None):
+        """Tramos (desplazamiento, longitud) de la cadena de la FAT desde cluster.
+
+        Se detiene en el fin de cadena, en un valor fuera de rango o tras
+        maximo clústeres (por defecto, tantos como tiene el volumen, lo que
+        corta también los bucles de una FAT dañada).
+        """
+        maximo = self.clusters if maximo is None else maximo
+        tramos = []
+        inicio = anterior = None
+        contados = 0
+        while self.valido(cluster) and contados < maximo and cluster < len(self.fat):
+            if inicio is None or cluster != anterior + 1:
+                if inicio is not None:
+                    tramos.append((self.desplazamiento(inicio), (anterior - inicio + 1) * self.bytes_cluster))
+                inicio = cluster
+            anterior = cluster
+            contados += 1
+            siguiente = self.fat[cluster] & self.mascara
+            if siguiente >= self.fin_cadena:
+                break
+            cluster = siguiente
+        if inicio is not None:
+            tramos.append((self.desplazamiento(inicio), (anterior - inicio + 1) * self.bytes_cluster))
+        return tramos
+
+    def tramos_contiguos(self, cluster, tamano):
+        n = -(-tamano // self.bytes_cluster)
+        if not self.valido(cluster) or cluster + n > self.clusters + 2:
+            return []
+        return [(self.desplazamiento(cluster), tamano)]
+
+    def libres(self, cluster, n):
+        """True si ninguno de los n clústeres desde cluster está asignado."""
+        if self.mapa_bits is not None:
+            primero = cluster - 2
+            bits = int.from_bytes(self.mapa_bits[primero // 8:(primero + n + 7) // 8], 'little')
+            return (bits >> (primero % 8)) & ((1 << n) - 1) == 0
+        return not any(self.fat[cluster:cluster + n])
+
+    def _entradas(self, tramos):
+        """Entradas de 32 bytes de los tramos de un directorio (una lectura por tramo)."""
+        for inicio, longitud in tramos:
+            datos = memoryview(self.fuente.leer(inicio, longitud))
+            for posicion in range(0, len(datos) - 31, 32):
+                yield datos[posicion:posicion + 32]
+
+
+class LectorFat:
+    """Enumera los archivos borrados de los volúmenes FAT de una imagen o dispositivo.
+
+    Si la fuente empieza por una tabla de particiones MBR (un disco entero,
+    p. ej. /dev/sdb, en vez de /dev/sdb1) se recorren todas sus particiones
+    FAT. Se recorren las carpetas existentes y también las borradas cuyo
+    primer clúster sigue pareciendo un directorio.
+    """
+
+    def __init__(self, diagnostico=None):
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+
+    def volumenes(self, fuente):
+        """[(nombre, VolumenFat), ...] de la fuente; nombre es '' si no hay particiones."""
+        try:
+            return [('', VolumenFat(fuente))]
+        except ValueError:
+            pass
+        mbr = fuente.leer(0, 512)
+        volumenes = []
+        if len(mbr) == 512 and mbr[510:512] == b'\x55\xaa':
+            for numero in range(4):
+                entrada = mbr[446 + 16 * numero:462 + 16 * numero]
+                if entrada[4] in TIPOS_MBR and _entero(entrada, 8, 4):
+                    try:
+                        volumenes.append((f"particion{numero + 1}", VolumenFat(fuente, _entero(entrada, 8, 4) * 512)))
+                    except ValueError:
+                        continue
+        return volumenes
+
+    def borrados(self, ruta, cancelado=lambda: False, progreso=None):
+        """Generador de lotes de RegistroBorrado, uno por carpeta con hallazgos.
+
+        progreso(valor, mensaje) recibe el avance en la escala 0-100. Lanza
+        ValueError si la fuente no contiene ningún volumen FAT16/32 o exFAT.
+        """
+        progreso = progreso or (lambda valor, mensaje: None)
+        fuente = FuenteCruda(ruta, self.diagnostico)
+        try:
+            with self.diagnostico.fase("fat: volúmenes"):
+                volumenes = self.volumenes(fuente)
+            if not volumenes:
+                raise ValueError(f"{ruta} no contiene ningún volumen FAT16, FAT32 o exFAT")
+            reportador = ReportadorProgreso(None, None, inicio=0, fin=99, descripcion="Borrados")
+            with self.diagnostico.fase("fat: directorios"):
+                for nombre, volumen in volumenes:
+                    raiz_virtual = os.path.join(ruta + ".borrados", nombre) if nombre else ruta + ".borrados"
+                    for lote in self._recorrer(ruta, volumen, raiz_virtual, cancelado):
+                        yield lote
+                        estado = reportador.registrar(len(lote), sum(r.tamano for r in lote))
+                        if estado:
+                            progreso(*estado)
+        finally:
+            fuente.cerrar()
+
+    def _recorrer(self, ruta, volumen, raiz_virtual, cancelado):
+        if volumen.raiz_fija is not None:
+            pendientes = [([volumen.raiz_fija], raiz_virtual)]
+        else:
+            pendientes = [(volumen.cadena(volumen.raiz), raiz_virtual)]
+        visitados = {volumen.raiz}
+        analizar = self._directorio_exfat if volumen.tipo == 'exFAT' else self._directorio_fat
+        while pendientes and not cancelado():
+            tramos, carpeta = pendientes.pop()
+            self.diagnostico.contar('fat.directorios')
+            lote = []
+            for nombre, cluster, tamano, fecha, es_directorio, borrado, contiguo in analizar(volumen, tramos):
+                if es_directorio:
+                    if cluster in visitados or not volumen.valido(cluster):
+                        continue
+                    visitados.add(cluster)
+                    subtramos = self._tramos_directorio(volumen, cluster, tamano, borrado, contiguo)
+                    if subtramos:
+                        pendientes.append((subtramos, os.path.join(carpeta, nombre)))
+                elif borrado and tamano:
+                    registro = self._registro(ruta, volumen, os.path.join(carpeta, nombre), cluster, tamano,
+                                              fecha, contiguo)
+                    if registro is not None:
+                        lote.append(registro)
+            if lote:
+                self.diagnostico.contar('fat.borrados', len(lote))
+                self.diagnostico.contar('fat.sobrescritos', sum(1 for r in lote if not r.integro))
+                yield lote
+
+    def _tramos_directorio(self, volumen, cluster, tamano, borrado, contiguo):
+        if volumen.tipo == 'exFAT' and (contiguo or not volumen.fat[cluster]):
+            return volumen.tramos_contiguos(cluster, tamano)
+        if not borrado or volumen.fat[cluster]:
+            return volumen.cadena(cluster)
+        # Carpeta FAT borrada con la cadena liberada: su tamaño no se guarda,
+        # así que solo se lee el primer clúster si empieza por la entrada «.»
+        inicio = volumen.desplazamiento(cluster)
+        primera = volumen.fuente.leer(inicio, 32)
+        if len(primera) == 32 and primera[:11] == b'.          ' and primera[11] & ATRIBUTO_DIRECTORIO:
+            return [(inicio, volumen.bytes_cluster)]
+        return []
+
+    def _registro(self, ruta, volumen, ruta_virtual, cluster, tamano, fecha, contiguo):
+        n = -(-tamano // volumen.bytes_cluster)
+        tramos = None
+        if volumen.tipo == 'exFAT' and not contiguo and volumen.fat[cluster]:
+            # exFAT no borra la FAT al liberar: la cadena puede seguir ahí
+            tramos = self._recortar(volumen.cadena(cluster, n), tamano)
+            if sum(longitud for _, longitud in tramos) == tamano:
+                integro = all(volumen.libres(2 + (inicio - volumen.inicio_datos) // volumen.bytes_cluster,
+                                             -(-longitud // volumen.bytes_cluster)) for inicio, longitud in tramos)
+            else:
+                tramos = None
+        if tramos is None:
+            tramos = volumen.tramos_contiguos(cluster, tamano)
+            if not tramos:
+                return None
+            integro = volumen.libres(cluster, n)
+        return RegistroBorrado(ruta, ruta_virtual, tramos, tamano, fecha, integro)
+
+    @staticmethod
+    def _recortar(tramos, tamano):
+        recortados = []
+        for inicio, longitud in tramos:
+            if tamano <= 0:
+                break
+            recortados.append((inicio, min(longitud, tamano)))
+            tamano -= longitud
+        return recortados
+
+    def _directorio_fat(self, volumen, tramos):
+        """(nombre, clúster, tamaño, fecha, es_directorio, borrado, contiguo) de un directorio FAT16/32."""
+        largas = []
+        for entrada in volumen._entradas(tramos):
+            primero = entrada[0]
+            if primero == 0x00:
+                return
+            atributos = entrada[11]
+            if atributos == ATRIBUTO_LFN:
+                largas.append(entrada)
+                continue
+            partes, largas = largas, []
+            if atributos & ATRIBUTO_ETIQUETA or primero == 0x2E:
+                continue
+            borrado = primero == BORRADO
+            if borrado:
+                self.diagnostico.contar('fat.entradas_borradas')
+            nombre = self._nombre_fat(bytes(entrada[:11]), entrada[12], partes, borrado)
+            cluster = (_entero(entrada, 20, 2) << 16 if volumen.tipo == 'FAT32' else 0) | _entero(entrada, 26, 2)
+            yield (nombre, cluster, _entero(entrada, 28, 4), _fecha_dos(_entero(entrada, 24, 2), _entero(entrada, 22, 2)),
+                   bool(atributos & ATRIBUTO_DIRECTORIO), borrado, False)
+
+    @staticmethod
+    def _nombre_fat(corto, minusculas, largas, borrado):
+        """Nombre largo si sus entradas cuadran con el corto; si no, el 8.3.
+
+        En una entrada borrada se ha perdido el primer carácter del nombre
+        corto, pero la suma de control de las entradas largas permite
+        recuperarlo probando los 256 valores posibles.
+        """
+        suma = largas[0][13] if largas else None
+        if borrado and suma is not None:
+            for primero in range(0x20, 0x100):
+                if primero != BORRADO and _suma_lfn(bytes((primero,)) + corto[1:]) == suma:
+                    corto = bytes((primero,)) + corto[1:]
+                    break
+            else:
+                corto = b'_' + corto[1:]
+        elif borrado:
+            corto = b'_' + corto[1:]
+        if suma is not None and _suma_lfn(corto) == suma and all(parte[13] == suma for parte in largas):
+            texto = b''.join(bytes(p[1:11]) + bytes(p[14:26]) + bytes(p[28:32]) for p in reversed(largas))
+            nombre = _texto_utf16(texto).rstrip('\uffff')
+            if nombre:
+                return nombre
+        if corto[0] == 0x05:
+            corto = b'\xe5' + corto[1:]
+        base = corto[:8].decode('cp437').rstrip()
+        extension = corto[8:].decode('cp437').rstrip()
+        if minusculas & 0x08:
+            base = base.lower()
+        if minusculas & 0x10:
+            extension = extension.lower()
+        return f"{base}.{extension}" if extension else base
+
+    def _directorio_exfat(self, volumen, tramos):
+        """(nombre, clúster, tamaño, fecha, es_directorio, borrado, contiguo) de un directorio exFAT."""
+        entradas = list(volumen._entradas(tramos))
+        posicion = 0
+        while posicion < len(entradas):
+            entrada = entradas[posicion]
+            tipo = entrada[0]
+            if tipo == 0x00:
+                return
+            if tipo & 0x7F != 0x05:
+                posicion += 1
+                continue
+            secundarias = entrada[1]
+            conjunto = entradas[posicion + 1:posicion + 1 + secundarias]
+            borrado = not tipo & 0x80
+            # Un conjunto borrado solo vale si sus entradas siguen juntas y
+            # con el mismo estado (no reutilizadas por otro archivo)
+            if (len(conjunto) < 2 or conjunto[0][0] & 0x7F != 0x40
+                    or any(e[0] & 0x7F != 0x41 for e in conjunto[1:])
+                    or any(bool(e[0] & 0x80) == borrado for e in conjunto)):
+                posicion += 1
+                continue
+            posicion += 1 + secundarias
+            if borrado:
+                self.diagnostico.contar('fat.entradas_borradas')
+            flujo = conjunto[0]
+            nombre = _texto_utf16(b''.join(bytes(e[2:32]) for e in conjunto[1:]))[:flujo[3]]
+            marca = _entero(entrada, 12, 4)
+            yield (nombre, _entero(flujo, 20, 4), _entero(flujo, 24, 8), _fecha_dos(marca >> 16, marca & 0xFFFF),
+                   bool(_entero(entrada, 4, 2) & ATRIBUTO_DIRECTORIO), borrado, bool(flujo[1] & 0x02))
@@ -0,0 +1,2534 @@
+import os
+import sys
+import time
+import functools
+import sqlite3
+import hashlib
+import threading
+import psutil
+from array import array
+from collections import OrderedDict, deque
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
+                             QPushButton, QTreeView, QLabel, QComboBox,
+                             QProgressBar, QFileDialog, QMessageBox, QSplitter, QHeaderView,
+                             QSlider, QFrame, QSizePolicy, QCheckBox, QPlainTextEdit, QLineEdit)
+from PyQt5.QtCore import (Qt, QThread, QObject, pyqtSignal, QSize, QAbstractItemModel, QModelIndex, QTimer, QPoint,
+                          QBuffer, QByteArray, QIODevice, QPersistentModelIndex)
+from PyQt5.QtGui import QIcon, QPalette, QColor, QFontDatabase, QImage, QImageReader, QPixmap
+from nucleo import (AlmacenResultados, IndiceEscaneo, MotorEscaneo, ReportadorProgreso, BuscadorDuplicados,
+                    MotorExportacion, Diagnostico, PlanificadorEscaneo, PuntoControl, RegistroTallado, SIN_DIAGNOSTICO,
+                    escanear_unidad, formato_tamano, formato_fecha, ruta_datos_app)
+from tallado import MotorTallado
+from fat import LectorFat
+from busqueda import Consulta, IndiceBusqueda
+from deteccion import CacheTipos, DetectorTipos
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        base_path = sys._MEIPASS  # Para PyInstaller
+    except Exception:
+        base_path = os.path.dirname(os.path.abspath(__file__))  # Directorio donde está este script
+    return os.path.join(base_path, relative_path)
+
+
+class TrabajadorRecuperacion(QThread):
+    progreso_actualizado = pyqtSignal(int, str)
+    recuperacion_completada = pyqtSignal(list)
+    error_ocurrido = pyqtSignal(str)
+    # Modo streaming: lotes parciales y total al terminar
+    lote_encontrado = pyqtSignal(list)
+    escaneo_terminado = pyqtSignal(int)
+    # Una línea por destino cuando se escanea más de uno
+    desglose_actualizado = pyqtSignal(list)
+
+    def __init__(self, unidad, tipo_recuperacion, motor=None, streaming=False,
+                 tamano_lote=2000, intervalo_lote=0.25, indice=None, diagnostico=None, punto_control=None):
+        super().__init__()
+        # unidad puede ser una letra (str) o una lista de letras y rutas (list)
+        self.unidad = unidad
+        self.tipo_recuperacion = tipo_recuperacion
+        # Motor de escaneo intercambiable (por defecto scandir en paralelo,
+        # reutilizando el índice persistente si se indica)
+        self.motor = motor or MotorEscaneo(indice=indice, diagnostico=diagnostico)
+        self.diagnostico = diagnostico or self.motor.diagnostico
+        # Reparte los destinos por disco y lleva la cuenta de cada uno
+        self.planificador = PlanificadorEscaneo(self.motor)
+        # En modo streaming no se acumula la lista completa: se emiten lotes
+        # de como mucho tamano_lote archivos o cada intervalo_lote segundos.
+        self.streaming = streaming
+        self.tamano_lote = tamano_lote
+        self.intervalo_lote = intervalo_lote
+        # Diario para poder continuar el escaneo si se cancela o se cierra
+        self.punto_control = punto_control
+        self.cancelado = False
+        self.pausado = False
+
+    def run(self):
+        try:
+            archivos_recuperados = []
+            total = 0
+            ultimo_envio = time.monotonic()
+            for lote in escanear_unidad(self.unidad, self.motor, lambda: self.cancelado,
+                                        self.progreso_actualizado.emit, self.diagnostico,
+                                        punto_control=self.punto_control, pausado=lambda: self.pausado,
+                                        planificador=self.planificador):
+                archivos_recuperados.extend(lote)
+                total += len(lote)
+                if self.streaming:
+                    ahora = time.monotonic()
+                    if (len(archivos_recuperados) >= self.tamano_lote
+                            or ahora - ultimo_envio >= self.intervalo_lote):
+                        self._enviar_lotes(archivos_recuperados)
+                        self._enviar_desglose()
+                        archivos_recuperados = []
+                        ultimo_envio = ahora
+            self._enviar_desglose()
+            if self.cancelado:
+                return
+            if self.streaming:
+                self._enviar_lotes(archivos_recuperados)
+                self.escaneo_terminado.emit(total)
+            else:
+                self.recuperacion_completada.emit(archivos_recuperados)
+        except Exception as e:
+            self.error_ocurrido.emit(str(e))
+
+    def _enviar_lotes(self, archivos):
+        # Un directorio grande puede superar el tamaño de lote: se trocea
+        with self.diagnostico.fase("emitir lotes", "interfaz"):
+            for inicio in range(0, len(archivos), self.tamano_lote):
+                self.lote_encontrado.emit(archivos[inicio:inicio + self.tamano_lote])
+                self.diagnostico.contar('interfaz.lotes_emitidos')
+
+    def _enviar_desglose(self):
+        if len(self.planificador.destinos) > 1:
+            self.desglose_actualizado.emit(self.planificador.desglose())
+
+    def cancelar(self):
+        self.cancelado = True
+
+    def pausar(self, pausado=True):
+        self.pausado = pausado
+
+class TrabajadorCrudo(QThread):
+    progreso_actualizado = pyqtSignal(int, str)
+    lote_encontrado = pyqtSignal(list)
+    escaneo_terminado = pyqtSignal(int)
+    error_ocurrido = pyqtSignal(str)
+
+    def __init__(self, ruta, buscar, mensaje_inicio, mensaje_fin):
+        super().__init__()
+        # Imagen de disco o dispositivo en crudo (p. ej. /dev/sdb); buscar es
+        # MotorTallado.tallar o LectorFat.borrados
+        self.ruta = ruta
+        self.buscar = buscar
+        self.mensaje_inicio = mensaje_inicio
+        self.mensaje_fin = mensaje_fin
+        self.cancelado = False
+
+    def run(self):
+        try:
+            self.progreso_actualizado.emit(0, self.mensaje_inicio)
+            total = 0
+            for lote in self.buscar(self.ruta, lambda: self.cancelado, self.progreso_actualizado.emit):
+                total += len(lote)
+                self.lote_encontrado.emit(lote)
+            if self.cancelado:
+                return
+            self.progreso_actualizado.emit(100, self.mensaje_fin)
+            self.escaneo_terminado.emit(total)
+        except Exception as e:
+            self.error_ocurrido.emit(str(e))
+
+    def cancelar(self):
+        self.cancelado = True
+
+
+class TrabajadorDuplicados(QThread):
+    progreso_actualizado = pyqtSignal(int, str)
+    duplicados_encontrados = pyqtSignal(list)
+    error_ocurrido = pyqtSignal(str)
+
+    def __init__(self, rutas, tamanos, buscador=None, diagnostico=None):
+        super().__init__()
+        self.rutas = rutas
+        self.tamanos = tamanos
+        self.buscador = buscador or BuscadorDuplicados(diagnostico=diagnostico)
+        self.cancelado = False
+
+    def run(self):
+        try:
+            self.progreso_actualizado.emit(0, "Buscando duplicados...")
+            grupos = self.buscador.agrupar(self.rutas, self.tamanos, lambda: self.cancelado, self._progreso)
+            if self.cancelado:
+                return
+            self.progreso_actualizado.emit(100, f"Duplicados: {len(grupos)} grupos encontrados")
+            self.duplicados_encontrados.emit(grupos)
+        except Exception as e:
+            self.error_ocurrido.emit(str(e))
+
+    def _progreso(self, fase, hechos, total):
+        # Hash parcial en la primera mitad de la barra, completo en la segunda
+        base = 0 if fase == "parcial" else 50
+        self.progreso_actualizado.emit(base + int(50 * hechos / max(total, 1)),
+                                       f"Buscando duplicados ({fase}): {hechos}/{total}")
+
+    def cancelar(self):
+        self.cancelado = True
+
+
+class TrabajadorTipos(QThread):
+    progreso_actualizado = pyqtSignal(int, str)
+    tipos_detectados = pyqtSignal(dict)
+    error_ocurrido = pyqtSignal(str)
+
+    def __init__(self, almacen, detector):
+        super().__init__()
+        # Solo se leen los archivos ya añadidos: el almacén crece por el final
+        self.almacen = almacen
+        self.detector = detector
+        self.cancelado = False
+
+    def run(self):
+        try:
+            self.progreso_actualizado.emit(0, "Comprobando el tipo de los archivos por su contenido...")
+            cambios = self.detector.clasificar(self.almacen, lambda: self.cancelado, self._progreso)
+            if self.cancelado:
+                return
+            self.tipos_detectados.emit(cambios)
+        except Exception as e:
+            self.error_ocurrido.emit(str(e))
+
+    def _progreso(self, hechos, total):
+        self.progreso_actualizado.emit(int(100 * hechos / max(total, 1)),
+                                       f"Comprobando tipos por contenido: {hechos}/{total}")
+
+    def cancelar(self):
+        self.cancelado = True
+
+
+class TrabajadorExportacion(QThread):
+    progreso_actualizado = pyqtSignal(int, str)
+    exportacion_completada = pyqtSignal(object)
+    error_ocurrido = pyqtSignal(str)
+
+    def __init__(self, registros, carpeta_destino, motor=None, formato_archivo=None, comprimir=False):
+        super().__init__()
+        self.registros = registros
+        # Carpeta destino o, con formato_archivo ('zip'/'tar'), ruta del contenedor
+        self.carpeta_destino = carpeta_destino
+        self.motor = motor or MotorExportacion()
+        self.formato_archivo = formato_archivo
+        self.comprimir = comprimir
+        self.cancelado = False
+
+    def run(self):
+        try:
+            reportador = ReportadorProgreso(len(self.registros), sum(r.tamano for r in self.registros),
+                                            inicio=0, fin=99, descripcion="Exportados")
+
+            def progreso(archivos, bytes_):
+                estado = reportador.registrar(archivos, bytes_)
+                if estado:
+                    self.progreso_actualizado.emit(*estado)
+
+            if self.formato_archivo:
+                informe = self.motor.exportar_a_archivo(self.registros, self.carpeta_destino, self.formato_archivo,
+                                                        self.comprimir, lambda: self.cancelado, progreso)
+            else:
+                informe = self.motor.exportar(self.registros, self.carpeta_destino, lambda: self.cancelado, progreso)
+            self.progreso_actualizado.emit(100, reportador.estado()[1])
+            self.exportacion_completada.emit(informe)
+        except Exception as e:
+            self.error_ocurrido.emit(str(e))
+
+    def cancelar(self):
+        self.cancelado = True
+
+
+def calcular_orden(almacen, grupos, extensiones, claves, descendente, cancelado=lambda: False):
+    """[(contenedor, orden), ...] para listas [(nodo, copia de sus entradas), ...].
+
+    Primero se ordena cada grupo de duplicados; luego, en cada extensión, un
+    grupo (entrada negativa) ocupa el lugar de su primer archivo ya ordenado.
+    Devuelve None si se cancela.
+    """
+    resultado = []
+    primeros = []
+    for grupo, entradas in grupos:
+        orden = almacen.ordenar(entradas, claves, descendente, cancelado)
+        if orden is None:
+            return None
+        resultado.append((grupo, orden))
+        primeros.append(entradas[orden[0]])
+    for nodo_ext, entradas in extensiones:
+        archivos = [entrada if entrada >= 0 else primeros[~entrada] for entrada in entradas]
+        orden = almacen.ordenar(archivos, claves, descendente, cancelado)
+        if orden is None:
+            return None
+        resultado.append((nodo_ext, orden))
+    return resultado
+
+
+class TrabajadorOrden(QThread):
+    orden_calculado = pyqtSignal(object)
+
+    def __init__(self, almacen, grupos, extensiones, claves, descendente, ficha, parent=None):
+        super().__init__(parent)
+        # Copias de las entradas de cada nodo: el árbol puede seguir creciendo
+        self.almacen = almacen
+        self.grupos = grupos
+        self.extensiones = extensiones
+        self.claves = claves
+        self.descendente = descendente
+        self.ficha = ficha
+        self.cancelado = False
+
+    def run(self):
+        resultado = calcular_orden(self.almacen, self.grupos, self.extensiones, self.claves, self.descendente,
+                                   lambda: self.cancelado)
+        if resultado is not None:
+            self.orden_calculado.emit((self.ficha, resultado))
+
+    def cancelar(self):
+        self.cancelado = True
+
+
+def _filas_negativas(entradas):
+    """Posiciones de las entradas negativas (grupos) de un array('q')."""
+    # El byte más significativo de una entrada solo es 0xff si es negativa;
+    # find los busca sin recorrer en Python los archivos
+    signos = entradas.tobytes()[7::8] if sys.byteorder == 'little' else entradas.tobytes()[::8]
+    fila = signos.find(b'\xff')
+    while fila >= 0:
+        yield fila
+        fila = signos.find(b'\xff', fila + 1)
+
+
+def decodificar_miniatura(registro, lado, max_bytes=16 << 20):
+    """QImage de como mucho lado x lado píxeles, o una QImage nula si no se puede leer.
+
+    QImageReader decodifica ya reducida (los JPEG, a 1/2, 1/4 u 1/8 sin pasar
+    por el tamaño completo). Los archivos tallados o borrados se leen enteros
+    en memoria con registro.abrir(), así que solo si no pasan de max_bytes.
+    """
+    bufer = None
+    if isinstance(registro, RegistroTallado):
+        if registro.tamano > max_bytes:
+            return QImage()
+        with registro.abrir() as fuente:
+            bufer = QBuffer()
+            bufer.setData(QByteArray(fuente.read(registro.tamano)))
+        bufer.open(QIODevice.ReadOnly)
+        lector = QImageReader(bufer)
+    else:
+        lector = QImageReader(registro.ruta)
+    lector.setAutoTransform(True)
+    tamano = lector.size()
+    if tamano.isValid() and (tamano.width() > lado or tamano.height() > lado):
+        lector.setScaledSize(tamano.scaled(lado, lado, Qt.KeepAspectRatio))
+    imagen = lector.read()
+    # Con la rotación EXIF el tamaño reducido puede no cuadrar
+    if not imagen.isNull() and (imagen.width() > lado or imagen.height() > lado):
+        imagen = imagen.scaled(lado, lado, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return imagen
+
+
+class CacheMiniaturas:
+    """Miniaturas ya decodificadas: un LRU en memoria limitado en bytes y, si hay carpeta, una copia en disco.
+
+    La clave es (ruta, tamaño, fecha, lado), así que un archivo modificado no
+    encuentra la miniatura vieja. La parte en memoria guarda QPixmap y solo
+    se usa desde el hilo de la interfaz; la de disco (un JPEG, o PNG si hay
+    transparencia, con el sha1 de la clave por nombre) la usan los hilos del
+    generador. Una imagen que no se pudo leer se guarda como QPixmap nulo
+    para no volver a intentarlo.
+    """
+    COSTE_FALLIDA = 64
+
+    def __init__(self, max_bytes=64 << 20, carpeta=None):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._imagenes = OrderedDict()
+        self.carpeta = carpeta
+        if carpeta is not None:
+            os.makedirs(carpeta, exist_ok=True)
+
+    def __contains__(self, clave):
+        return clave in self._imagenes
+
+    def __len__(self):
+        return len(self._imagenes)
+
+    def obtener(self, clave):
+        """QPixmap de la clave (nulo si no se pudo leer) o None si no está."""
+        pixmap = self._imagenes.get(clave)
+        if pixmap is not None:
+            self._imagenes.move_to_end(clave)
+        return pixmap
+
+    def guardar(self, clave, imagen):
+        pixmap = QPixmap.fromImage(imagen) if not imagen.isNull() else QPixmap()
+        anterior = self._imagenes.pop(clave, None)
+        if anterior is not None:
+            self.bytes -= self._coste(anterior)
+        self._imagenes[clave] = pixmap
+        self.bytes += self._coste(pixmap)
+        while self.bytes > self.max_bytes and len(self._imagenes) > 1:
+            _, expulsada = self._imagenes.popitem(last=False)
+            self.bytes -= self._coste(expulsada)
+        return pixmap
+
+    def vaciar(self):
+        self._imagenes.clear()
+        self.bytes = 0
+
+    def _coste(self, pixmap):
+        if pixmap.isNull():
+            return self.COSTE_FALLIDA
+        return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+    def _archivo(self, clave):
+        return os.path.join(self.carpeta, hashlib.sha1(repr(clave).encode('utf-8', 'surrogatepass')).hexdigest())
+
+    def leer_disco(self, clave):
+        """QImage guardada en disco o None (también sin carpeta)."""
+        if self.carpeta is None:
+            return None
+        imagen = QImage(self._archivo(clave))
+        return None if imagen.isNull() else imagen
+
+    def escribir_disco(self, clave, imagen):
+        if self.carpeta is None or imagen.isNull():
+            return
+        ruta = self._archivo(clave)
+        # Se escribe aparte y se renombra: otro hilo puede estar leyéndola
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        if imagen.save(temporal, 'PNG' if imagen.hasAlphaChannel() else 'JPG', 85):
+            try:
+                os.replace(temporal, ruta)
+            except OSError:
+                pass
+        else:
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+
+    def podar_disco(self, max_bytes=256 << 20):
+        """Borra las miniaturas en disco menos usadas hasta quedar por debajo de max_bytes."""
+        if self.carpeta is None:
+            return
+        archivos = []
+        try:
+            with os.scandir(self.carpeta) as entradas:
+                for entrada in entradas:
+                    try:
+                        datos = entrada.stat()
+                    except OSError:
+                        continue
+                    archivos.append((datos.st_atime, datos.st_size, entrada.path))
+        except OSError:
+            return
+        total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, ruta in sorted(archivos):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(ruta)
+                total -= tamano
+            except OSError:
+                pass
+
+
+class GeneradorMiniaturas(QObject):
+    """Decodifica miniaturas en unos pocos hilos, siempre las pedidas más recientemente.
+
+    pedir() sustituye la cola de pendientes: lo que ya no está a la vista se
+    descarta sin leerlo. Las decodificaciones en curso terminan y su
+    resultado llega igualmente (la caché lo aprovecha). Los resultados se
+    emiten con miniatura_lista, que se recibe en el hilo de la interfaz. Un
+    archivo que falla al leerse da una miniatura nula y se cuenta como error
+    en diagnostico.
+    """
+    miniatura_lista = pyqtSignal(object, QImage)
+
+    def __init__(self, cache, hilos=2, diagnostico=None, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+        self._condicion = threading.Condition()
+        self._pendientes = deque()
+        self._en_curso = set()
+        self._detenido = False
+        self._hilos = [threading.Thread(target=self._trabajar, daemon=True, name=f"miniaturas-{i}")
+                       for i in range(hilos)]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def pedir(self, peticiones):
+        """peticiones: lista de (clave, registro), la primera la más urgente; clave[3] es el lado."""
+        with self._condicion:
+            self._pendientes = deque((clave, registro) for clave, registro in peticiones
+                                     if clave not in self.cache and clave not in self._en_curso)
+            if self._pendientes:
+                self._condicion.notify_all()
+
+    def pendientes(self):
+        with self._condicion:
+            return len(self._pendientes) + len(self._en_curso)
+
+    def detener(self):
+        with self._condicion:
+            self._detenido = True
+            self._pendientes.clear()
+            self._condicion.notify_all()
+
+    def _trabajar(self):
+        while True:
+            with self._condicion:
+                while not self._pendientes and not self._detenido:
+                    self._condicion.wait()
+                if self._detenido:
+                    return
+                clave, registro = self._pendientes.popleft()
+                self._en_curso.add(clave)
+            try:
+                imagen = self.cache.leer_disco(clave)
+                if imagen is None:
+                    imagen = decodificar_miniatura(registro, clave[3])
+                    self.cache.escribir_disco(clave, imagen)
+            except Exception as e:
+                # Un archivo dañado no puede dejar el hilo fuera del grupo
+                self.diagnostico.error('miniaturas', e)
+                imagen = QImage()
+            finally:
+                with self._condicion:
+                    self._en_curso.discard(clave)
+            if not self._detenido:
+                self.miniatura_lista.emit(clave, imagen)
+
+
+class _Nodo:
+    """Nodo agrupador del modelo: raíz, extensión o grupo de duplicados.
+
+    Las hojas (archivos) no tienen nodo propio: son enteros en `todos` que
+    indexan las columnas del modelo. En un nodo de extensión una entrada
+    negativa `~i` apunta al grupo de duplicados i. `hijos` son las entradas
+    que se ven (las filas); sin filtro es la misma lista que `todos`. `total`
+    y `marcados` cuentan todos los archivos del subárbol y cuántos están
+    marcados; `visibles`, los que pasan el filtro.
+    """
+    __slots__ = ('padre', 'fila', 'nivel', 'clave', 'todos', 'hijos', 'cargados', 'total', 'marcados', 'visibles')
+
+    def __init__(self, padre, fila, nivel, clave):
+        self.padre = padre
+        self.fila = fila
+        self.nivel = nivel
+        self.clave = clave
+        self.todos = [] if nivel == 0 else array('q')
+        self.hijos = self.todos
+        self.cargados = 0
+        self.total = 0
+        self.marcados = 0
+        self.visibles = 0
+
+
+class ModeloArchivos(QAbstractItemModel):
+    """Modelo extensión → duplicados → archivo con datos en columnas compactas.
+
+    Las filas de cada extensión se crean bajo demanda (canFetchMore/fetchMore)
+    y los textos solo se formatean cuando la vista los pide. Al ordenar se
+    reordenan los arrays de índices de cada grupo según los valores numéricos
+    del almacén (ROL_ORDEN los expone a la vista), en otro hilo si son muchos.
+    Un filtro (busqueda.Consulta) deja en cada nodo solo las entradas que lo
+    cumplen; las marcas de los archivos ocultos se conservan. Se aplica por
+    pasos desde el bucle de eventos (ver filtrar_por_pasos).
+    """
+    COLUMNAS = ['Archivo', 'Tamaño', 'Fecha Modificación', 'Estado', 'Ruta']
+    PASO_CARGA = 1000
+    # Filtro por pasos: duración de cada paso, coincidencias por extensión que
+    # se buscan una a una antes de tener la máscara y entradas por trozo
+    TIEMPO_PASO_FILTRO = 0.02
+    PRIMERAS_FILAS = 100
+    TROZO_FILTRO = 1 << 15
+    ROL_ORDEN = Qt.UserRole + 1
+    # Claves por columna; la extensión, que agrupa, es siempre la primera
+    CLAVES_ORDEN = {0: ('nombre', 'tamano', 'fecha'), 1: ('tamano', 'fecha'), 2: ('fecha', 'tamano'),
+                    3: ('estado', 'nombre'), 4: ('ruta',)}
+    UMBRAL_ORDEN_FONDO = 50000
+    # Número total de archivos marcados tras cada cambio de checkbox
+    marcados_cambiados = pyqtSignal(int)
+    # Archivos visibles cuando el filtro queda aplicado del todo
+    filtro_aplicado = pyqtSignal(int)
+
+    def __init__(self, obtener_icono, parent=None):
+        super().__init__(parent)
+        self.obtener_icono = obtener_icono
+        # Miniatura ya decodificada de un archivo (QIcon) o None; el icono de
+        # su tipo sirve mientras tanto
+        self.obtener_miniatura = lambda archivo: None
+        # La vista puede pedir fetchMore mientras se notifica una inserción
+        self._insertando = False
+        # Orden actual (columna, Qt.SortOrder) y último orden pedido; la
+        # generación cambia cuando se rehace el árbol y anula los pendientes
+        self._orden = None
+        self._ficha_orden = 0
+        self._generacion = 0
+        self._trabajador_orden = None
+        # El filtro se mantiene entre escaneos; la máscara (1 = visible) es
+        # None sin filtro. _filtrado son los pasos pendientes del filtro
+        # (_pasos_filtro), que sigue con el temporizador
+        self._consulta = None
+        self._filtrado = None
+        self._reiniciando = False
+        self._temporizador_filtro = QTimer(self)
+        self._temporizador_filtro.setSingleShot(True)
+        self._temporizador_filtro.setInterval(0)
+        self._temporizador_filtro.timeout.connect(self._seguir_filtrando)
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._generacion += 1
+        self._filtrado = None
+        self._raiz = _Nodo(None, 0, 0, None)
+        self._por_ext = {}
+        self._duplicados = []
+        # Datos de cada archivo; aquí solo se añade su marca
+        self.almacen = AlmacenResultados()
+        self.marcados = bytearray()
+        self.indice = IndiceBusqueda(self.almacen)
+        self._mascara = None if self._consulta is None else bytearray()
+        if self._mascara is not None:
+            self._raiz.hijos = []
+
+    def limpiar(self):
+        self.beginResetModel()
+        self._reiniciar()
+        self.endResetModel()
+        self.marcados_cambiados.emit(0)
+
+    def total_marcados(self):
+        return self._raiz.marcados
+
+    def total_visibles(self):
+        if self._consulta is None:
+            return self._raiz.total
+        return sum(nodo_ext.visibles for nodo_ext in self._raiz.hijos)
+
+    # --- Navegación -----------------------------------------------------
+    def _nodo(self, indice):
+        """Nodo representado por el índice, o None si es una hoja."""
+        if not indice.isValid():
+            return self._raiz
+        contenedor = indice.internalPointer()
+        entrada = contenedor.hijos[indice.row()]
+        if contenedor.nivel == 0:
+            return entrada
+        if contenedor.nivel == 1 and entrada < 0:
+            return self._duplicados[~entrada]
+        return None
+
+    def _indice_nodo(self, nodo):
+        if nodo.nivel == 0:
+            return QModelIndex()
+        return self.createIndex(nodo.fila, 0, nodo.padre)
+
+    def _archivos_de(self, nodo, visibles=False):
+        """Archivos del subárbol de nodo; con visibles=True, solo los que se ven."""
+        if nodo.nivel == 0:
+            for nodo_ext in (nodo.hijos if visibles else nodo.todos):
+                yield from self._archivos_de(nodo_ext, visibles)
+        elif nodo.nivel == 1:
+            for entrada in (nodo.hijos if visibles else nodo.todos):
+                if entrada < 0:
+                    grupo = self._duplicados[~entrada]
+                    yield from (grupo.hijos if visibles else grupo.todos)
+                else:
+                    yield entrada
+        else:
+            yield from (nodo.hijos if visibles else nodo.todos)
+
+    def index(self, fila, columna, padre=QModelIndex()):
+        nodo = self._nodo(padre)
+        if nodo is None or not (0 <= fila < nodo.cargados) or not (0 <= columna < len(self.COLUMNAS)):
+            return QModelIndex()
+        return self.createIndex(fila, columna, nodo)
+
+    def parent(self, indice):
+        if not indice.isValid():
+            return QModelIndex()
+        return self._indice_nodo(indice.internalPointer())
+
+    def rowCount(self, padre=QModelIndex()):
+        if padre.column() > 0:
+            return 0
+        nodo = self._nodo(padre)
+        return nodo.cargados if nodo is not None else 0
+
+    def columnCount(self, padre=QModelIndex()):
+        return len(self.COLUMNAS)
+
+    def hasChildren(self, padre=QModelIndex()):
+        if padre.column() > 0:
+            return False
+        nodo = self._nodo(padre)
+        return nodo is not None and len(nodo.hijos) > 0
+
+    def canFetchMore(self, padre):
+        # Solo la columna 0 tiene hijos
+        if self._insertando or padre.column() > 0:
+            return False
+        nodo = self._nodo(padre)
+        return nodo is not None and nodo.cargados < len(nodo.hijos)
+
+    def fetchMore(self, padre):
+        nodo = self._nodo(padre)
+        if nodo is None or self._insertando or padre.column() > 0:
+            return
+        self._cargar_filas(nodo, padre, min(len(nodo.hijos), nodo.cargados + self.PASO_CARGA))
+
+    def _cargar_filas(self, nodo, indice, hasta):
+        if hasta <= nodo.cargados:
+            return
+        self._insertando = True
+        try:
+            self.beginInsertRows(indice, nodo.cargados, hasta - 1)
+            nodo.cargados = hasta
+            self.endInsertRows()
+        finally:
+            self._insertando = False
+
+    # --- Datos ----------------------------------------------------------
+    def headerData(self, seccion, orientacion, rol=Qt.DisplayRole):
+        if orientacion == Qt.Horizontal and rol == Qt.DisplayRole:
+            return self.COLUMNAS[seccion]
+        return None
+
+    def flags(self, indice):
+        if not indice.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def data(self, indice, rol=Qt.DisplayRole):
+        if not indice.isValid():
+            return None
+        contenedor = indice.internalPointer()
+        nodo = self._nodo(indice)
+        columna = indice.column()
+        if nodo is not None:
+            if columna != 0:
+                return None
+            if rol == Qt.DisplayRole:
+                if nodo.nivel == 1:
+                    if self._consulta is None:
+                        cuantos = nodo.total
+                    else:
+                        # Mientras se aplica el filtro la cuenta aún crece
+                        cuantos = f"{nodo.visibles}{'…' if self._filtrado is not None else ''} de {nodo.total}"
+                    return f"{nodo.clave[1:].upper() if nodo.clave else 'SIN_EXT'} files ({cuantos})"
+                return f"{nodo.clave} (Duplicado x{nodo.total})"
+            if rol == Qt.DecorationRole:
+                return self.obtener_icono(nodo.clave if nodo.nivel == 1 else nodo.padre.clave)
+            if rol == Qt.CheckStateRole:
+                return self._estado_grupo(nodo)
+            if rol in (Qt.UserRole, self.ROL_ORDEN) and nodo.nivel == 1:
+                return nodo.clave
+            return None
+
+        archivo = contenedor.hijos[indice.row()]
+        if rol == Qt.DisplayRole:
+            almacen = self.almacen
+            if columna == 0:
+                return almacen.nombre(archivo)
+            if columna in (1, 2):
+                if columna == 1:
+                    return GestorArchivos.formato_tamano(almacen.tamanos[archivo])
+                return GestorArchivos.formato_fecha(almacen.fechas[archivo])
+            if columna == 3:
+                if archivo in almacen.tallados:
+                    return almacen.tallados[archivo].estado
+                return "Duplicado" if contenedor.nivel == 2 else "Backup"
+            return almacen.ruta(archivo)
+        if rol == self.ROL_ORDEN:
+            if columna == 1:
+                return self.almacen.tamanos[archivo]
+            if columna == 2:
+                return self.almacen.fechas[archivo]
+            if columna == 0:
+                return self.almacen.nombre(archivo).casefold()
+            return self.data(indice, Qt.DisplayRole)
+        if columna != 0:
+            return None
+        if rol == Qt.DecorationRole:
+            return (self.obtener_miniatura(archivo)
+                    or self.obtener_icono(contenedor.clave if contenedor.nivel == 1 else contenedor.padre.clave))
+        if rol == Qt.CheckStateRole:
+            return Qt.Checked if self.marcados[archivo] else Qt.Unchecked
+        if rol == Qt.UserRole:
+            return self.almacen.ruta(archivo)
+        return None
+
+    def registro(self, archivo):
+        return self.almacen.registro(archivo)
+
+    def archivo(self, indice):
+        """Número del archivo de la fila, o None si es un nodo agrupador."""
+        if not indice.isValid() or self._nodo(indice) is not None:
+            return None
+        return indice.internalPointer().hijos[indice.row()]
+
+    @staticmethod
+    def _estado_grupo(nodo):
+        if nodo.marcados == 0:
+            return Qt.Unchecked
+        return Qt.Checked if nodo.marcados == nodo.total else Qt.PartiallyChecked
+
+    def setData(self, indice, valor, rol=Qt.EditRole):
+        if rol != Qt.CheckStateRole or not indice.isValid():
+            return False
+        marca = 1 if valor == Qt.Checked else 0
+        nodo = self._nodo(indice)
+        if nodo is not None and self._filtrado is not None:
+            # Un grupo se marca con todos sus archivos visibles: hay que
+            # terminar el filtro, que puede insertar filas antes que él
+            persistente = QPersistentModelIndex(indice)
+            self.completar_filtro()
+            indice = QModelIndex(persistente)
+        if nodo is None:
+            contenedor = indice.internalPointer()
+            archivo = contenedor.hijos[indice.row()]
+            delta = marca - self.marcados[archivo]
+            self.marcados[archivo] = marca
+        else:
+            contenedor = nodo.padre
+            antes = nodo.marcados
+            self._fijar_marca(nodo, marca)
+            delta = nodo.marcados - antes
+            self._notificar_descendientes(nodo, indice)
+        if delta:
+            while contenedor is not None:
+                contenedor.marcados += delta
+                contenedor = contenedor.padre
+        # El propio índice y sus ancestros
+        while indice.isValid():
+            self.dataChanged.emit(indice, indice, [Qt.CheckStateRole])
+            indice = indice.parent()
+        self.marcados_cambiados.emit(self._raiz.marcados)
+        return True
+
+    def _fijar_marca(self, nodo, marca):
+        """Marca o desmarca el subárbol de nodo actualizando los contadores.
+
+        La raíz (marcar todo) abarca todos los archivos; un grupo, con un
+        filtro activo, solo los que se ven.
+        """
+        if nodo.nivel == 0:
+            self.marcados[:] = bytes([marca]) * len(self.marcados)
+            grupos = list(nodo.todos) + self._duplicados
+        elif self._mascara is not None:
+            for archivo in self._archivos_de(nodo, visibles=True):
+                self.marcados[archivo] = marca
+            self._recontar([nodo] if nodo.nivel == 1 else [], [nodo] if nodo.nivel == 2 else None)
+            return
+        else:
+            for archivo in self._archivos_de(nodo):
+                self.marcados[archivo] = marca
+            grupos = [self._duplicados[~e] for e in nodo.todos if e < 0] if nodo.nivel == 1 else []
+        for grupo in grupos:
+            grupo.marcados = grupo.total * marca
+        nodo.marcados = nodo.total * marca
+
+    def _recontar(self, extensiones, grupos=None):
+        """Recuenta los marcados de esas extensiones y de sus grupos (o de grupos)."""
+        marcado = self.marcados.__getitem__
+        extensiones = set(extensiones)
+        if grupos is None:
+            grupos = [grupo for grupo in self._duplicados if grupo.padre in extensiones]
+        for grupo in grupos:
+            grupo.marcados = sum(map(marcado, grupo.todos))
+        for nodo_ext in extensiones:
+            nodo_ext.marcados = sum(map(marcado, filter((-1).__lt__, nodo_ext.todos)))
+        for grupo in grupos:
+            if grupo.padre in extensiones:
+                grupo.padre.marcados += grupo.marcados
+
+    def _notificar_descendientes(self, nodo, indice):
+        if not nodo.cargados:
+            return
+        self.dataChanged.emit(self.index(0, 0, indice), self.index(nodo.cargados - 1, 0, indice), [Qt.CheckStateRole])
+        if nodo.nivel == 2:
+            return
+        for fila in range(nodo.cargados):
+            hijo = nodo.hijos[fila]
+            if nodo.nivel == 1:
+                if hijo >= 0:
+                    continue
+                hijo = self._duplicados[~hijo]
+            self._notificar_descendientes(hijo, self.index(fila, 0, indice))
+
+    def marcar_todo(self, marcar=True):
+        self._fijar_marca(self._raiz, 1 if marcar else 0)
+        self._notificar_descendientes(self._raiz, QModelIndex())
+        self.marcados_cambiados.emit(self._raiz.marcados)
+
+    def marcar_coincidentes(self, marcar=True):
+        """Marca (o desmarca) de una vez todos los archivos que cumplen el filtro."""
+        self.completar_filtro()
+        if self._mascara is None:
+            self.marcar_todo(marcar)
+            return
+        # Las dos máscaras son bytes 0/1: se combinan como enteros
+        marcados = int.from_bytes(self.marcados, 'little')
+        mascara = int.from_bytes(self._mascara, 'little')
+        marcados = marcados | mascara if marcar else marcados & ~mascara
+        self.marcados[:] = marcados.to_bytes(len(self.marcados), 'little')
+        raiz = self._raiz
+        self._recontar(raiz.todos)
+        raiz.marcados = sum(nodo_ext.marcados for nodo_ext in raiz.todos)
+        self._notificar_descendientes(raiz, QModelIndex())
+        self.marcados_cambiados.emit(raiz.marcados)
+
+    def coincidentes_marcados(self):
+        """True si todos los archivos que cumplen el filtro están marcados."""
+        self.completar_filtro()
+        if self._mascara is None:
+            return self._raiz.marcados == self._raiz.total
+        return not int.from_bytes(self._mascara, 'little') & ~int.from_bytes(self.marcados, 'little')
+
+    def rutas_marcadas(self):
+        return [self.almacen.ruta(archivo) for archivo in self._archivos_marcados()]
+
+    def registros_marcados(self):
+        return [self.registro(archivo) for archivo in self._archivos_marcados()]
+
+    def _archivos_marcados(self):
+        # Los contadores permiten saltar grupos vacíos y copiar enteros los completos
+        archivos = []
+        pendientes = [self._raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo.marcados == 0:
+                continue
+            if nodo.marcados == nodo.total:
+                archivos.extend(self._archivos_de(nodo))
+            elif nodo.nivel == 0:
+                pendientes.extend(reversed(nodo.todos))
+            elif nodo.nivel == 1:
+                for entrada in nodo.todos:
+                    if entrada < 0:
+                        grupo = self._duplicados[~entrada]
+                        if grupo.marcados:
+                            archivos.extend(archivo for archivo in grupo.todos if self.marcados[archivo])
+                    elif self.marcados[entrada]:
+                        archivos.append(entrada)
+            else:
+                archivos.extend(archivo for archivo in nodo.todos if self.marcados[archivo])
+        return archivos
+
+    # --- Orden ----------------------------------------------------------
+    def sort(self, columna, orden=Qt.AscendingOrder):
+        if columna not in self.CLAVES_ORDEN:
+            self._orden = None
+            return
+        self._orden = (columna, orden)
+        self._ficha_orden += 1
+        if self._trabajador_orden is not None:
+            self._trabajador_orden.cancelar()
+            self._trabajador_orden = None
+        grupos = [(grupo, array('q', grupo.todos)) for grupo in self._duplicados]
+        extensiones = [(nodo, array('q', nodo.todos)) for nodo in self._raiz.todos]
+        claves = self.CLAVES_ORDEN[columna]
+        descendente = orden == Qt.DescendingOrder
+        ficha = (self._ficha_orden, self._generacion, columna, descendente)
+        if sum(len(nodo.todos) for nodo in self._raiz.todos) < self.UMBRAL_ORDEN_FONDO:
+            self._aplicar_orden((ficha, calcular_orden(self.almacen, grupos, extensiones, claves, descendente)))
+            return
+        trabajador = TrabajadorOrden(self.almacen, grupos, extensiones, claves, descendente, ficha, self)
+        trabajador.orden_calculado.connect(self._aplicar_orden)
+        trabajador.finished.connect(trabajador.deleteLater)
+        self._trabajador_orden = trabajador
+        trabajador.start()
+
+    def reordenar(self):
+        """Vuelve a aplicar el orden actual (p. ej. tras anexar más archivos)."""
+        if self._orden is not None:
+            self.sort(*self._orden)
+
+    def _aplicar_orden(self, resultado):
+        (ficha_orden, generacion, columna, descendente), permutaciones = resultado
+        if ficha_orden != self._ficha_orden or generacion != self._generacion:
+            return
+        self._trabajador_orden = None
+        if columna == 0:
+            claves = [nodo.clave for nodo in self._raiz.todos]
+            permutaciones.append((self._raiz, sorted(range(len(claves)), key=claves.__getitem__,
+                                                     reverse=descendente)))
+        if self._consulta is not None:
+            # Con filtro, las filas visibles se rehacen desde cero
+            self.completar_filtro()
+            self.beginResetModel()
+            for contenedor, orden in permutaciones:
+                self._permutar(contenedor, orden)
+            self._aplicar_filtro()
+            self.endResetModel()
+            return
+        self.layoutAboutToBeChanged.emit()
+        inversos = {}
+        for contenedor, orden in permutaciones:
+            self._permutar(contenedor, orden)
+            if contenedor.nivel == 0:
+                for fila, nodo_ext in enumerate(contenedor.hijos):
+                    nodo_ext.fila = fila
+            # Ordenar la permutación da su inversa: fila antigua -> nueva
+            inversos[id(contenedor)] = sorted(range(len(orden)), key=orden.__getitem__)
+        for grupo in self._duplicados:
+            inverso = inversos.get(id(grupo.padre))
+            if inverso is not None and grupo.fila < len(inverso):
+                grupo.fila = inverso[grupo.fila]
+        anteriores = self.persistentIndexList()
+        nuevos_indices = []
+        for indice in anteriores:
+            contenedor = indice.internalPointer()
+            fila = indice.row()
+            inverso = inversos.get(id(contenedor))
+            if inverso is not None and fila < len(inverso):
+                fila = inverso[fila]
+            # Lo que pasa a una fila aún no cargada deja de estar en la vista
+            nuevos_indices.append(self.createIndex(fila, indice.column(), contenedor)
+                                  if fila < contenedor.cargados else QModelIndex())
+        self.changePersistentIndexList(anteriores, nuevos_indices)
+        self.layoutChanged.emit()
+
+    @staticmethod
+    def _permutar(contenedor, orden):
+        # Lo anexado después de tomar las entradas queda al final
+        viejos = contenedor.todos
+        if contenedor.nivel == 0:
+            nuevos = [viejos[i] for i in orden] + viejos[len(orden):]
+        else:
+            nuevos = array('q', map(viejos.__getitem__, orden))
+            nuevos.extend(viejos[len(orden):])
+        if contenedor.hijos is viejos:
+            contenedor.hijos = nuevos
+        contenedor.todos = nuevos
+
+    # --- Filtro ---------------------------------------------------------
+    def filtrar(self, consulta):
+        """Muestra solo los archivos que cumplen consulta (None: todos).
+
+        Espera a que el filtro esté aplicado del todo y devuelve el número de
+        archivos visibles.
+        """
+        self.filtrar_por_pasos(consulta)
+        return self.completar_filtro()
+
+    def filtrar_por_pasos(self, consulta):
+        """Como filtrar, pero sin bloquear la interfaz: filtro_aplicado avisa al terminar.
+
+        Con un millón de archivos, calcular la máscara y rehacer las filas
+        lleva unos cientos de ms. Aquí solo se da el primer paso, que ya deja
+        a la vista las primeras filas de cada extensión; el resto se hace en
+        pasos de TIEMPO_PASO_FILTRO desde el bucle de eventos. Lo que necesita
+        el filtro completo (marcar un grupo, anexar, reordenar) llama antes a
+        completar_filtro.
+        """
+        if consulta is not None and consulta.vacia():
+            consulta = None
+        self.beginResetModel()
+        self._consulta = consulta
+        if consulta is None:
+            self._mascara = None
+        self._aplicar_filtro(calcular=True)
+        self.endResetModel()
+
+    def completar_filtro(self):
+        """Termina ya el filtro en curso, si lo hay; devuelve el número de archivos visibles."""
+        self._seguir_filtrando(sin_limite=True)
+        return self.total_visibles()
+
+    def _aplicar_filtro(self, calcular=False):
+        """Rehace las entradas visibles (hijos) de cada nodo; se llama dentro de un reinicio del modelo.
+
+        Sin filtro es inmediato. Con filtro se empiezan los pasos de
+        _pasos_filtro (con calcular, también los de la máscara de la consulta)
+        y el primero se da ya.
+        """
+        raiz = self._raiz
+        duplicados = self._duplicados
+        self._filtrado = None
+        if self._consulta is not None:
+            self._filtrado = self._pasos_filtro(calcular)
+            self._reiniciando = True
+            try:
+                self._seguir_filtrando()
+            finally:
+                self._reiniciando = False
+            return
+        for nodo in duplicados:
+            nodo.hijos = nodo.todos
+        for nodo in raiz.todos:
+            nodo.hijos = nodo.todos
+        raiz.hijos = raiz.todos
+        raiz.cargados = len(raiz.hijos)
+        for grupo in duplicados:
+            grupo.cargados = len(grupo.hijos)
+        for fila, nodo_ext in enumerate(raiz.hijos):
+            nodo_ext.fila = fila
+            nodo_ext.cargados = min(len(nodo_ext.hijos), self.PASO_CARGA)
+            nodo_ext.visibles = nodo_ext.total
+            for fila_grupo in _filas_negativas(nodo_ext.hijos):
+                duplicados[~nodo_ext.hijos[fila_grupo]].fila = fila_grupo
+        self.filtro_aplicado.emit(raiz.total)
+
+    def _pasos_filtro(self, calcular):
+        """Generador que rehace las filas visibles con filtro; cada yield separa dos pasos.
+
+        Con calcular, lo primero son las PRIMERAS_FILAS coincidencias de cada
+        extensión, comprobadas una a una, para que la vista cambie sin esperar
+        a la máscara; luego se calcula la máscara (IndiceBusqueda.
+        filtrar_por_pasos). Después se completan las filas de cada extensión
+        por trozos de TROZO_FILTRO entradas, en el orden de la vista y desde
+        donde se quedó la primera pasada.
+        """
+        raiz = self._raiz
+        duplicados = self._duplicados
+        for grupo in duplicados:
+            grupo.hijos = array('q')
+            grupo.cargados = 0
+        for nodo_ext in raiz.todos:
+            nodo_ext.hijos = array('q')
+            nodo_ext.cargados = nodo_ext.visibles = 0
+        raiz.hijos = []
+        raiz.cargados = 0
+        hechas = {}
+        if calcular:
+            coincide = functools.partial(self.indice.coincide, self._consulta)
+            limite = time.perf_counter() + self.TIEMPO_PASO_FILTRO
+            for nodo_ext in raiz.todos:
+                if time.perf_counter() >= limite:
+                    break
+                primeras = array('q')
+                posicion = 0
+                for posicion, entrada in enumerate(nodo_ext.todos, 1):
+                    if entrada >= 0:
+                        if coincide(entrada):
+                            primeras.append(entrada)
+                    else:
+                        grupo = duplicados[~entrada]
+                        grupo.hijos = array('q', filter(coincide, grupo.todos))
+                        grupo.cargados = len(grupo.hijos)
+                        if grupo.hijos:
+                            primeras.append(entrada)
+                    if len(primeras) >= self.PRIMERAS_FILAS or (posicion % 256 == 0
+                                                                 and time.perf_counter() >= limite):
+                        break
+                hechas[nodo_ext] = posicion
+                if primeras:
+                    self._anadir_filas(nodo_ext, primeras)
+            yield
+            self._mascara = yield from self.indice.filtrar_por_pasos(self._consulta)
+        mascara = self._mascara
+        for grupo in duplicados:
+            grupo.hijos = array('q', filter(mascara.__getitem__, grupo.todos))
+            grupo.cargados = len(grupo.hijos)
+        yield
+        # Los grupos se añaden al final en orden inverso, así tabla[~i]
+        # dice si el grupo i tiene algo visible
+        tabla = mascara + bytes(len(grupo.hijos) > 0 for grupo in reversed(duplicados))
+        for nodo_ext in raiz.todos:
+            todos = nodo_ext.todos
+            for inicio in range(hechas.get(nodo_ext, 0), len(todos), self.TROZO_FILTRO):
+                trozo = array('q', filter(tabla.__getitem__, todos[inicio:inicio + self.TROZO_FILTRO]))
+                if trozo:
+                    self._anadir_filas(nodo_ext, trozo)
+                yield
+
+    def _anadir_filas(self, nodo_ext, entradas):
+        """Añade entradas visibles al final de nodo_ext y avisa a la vista (salvo en un reinicio)."""
+        raiz = self._raiz
+        hijos = nodo_ext.hijos
+        antes = len(hijos)
+        hijos.extend(entradas)
+        nodo_ext.visibles += len(entradas)
+        for fila in _filas_negativas(entradas):
+            grupo = self._duplicados[~entradas[fila]]
+            grupo.fila = antes + fila
+            nodo_ext.visibles += len(grupo.hijos) - 1
+        avisar = not self._reiniciando
+        if not antes:
+            # La extensión empieza a verse: va en su sitio entre las visibles
+            fila = 0
+            for otro in raiz.todos:
+                if otro is nodo_ext:
+                    break
+                if otro.hijos:
+                    fila += 1
+            if avisar:
+                self.beginInsertRows(QModelIndex(), fila, fila)
+            raiz.hijos.insert(fila, nodo_ext)
+            raiz.cargados += 1
+            for numero in range(fila, len(raiz.hijos)):
+                raiz.hijos[numero].fila = numero
+            nodo_ext.cargados = min(len(hijos), self.PASO_CARGA)
+            if avisar:
+                self.endInsertRows()
+        elif not avisar:
+            nodo_ext.cargados = min(len(hijos), self.PASO_CARGA)
+        else:
+            indice = self._indice_nodo(nodo_ext)
+            if nodo_ext.cargados == antes:
+                # La vista ya tenía todas sus filas: se cargan más, como en fetchMore
+                self._cargar_filas(nodo_ext, indice, min(len(hijos), antes + self.PASO_CARGA))
+            self.dataChanged.emit(indice, indice)
+
+    def _seguir_filtrando(self, sin_limite=False):
+        """Da pasos del filtro en curso durante TIEMPO_PASO_FILTRO (o hasta el final) y programa el resto."""
+        pasos = self._filtrado
+        if pasos is None:
+            return
+        limite = time.perf_counter() + self.TIEMPO_PASO_FILTRO
+        try:
+            next(pasos)
+            while sin_limite or time.perf_counter() < limite:
+                next(pasos)
+        except StopIteration:
+            self._filtrado = None
+            self._temporizador_filtro.stop()
+            if not self._reiniciando:
+                # Las cuentas de las extensiones dejan de ser provisionales
+                for nodo_ext in self._raiz.hijos:
+                    indice = self._indice_nodo(nodo_ext)
+                    self.dataChanged.emit(indice, indice)
+            self.filtro_aplicado.emit(self.total_visibles())
+            return
+        self._temporizador_filtro.start()
+
+    # --- Alta de resultados ---------------------------------------------
+    def anexar(self, lista_archivos):
+        """Añade un lote de RegistroArchivo agrupándolos por extensión y nombre."""
+        self.completar_filtro()
+        self._insertando = True
+        try:
+            tocados = self._anexar(lista_archivos)
+        finally:
+            self._insertando = False
+        for nodo_ext in tocados:
+            indice_ext = self._indice_nodo(nodo_ext)
+            # Las primeras filas se muestran ya; el resto se carga al desplazarse
+            self._cargar_filas(nodo_ext, indice_ext, min(len(nodo_ext.hijos), self.PASO_CARGA))
+            self.dataChanged.emit(indice_ext, indice_ext)
+
+    def aplicar_duplicados(self, grupos):
+        """Reagrupa los archivos según grupos de contenido idéntico.
+
+        grupos son listas de índices de archivo (ver BuscadorDuplicados). Dentro
+        de cada extensión, los archivos de un mismo grupo cuelgan de un nodo
+        "Duplicado" situado donde estaba el primero de ellos.
+        """
+        self.completar_filtro()
+        grupo_de = {}
+        for numero, grupo in enumerate(grupos):
+            for archivo in grupo:
+                grupo_de[archivo] = numero
+        self.beginResetModel()
+        duplicados = []
+        for nodo_ext in self._raiz.todos:
+            archivos = list(self._archivos_de(nodo_ext))
+            hijos = array('q')
+            posiciones = {}
+            for archivo in archivos:
+                numero = grupo_de.get(archivo)
+                fila = posiciones.get(numero) if numero is not None else None
+                if fila is None:
+                    if numero is not None:
+                        posiciones[numero] = len(hijos)
+                    hijos.append(archivo)
+                    continue
+                entrada = hijos[fila]
+                if entrada >= 0:
+                    grupo = _Nodo(nodo_ext, fila, 2, self.almacen.nombre(entrada))
+                    grupo.todos.append(entrada)
+                    duplicados.append(grupo)
+                    hijos[fila] = ~(len(duplicados) - 1)
+                else:
+                    grupo = duplicados[~entrada]
+                grupo.todos.append(archivo)
+            nodo_ext.todos = hijos
+        for grupo in duplicados:
+            grupo.total = len(grupo.todos)
+            grupo.marcados = sum(self.marcados[archivo] for archivo in grupo.todos)
+        self._duplicados = duplicados
+        self._aplicar_filtro()
+        self._generacion += 1
+        self.endResetModel()
+        self.reordenar()
+
+    def reclasificar(self, cambios):
+        """Pasa los archivos de cambios {archivo: tipo} al nodo de su nuevo tipo.
+
+        Un grupo de duplicados se mueve entero con su primer archivo: todos
+        tienen el mismo contenido.
+        """
+        if not cambios:
+            return
+        self.completar_filtro()
+        self.beginResetModel()
+        almacen = self.almacen
+        raiz = self._raiz
+        tocados = set()
+        for nodo_ext in list(raiz.todos):
+            quedan = array('q')
+            for entrada in nodo_ext.todos:
+                grupo = self._duplicados[~entrada] if entrada < 0 else None
+                tipo = cambios.get(entrada if grupo is None else grupo.todos[0])
+                if tipo is None or tipo == nodo_ext.clave:
+                    quedan.append(entrada)
+                    continue
+                destino = self._por_ext.get(tipo)
+                if destino is None:
+                    destino = self._por_ext[tipo] = _Nodo(raiz, len(raiz.todos), 1, tipo)
+                    raiz.todos.append(destino)
+                if grupo is None:
+                    almacen.cambiar_tipo(entrada, tipo)
+                else:
+                    grupo.padre = destino
+                    for archivo in grupo.todos:
+                        almacen.cambiar_tipo(archivo, tipo)
+                destino.todos.append(entrada)
+                tocados.update((nodo_ext, destino))
+            if len(quedan) != len(nodo_ext.todos):
+                nodo_ext.todos = quedan
+        for nodo_ext in tocados:
+            archivos = list(self._archivos_de(nodo_ext))
+            nodo_ext.total = len(archivos)
+            nodo_ext.marcados = sum(map(self.marcados.__getitem__, archivos))
+        raiz.todos = [nodo_ext for nodo_ext in raiz.todos if nodo_ext.total]
+        self._por_ext = {nodo_ext.clave: nodo_ext for nodo_ext in raiz.todos}
+        # tipo: en la consulta depende de lo que acaba de cambiar
+        self._aplicar_filtro(calcular=True)
+        self._generacion += 1
+        self.endResetModel()
+        self.reordenar()
+
+    def _anexar(self, lista_archivos):
+        tocados = set()
+        raiz = self._raiz
+        mascara = self._mascara
+        for registro in lista_archivos:
+            archivo = self.almacen.anadir(registro)
+            self.marcados.append(0)
+
+            ext = registro.tipo
+            nodo_ext = self._por_ext.get(ext)
+            if nodo_ext is None:
+                nodo_ext = _Nodo(raiz, len(raiz.hijos), 1, ext)
+                self._por_ext[ext] = nodo_ext
+                if mascara is None:
+                    self._insertar_extension(nodo_ext)
+                else:
+                    # Aparece cuando tenga algo que pase el filtro
+                    nodo_ext.hijos = array('q')
+                    raiz.todos.append(nodo_ext)
+            nodo_ext.total += 1
+            raiz.total += 1
+            nodo_ext.todos.append(archivo)
+            if mascara is not None:
+                visible = self.indice.coincide(self._consulta, archivo)
+                mascara.append(visible)
+                if not visible:
+                    continue
+                if not nodo_ext.hijos:
+                    self._insertar_extension(nodo_ext)
+                nodo_ext.hijos.append(archivo)
+                nodo_ext.visibles += 1
+            tocados.add(nodo_ext)
+        return tocados
+
+    def _insertar_extension(self, nodo_ext):
+        raiz = self._raiz
+        nodo_ext.fila = len(raiz.hijos)
+        self.beginInsertRows(QModelIndex(), nodo_ext.fila, nodo_ext.fila)
+        if raiz.hijos is not raiz.todos:
+            raiz.hijos.append(nodo_ext)
+        else:
+            raiz.todos.append(nodo_ext)
+        raiz.cargados += 1
+        self.endInsertRows()
+
+
+class GestorArchivos(QTreeView):
+    # Píxeles de las miniaturas de las filas (la vista las reduce a su iconSize)
+    LADO_FILA = 32
+    # La miniatura del archivo actual está lista (o el actual ha cambiado)
+    vista_previa_cambiada = pyqtSignal()
+
+    def __init__(self, modo_oscuro=False, cache_miniaturas=None):
+        super().__init__()
+        self.modo_oscuro = modo_oscuro
+        self.modelo = ModeloArchivos(self.obtener_icono, self)
+        self.setModel(self.modelo)
+        self.configurar_ui()
+        self.modelo.rowsInserted.connect(self._expandir_grupos)
+        self.modelo.modelReset.connect(lambda: self._expandir_grupos(QModelIndex(), 0, self.modelo.rowCount() - 1))
+        self._configurar_miniaturas(CacheMiniaturas() if cache_miniaturas is None else cache_miniaturas)
+
+    def _configurar_miniaturas(self, cache):
+        """Miniaturas de las filas a la vista y, con la vista previa abierta, de la actual.
+
+        Cada cambio de lo visible (desplazamiento, expandir, filas nuevas...)
+        reinicia un temporizador corto; al vencer se piden solo las filas que
+        se ven, lo que descarta las peticiones de las que ya pasaron.
+        """
+        self.cache_miniaturas = cache
+        self.generador_miniaturas = GeneradorMiniaturas(cache, hilos=max(2, min(4, os.cpu_count() or 2)), parent=self)
+        self.generador_miniaturas.miniatura_lista.connect(self._miniatura_lista)
+        self.formatos_miniatura = {'.' + bytes(formato).decode('ascii', 'replace').lower()
+                                   for formato in QImageReader.supportedImageFormats()} - {'.svg', '.svgz'}
+        if '.jpeg' in self.formatos_miniatura:
+            self.formatos_miniatura |= {'.jpg', '.jpe'}
+        # 0 = vista previa cerrada
+        self.lado_vista_previa = 0
+        self.modelo.obtener_miniatura = self._miniatura_fila
+        self.temporizador_miniaturas = QTimer(self)
+        self.temporizador_miniaturas.setSingleShot(True)
+        self.temporizador_miniaturas.setInterval(80)
+        self.temporizador_miniaturas.timeout.connect(self.pedir_miniaturas)
+        programar = self.temporizador_miniaturas.start
+        self.verticalScrollBar().valueChanged.connect(programar)
+        self.expanded.connect(programar)
+        self.collapsed.connect(programar)
+        for senal in (self.modelo.modelReset, self.modelo.layoutChanged, self.modelo.rowsInserted,
+                      self.modelo.rowsRemoved):
+            senal.connect(programar)
+        self.selectionModel().currentChanged.connect(self._actual_cambiado)
+
+    def _clave_miniatura(self, archivo, lado):
+        """Clave de la miniatura del archivo, o None si su tipo no es una imagen legible."""
+        almacen = self.modelo.almacen
+        if almacen.tipo(archivo) not in self.formatos_miniatura:
+            return None
+        return (almacen.ruta(archivo), almacen.tamanos[archivo], almacen.fechas[archivo], lado)
+
+    def _miniatura_fila(self, archivo):
+        clave = self._clave_miniatura(archivo, self.LADO_FILA)
+        pixmap = self.cache_miniaturas.obtener(clave) if clave is not None else None
+        return QIcon(pixmap) if pixmap is not None and not pixmap.isNull() else None
+
+    def archivos_visibles(self):
+        """Archivos con fila a la vista, de arriba abajo."""
+        archivos = []
+        indice = self.indexAt(QPoint(0, 0))
+        alto = self.viewport().height()
+        while indice.isValid() and self.visualRect(indice).top() < alto:
+            archivo = self.modelo.archivo(indice)
+            if archivo is not None:
+                archivos.append(archivo)
+            indice = self.indexBelow(indice)
+        return archivos
+
+    def pedir_miniaturas(self):
+        """Sustituye las peticiones pendientes por las de lo que se ve ahora."""
+        peticiones = []
+        actual = self.modelo.archivo(self.currentIndex())
+        if actual is not None and self.lado_vista_previa:
+            clave = self._clave_miniatura(actual, self.lado_vista_previa)
+            if clave is not None:
+                peticiones.append((clave, self.modelo.registro(actual)))
+        if self.isVisible():
+            for archivo in self.archivos_visibles():
+                clave = self._clave_miniatura(archivo, self.LADO_FILA)
+                if clave is not None and clave not in self.cache_miniaturas:
+                    peticiones.append((clave, self.modelo.registro(archivo)))
+        self.generador_miniaturas.pedir(peticiones)
+
+    def _miniatura_lista(self, clave, imagen):
+        self.cache_miniaturas.guardar(clave, imagen)
+        if clave[3] == self.LADO_FILA:
+            # Las filas leen la caché al repintarse
+            self.viewport().update()
+        elif clave[3] == self.lado_vista_previa:
+            actual = self.modelo.archivo(self.currentIndex())
+            if actual is not None and self._clave_miniatura(actual, clave[3]) == clave:
+                self.vista_previa_cambiada.emit()
+
+    def _actual_cambiado(self, actual, anterior):
+        if self.lado_vista_previa:
+            self.vista_previa_cambiada.emit()
+            self.temporizador_miniaturas.start()
+
+    def activar_vista_previa(self, lado):
+        """Con lado > 0 se decodifica también el archivo actual a ese tamaño; 0 lo desactiva."""
+        self.lado_vista_previa = lado
+        if lado:
+            self.vista_previa_cambiada.emit()
+        self.pedir_miniaturas()
+
+    def vista_previa(self):
+        """(registro o None, QPixmap) del archivo actual: su miniatura o, mientras no esté, el icono de su tipo."""
+        lado = self.lado_vista_previa or 256
+        archivo = self.modelo.archivo(self.currentIndex())
+        if archivo is None:
+            return None, QPixmap()
+        registro = self.modelo.registro(archivo)
+        clave = self._clave_miniatura(archivo, lado)
+        pixmap = self.cache_miniaturas.obtener(clave) if clave is not None else None
+        if pixmap is None or pixmap.isNull():
+            pixmap = self.obtener_icono(registro.tipo).pixmap(min(lado, 128))
+        return registro, pixmap
+
+    def detener_miniaturas(self):
+        self.temporizador_miniaturas.stop()
+        self.generador_miniaturas.detener()
+
+    def resizeEvent(self, evento):
+        super().resizeEvent(evento)
+        self.temporizador_miniaturas.start()
+    def configurar_ui(self):
+        self.setColumnWidth(0, 250)
+        self.setColumnWidth(4, 400)
+        self.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.setSelectionMode(QTreeView.ExtendedSelection)
+        self.setUniformRowHeights(True)
+        # Sin orden inicial: los archivos aparecen en el orden del escaneo
+        self.header().setSortIndicator(-1, Qt.AscendingOrder)
+        self.setSortingEnabled(True)
+        # Iconos por defecto (serán reemplazados en MainWindow)
+        self.iconos_archivo = {
+            '.txt': QIcon(),
+            '.pdf': QIcon(),
+            '.jpg': QIcon(),
+            '.png': QIcon(),
+            '.docx': QIcon(),
+            '.xlsx': QIcon(),
+            'default': QIcon()
+        }
+        self.actualizar_tema()
+    def actualizar_tema(self):
+        if self.modo_oscuro:
+            self.setStyleSheet("""
+                QTreeView {
+                    background-color: #3E2723;
+                    border: 1px solid #5D4037;
+                    font-size: 12px;
+                    color: #F7F3F0;
+                }
+                QTreeView::item {
+                    padding: 5px;
+                }
+                QTreeView::item:selected {
+                    background-color: #6B4C3B;
+                    color: white;
+                }
+                QHeaderView::section {
+                    background-color: #6B4C3B;
+                    color: white;
+                    padding: 5px;
+                    border: none;
+                }
+            """)
+        else:
+            self.setStyleSheet("""
+                QTreeView {
+                    background-color: #FFFFFF;
+                    border: 1px solid #8C6A57;
+                    font-size: 12px;
+                }
+                QTreeView::item {
+                    color: #6B4C3B;
+                    padding: 5px;
+                }
+                QTreeView::item:selected {
+                    background-color: #6B4C3B;
+                    color: white;
+                }
+                QHeaderView::section {
+                    background-color: #6B4C3B;
+                    color: white;
+                    padding: 5px;
+                    border: none;
+                }
+            """)
+    def agregar_archivos(self, lista_archivos):
+        self.limpiar_archivos()
+        self.anexar_archivos(lista_archivos)
+
+    def limpiar_archivos(self):
+        self.modelo.limpiar()
+
+    def anexar_archivos(self, lista_archivos):
+        """Añade un lote de RegistroArchivo al árbol sin reconstruir lo ya mostrado."""
+        self.modelo.anexar(lista_archivos)
+
+    def aplicar_duplicados(self, grupos):
+        self.modelo.aplicar_duplicados(grupos)
+
+    def reclasificar(self, cambios):
+        self.modelo.reclasificar(cambios)
+
+    def reordenar(self):
+        self.modelo.reordenar()
+
+    def filtrar(self, consulta):
+        """Deja a la vista solo los archivos que cumplen consulta; devuelve cuántos son."""
+        return self.modelo.filtrar(consulta)
+
+    def filtrar_por_pasos(self, consulta):
+        """Como filtrar, sin esperar: modelo.filtro_aplicado avisa al terminar."""
+        self.modelo.filtrar_por_pasos(consulta)
+
+    def preparar_busqueda(self):
+        # Índices del filtro en segundo plano, para que la primera consulta no espere
+        self.modelo.indice.preparar_en_segundo_plano()
+
+    def _expandir_grupos(self, padre, primera, ultima):
+        # Los grupos por extensión se muestran expandidos, como antes
+        if not padre.isValid():
+            for fila in range(primera, ultima + 1):
+                self.expand(self.modelo.index(fila, 0))
+
+    def obtener_icono(self, extension):
+        return self.iconos_archivo.get(extension, self.iconos_archivo['default'])
+
+    formato_tamano = staticmethod(formato_tamano)
+    formato_fecha = staticmethod(formato_fecha)
+
+    def obtener_rutas_marcadas(self):
+        """Devuelve la lista de rutas (strings) de los files marcados (checkbox).
+        Solo devuelve rutas que correspondan a archivos (hojas con UserRole).
+        """
+        return self.modelo.rutas_marcadas()
+
+    def obtener_registros_marcados(self):
+        return self.modelo.registros_marcados()
+
+    def contar_marcados(self):
+        return self.modelo.total_marcados()
+
+    def obtener_rutas_seleccionadas(self):
+        """Rutas de los archivos seleccionados (se ignoran los nodos agrupadores)."""
+        return [registro.ruta for registro in self.obtener_registros_seleccionados()]
+
+    def obtener_registros_seleccionados(self):
+        registros = []
+        for indice in self.selectionModel().selectedRows(0):
+            if self.modelo._nodo(indice) is None:
+                registros.append(self.modelo.registro(indice.internalPointer().hijos[indice.row()]))
+        return registros
+
+    def marcar_todo(self, marcar=True):
+        self.modelo.marcar_todo(marcar)
+
+    def marcar_coincidentes(self, marcar=True):
+        self.modelo.marcar_coincidentes(marcar)
+
+class ThemeSlider(QFrame):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setup_ui()
+        
+    def setup_ui(self):
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(10)
+        
+        self.light_label = QLabel("☀️")
+        self.dark_label = QLabel("🌙")
+        
+        self.slider = QSlider(Qt.Horizontal)
+        self.slider.setMinimum(0)
+        self.slider.setMaximum(1)
+        self.slider.setFixedWidth(50)
+        self.slider.setStyleSheet("""
+            QSlider::groove:horizontal {
+                height: 5px;
+                background: qlineargradient(x1:0, y1:0, x2:1, y2:0,
+                    stop:0 #8C6A57, stop:1 #3E2723);
+                border-radius: 2px;
+            }
+            QSlider::handle:horizontal {
+                width: 15px;
+                height: 15px;
+                background: white;
+                border: 1px solid #777;
+                border-radius: 7px;
+                margin: -5px 0;
+            }
+        """)
+        
+        layout.addWidget(self.light_label)
+        layout.addWidget(self.slider)
+        layout.addWidget(self.dark_label)
+        self.setLayout(layout)
+
+class PanelDiagnostico(QFrame):
+    """Tiempos por fase, contadores y rutas más lentas de la última operación."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.diagnostico = None
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        barra = QHBoxLayout()
+        barra.addWidget(QLabel("Diagnóstico"))
+        barra.addStretch()
+        self.boton_exportar_traza = QPushButton("Exportar traza...")
+        self.boton_exportar_traza.clicked.connect(self.exportar_traza)
+        barra.addWidget(self.boton_exportar_traza)
+        layout.addLayout(barra)
+        self.texto = QPlainTextEdit()
+        self.texto.setReadOnly(True)
+        self.texto.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.texto)
+        # Mientras está visible se refresca solo, también durante el escaneo
+        self.temporizador = QTimer(self)
+        self.temporizador.setInterval(1000)
+        self.temporizador.timeout.connect(self.actualizar)
+
+    def mostrar(self, diagnostico):
+        self.diagnostico = diagnostico
+        self.actualizar()
+
+    def showEvent(self, evento):
+        super().showEvent(evento)
+        self.temporizador.start()
+        self.actualizar()
+
+    def hideEvent(self, evento):
+        super().hideEvent(evento)
+        self.temporizador.stop()
+
+    def actualizar(self):
+        if self.diagnostico is None or not self.isVisible():
+            return
+        self.texto.setPlainText(self.formatear(self.diagnostico.resumen()))
+
+    @staticmethod
+    def formatear(resumen):
+        lineas = ["Fases (segundos):"]
+        for fase, segundos in resumen['tiempos'].items():
+            lineas.append(f"  {fase:<28}{segundos:>10.3f}")
+        lineas.append("Contadores:")
+        for nombre, valor in sorted(resumen['contadores'].items()):
+            texto = formato_tamano(valor) if nombre.endswith('bytes_copiados') else f"{valor:,}"
+            lineas.append(f"  {nombre:<40}{texto:>14}")
+        for categoria, lentos in resumen['lentos'].items():
+            lineas.append(f"Más lentos ({categoria}):")
+            for segundos, ruta in lentos:
+                lineas.append(f"  {segundos:>8.3f} s  {ruta}")
+        return "\n".join(lineas)
+
+    def exportar_traza(self):
+        if self.diagnostico is None:
+            return
+        ruta, _ = QFileDialog.getSaveFileName(self, "Guardar traza", "pickrestore_traza.json",
+                                              "Traza Chrome (*.json)")
+        if not ruta:
+            return
+        try:
+            self.diagnostico.exportar_traza(ruta)
+        except OSError as e:
+            QMessageBox.warning(self, "Error", f"No se pudo guardar la traza:\n{e}")
+
+
+class PanelVistaPrevia(QFrame):
+    """Miniatura grande y datos del archivo actual del árbol."""
+    LADO = 256
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.imagen = QLabel()
+        self.imagen.setAlignment(Qt.AlignCenter)
+        self.imagen.setMinimumSize(self.LADO, self.LADO)
+        layout.addWidget(self.imagen)
+        self.datos = QLabel()
+        self.datos.setWordWrap(True)
+        self.datos.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.datos.setAlignment(Qt.AlignTop | Qt.AlignLeft)
+        layout.addWidget(self.datos, stretch=1)
+
+    def mostrar(self, registro, pixmap):
+        if registro is None:
+            self.imagen.clear()
+            self.datos.setText("Seleccione un archivo")
+            return
+        self.imagen.setPixmap(pixmap)
+        self.datos.setText("\n".join((os.path.basename(registro.ruta), formato_tamano(registro.tamano),
+                                       formato_fecha(registro.fecha), registro.ruta)))
+
+
+class VentanaPrincipal(QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.dark_mode = False
+        self._carpetas_seleccionadas = []
+        self.trabajador_recuperacion = None
+        self.trabajador_duplicados = None
+        self.trabajador_exportacion = None
+        self.trabajador_tallado = None
+        self.trabajador_tipos = None
+        self._texto_filtro = ''
+        # Consulta escrita e instante en que empezó a aplicarse, hasta que acaba
+        self._filtro_en_curso = None
+        # Diagnóstico del último escaneo y de lo que se haga con sus resultados
+        self.diagnostico = Diagnostico()
+        try:
+            self.indice_escaneo = IndiceEscaneo()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Índice de escaneo no disponible: {e}")
+            self.indice_escaneo = None
+        try:
+            self.cache_tipos = CacheTipos()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Caché de tipos no disponible: {e}")
+            self.cache_tipos = None
+        try:
+            self.cache_miniaturas = CacheMiniaturas(carpeta=os.path.join(ruta_datos_app(), 'miniaturas'))
+            threading.Thread(target=self.cache_miniaturas.podar_disco, daemon=True).start()
+        except OSError as e:
+            print(f"Caché de miniaturas en disco no disponible: {e}")
+            self.cache_miniaturas = CacheMiniaturas()
+
+        self.setWindowTitle("Pick & Restore")
+        self.setGeometry(100, 100, 900, 600)
+        self.configurar_ui()
+        self.configurar_iconos()
+
+    def cambiar_tema(self, valor):
+        self.dark_mode = bool(valor)
+        self.apply_theme()
+        self.update_styles()
+        if hasattr(self, 'selector_tema'):
+            self.selector_tema.slider.setValue(int(self.dark_mode))
+
+    def configurar_iconos(self):
+        try:
+            self.boton_escanear.setIcon(QIcon(resource_path('icons/icono_scan.png')))
+            self.boton_cancelar.setIcon(QIcon(resource_path('icons/icono_cancelar.png')))
+            self.boton_exportar.setIcon(QIcon(resource_path('icons/icono_exportar.png')))
+            self.gestor_archivos.iconos_archivo = {
+                '.txt': QIcon(resource_path('icons/icono_txt.png')),
+                '.pdf': QIcon(resource_path('icons/icono_pdf.png')),
+                '.jpg': QIcon(resource_path('icons/icono_jpg.png')),
+                '.png': QIcon(resource_path('icons/icono_png.png')),
+                '.docx': QIcon(resource_path('icons/icono_docx.png')),
+                '.xlsx': QIcon(resource_path('icons/icono_xlsx.png')),
+                'default': QIcon(resource_path('icons/icono_default.png'))
+            }
+        except Exception as e:
+            print(f"Error cargando iconos: {e}")
+
+    def configurar_ui(self):
+        self.apply_theme()
+
+        central_widget = QWidget()
+        self.setCentralWidget(central_widget)
+        main_layout = QVBoxLayout(central_widget)
+        main_layout.setContentsMargins(10, 10, 10, 10)
+        main_layout.setSpacing(10)
+
+        # Barra superior
+        top_bar = QHBoxLayout()
+
+        unit_controls = QHBoxLayout()
+        unit_controls.setSpacing(8)
+
+        self.combo_unidades = QComboBox()
+        self.combo_unidades.setFixedWidth(150)
+        self.actualizar_unidades()
+
+        self.boton_escanear = QPushButton(" Escanear Unidad")
+        self.boton_escanear.clicked.connect(self.iniciar_recuperacion)
+
+        self.boton_cancelar = QPushButton(" Cancelar")
+        self.boton_cancelar.clicked.connect(self.cancelar_recuperacion)
+        self.boton_cancelar.setEnabled(False)
+
+        # El avance se guarda mientras tanto: se puede cerrar y continuar luego
+        self.boton_pausar = QPushButton(" Pausar")
+        self.boton_pausar.setCheckable(True)
+        self.boton_pausar.toggled.connect(self.pausar_escaneo)
+        self.boton_pausar.setEnabled(False)
+
+        unit_controls.addWidget(QLabel("Unidad:"))
+        unit_controls.addWidget(self.combo_unidades)
+        unit_controls.addWidget(self.boton_escanear)
+        unit_controls.addWidget(self.boton_pausar)
+        unit_controls.addWidget(self.boton_cancelar)
+
+        # Selección manual de carpetas
+        self.boton_seleccionar_carpetas = QPushButton(" Seleccionar Carpetas")
+        self.boton_seleccionar_carpetas.clicked.connect(self.seleccionar_carpetas)
+        unit_controls.addWidget(self.boton_seleccionar_carpetas)
+
+        # Recuperación por firma desde una imagen o un dispositivo en crudo
+        self.boton_tallar = QPushButton(" Tallar Imagen/Disco")
+        self.boton_tallar.clicked.connect(self.iniciar_tallado)
+        unit_controls.addWidget(self.boton_tallar)
+
+        # Archivos borrados de un volumen FAT/exFAT (memorias USB, tarjetas SD)
+        self.boton_borrados = QPushButton(" Recuperar Borrados (FAT)")
+        self.boton_borrados.clicked.connect(self.iniciar_borrados)
+        unit_controls.addWidget(self.boton_borrados)
+
+        # Barra de progreso y tema
+        self.barra_progreso = QProgressBar()
+        self.barra_progreso.setFixedHeight(20)
+        self.barra_progreso.setTextVisible(False)
+
+        self.selector_tema = ThemeSlider()
+        self.selector_tema.slider.valueChanged.connect(self.cambiar_tema)
+
+        self.etiqueta_estado = QLabel("Seleccione una unidad o carpetas y haga clic en Escanear")
+
+        top_bar.addLayout(unit_controls)
+        top_bar.addWidget(self.barra_progreso)
+        top_bar.addWidget(self.selector_tema)
+        top_bar.addWidget(self.etiqueta_estado, stretch=1)
+
+        # Área principal
+        splitter = QSplitter(Qt.Vertical)
+        self.gestor_archivos = GestorArchivos(self.dark_mode, self.cache_miniaturas)
+        self.gestor_archivos.generador_miniaturas.diagnostico = self.diagnostico
+
+        # Controles de selección
+        seleccion_bar = QHBoxLayout()
+        self.boton_marcar_todo = QPushButton("Marcar/Desmarcar Todo")
+        self.boton_marcar_todo.clicked.connect(self._toggle_marcar_todo)
+        seleccion_bar.addWidget(self.boton_marcar_todo)
+        self.boton_olvidar_indice = QPushButton("Borrar índice de escaneo")
+        self.boton_olvidar_indice.clicked.connect(self.olvidar_indice)
+        seleccion_bar.addWidget(self.boton_olvidar_indice)
+        self.boton_diagnostico = QPushButton("Diagnóstico")
+        self.boton_diagnostico.setCheckable(True)
+        seleccion_bar.addWidget(self.boton_diagnostico)
+        self.boton_vista_previa = QPushButton("Vista previa")
+        self.boton_vista_previa.setCheckable(True)
+        seleccion_bar.addWidget(self.boton_vista_previa)
+        seleccion_bar.addStretch()
+
+        # Filtro de resultados; se aplica al dejar de escribir
+        self.campo_filtro = QLineEdit()
+        self.campo_filtro.setPlaceholderText("Filtrar: factura tipo:pdf,docx >1MB dias:30 en:/carpeta")
+        self.campo_filtro.setClearButtonEnabled(True)
+        self.campo_filtro.setMinimumWidth(320)
+        self.temporizador_filtro = QTimer(self)
+        self.temporizador_filtro.setSingleShot(True)
+        self.temporizador_filtro.setInterval(200)
+        self.temporizador_filtro.timeout.connect(self.aplicar_filtro)
+        self.campo_filtro.textChanged.connect(self.temporizador_filtro.start)
+        self.campo_filtro.returnPressed.connect(self.aplicar_filtro)
+        seleccion_bar.addWidget(self.campo_filtro)
+        self.boton_marcar_coincidentes = QPushButton("Marcar coincidentes")
+        self.boton_marcar_coincidentes.setToolTip("Marca (o desmarca) todos los archivos que cumplen el filtro")
+        self.boton_marcar_coincidentes.clicked.connect(self._toggle_marcar_coincidentes)
+        seleccion_bar.addWidget(self.boton_marcar_coincidentes)
+
+        # Barra inferior
+        bottom_bar = QHBoxLayout()
+        self.boton_exportar = QPushButton(" Exportar Selección")
+        self.boton_exportar.clicked.connect(self.exportar_archivos)
+        self.boton_exportar.setEnabled(False)
+        bottom_bar.addWidget(self.boton_exportar)
+        # Destino de la exportación: carpeta o un único archivo contenedor
+        self.combo_destino = QComboBox()
+        self.combo_destino.addItem("a carpeta", None)
+        self.combo_destino.addItem("a ZIP", ('zip', False))
+        self.combo_destino.addItem("a ZIP comprimido", ('zip', True))
+        self.combo_destino.addItem("a TAR", ('tar', False))
+        self.combo_destino.addItem("a TAR.GZ", ('tar', True))
+        bottom_bar.addWidget(self.combo_destino)
+        self.check_verificar = QCheckBox("Verificar copias (releer destino)")
+        bottom_bar.addWidget(self.check_verificar)
+        # Sin hash la copia puede ir por la vía rápida del sistema, pero no
+        # queda manifiesto y no se puede verificar
+        self.check_sin_hash = QCheckBox("Sin hash (copia más rápida)")
+        self.check_sin_hash.toggled.connect(lambda marcado: self.check_verificar.setEnabled(not marcado))
+        self.check_verificar.toggled.connect(lambda marcado: self.check_sin_hash.setEnabled(not marcado))
+        bottom_bar.addWidget(self.check_sin_hash)
+        bottom_bar.addStretch()
+
+        # La vista previa va junto al árbol y solo decodifica mientras se ve
+        division_archivos = QSplitter(Qt.Horizontal)
+        division_archivos.addWidget(self.gestor_archivos)
+        self.panel_vista_previa = PanelVistaPrevia()
+        self.panel_vista_previa.setVisible(False)
+        division_archivos.addWidget(self.panel_vista_previa)
+        division_archivos.setStretchFactor(0, 1)
+        self.boton_vista_previa.toggled.connect(self.alternar_vista_previa)
+        self.gestor_archivos.vista_previa_cambiada.connect(self.actualizar_vista_previa)
+        splitter.addWidget(division_archivos)
+        self.panel_diagnostico = PanelDiagnostico()
+        self.panel_diagnostico.mostrar(self.diagnostico)
+        self.panel_diagnostico.setVisible(False)
+        self.boton_diagnostico.toggled.connect(self.panel_diagnostico.setVisible)
+        splitter.addWidget(self.panel_diagnostico)
+
+        main_layout.addLayout(top_bar)
+        main_layout.addLayout(seleccion_bar)
+        main_layout.addWidget(splitter)
+        main_layout.addLayout(bottom_bar)
+
+        # Conectar señales
+        self.gestor_archivos.selectionModel().selectionChanged.connect(self.actualizar_boton_exportar)
+        self.gestor_archivos.modelo.marcados_cambiados.connect(self.actualizar_boton_exportar)
+        self.gestor_archivos.modelo.filtro_aplicado.connect(self.filtro_terminado)
+
+        self.update_styles()
+
+    def apply_theme(self):
+        palette = QPalette()
+        if self.dark_mode:
+            palette.setColor(QPalette.Window, QColor(30, 30, 30))
+            palette.setColor(QPalette.WindowText, QColor(220, 220, 220))
+            palette.setColor(QPalette.Base, QColor(50, 50, 50))
+        else:
+            palette.setColor(QPalette.Window, QColor(240, 245, 250))
+            palette.setColor(QPalette.WindowText, QColor(30, 63, 102))
+        self.setPalette(palette)
+
+    def update_styles(self):
+        # Simplificado: aplicamos estilos básicos y estilos a botones
+        # Aplicar estilos más completos para asegurar contraste
+        if self.dark_mode:
+            palette_css = """
+                QMainWindow { background-color: #3E2723; }
+                QLabel { color: #F7F3F0; }
+                QComboBox { background: #5D4037; color: #F7F3F0; border: 1px solid #8C6A57; padding: 5px; border-radius: 4px; }
+                QComboBox QAbstractItemView { background: #5D4037; color: #F7F3F0; selection-background-color: #6B4C3B; }
+                QProgressBar { border: 1px solid #5D4037; background: #5D4037; color: #F7F3F0; }
+                QSplitter::handle { background: #5D4037; }
+            """
+            btn_style = "background-color: #6B4C3B; color: white;"
+            cancel_style = "background-color: #D9534F; color: white;"
+            export_style = "background-color: #8F6F5B; color: white;"
+        else:
+            palette_css = """
+                QMainWindow { background-color: #FFFFFF; }
+                QLabel { color: #6B4C3B; }
+                QComboBox { background: #FFFFFF; color: #6B4C3B; border: 1px solid #8C6A57; padding: 5px; border-radius: 4px; }
+                QComboBox QAbstractItemView { background: #FFFFFF; color: #6B4C3B; selection-background-color: #EDE0D8; }
+                QProgressBar { border: 1px solid #8C6A57; background: #FFFFFF; color: #6B4C3B; }
+                QSplitter::handle { background: #8C6A57; }
+            """
+            btn_style = "background-color: #6B4C3B; color: white;"
+            cancel_style = "background-color: #D9534F; color: white;"
+            export_style = "background-color: #8F6F5B; color: white;"
+
+        # Aplicar hoja de estilo general
+        self.setStyleSheet(palette_css)
+
+        # Estilos específicos de botones
+        self.boton_escanear.setStyleSheet(btn_style)
+        self.boton_pausar.setStyleSheet(btn_style)
+        self.boton_cancelar.setStyleSheet(cancel_style)
+        self.boton_exportar.setStyleSheet(export_style)
+
+        # Actualizar tema del gestor de archivos
+        self.gestor_archivos.modo_oscuro = self.dark_mode
+        self.gestor_archivos.actualizar_tema()
+
+        # Asegurar que los QMessageBox también sean legibles en ambos modos
+        try:
+            app = QApplication.instance()
+            if app:
+                if self.dark_mode:
+                    msgbox_css = """
+                        QMessageBox {
+                            background-color: #3E2723; 
+                            color: #F7F3F0;
+                        }
+                        QMessageBox QLabel { color: #F7F3F0; }
+                        QMessageBox QPushButton { background-color: #6B4C3B; color: #F7F3F0; border: none; padding: 5px 10px; border-radius: 4px; }
+                        QMessageBox QPushButton:hover { background-color: #8C6A57; }
+                    """
+                else:
+                    msgbox_css = """
+                        QMessageBox { background-color: #FFFFFF; color: #6B4C3B; }
+                        QMessageBox QLabel { color: #6B4C3B; }
+                        QMessageBox QPushButton { background-color: #6B4C3B; color: white; border: none; padding: 5px 10px; border-radius: 4px; }
+                        QMessageBox QPushButton:hover { background-color: #8C6A57; }
+                    """
+                # Aplicar solo las reglas de QMessageBox a nivel de aplicación
+                # (no sobreescribe estilos locales del main window)
+                app.setStyleSheet(msgbox_css)
+        except Exception:
+            pass
+
+    def actualizar_unidades(self):
+        self.combo_unidades.clear()
+        for particion in psutil.disk_partitions():
+            if 'removable' in particion.opts or 'fixed' in particion.opts:
+                unidad = particion.device[0]
+                self.combo_unidades.addItem(f"{unidad}: {particion.mountpoint}", unidad)
+        if self.combo_unidades.count() > 1:
+            # Las de discos distintos se recorren a la vez
+            unidades = [self.combo_unidades.itemData(i) for i in range(self.combo_unidades.count())]
+            self.combo_unidades.addItem("Todas", unidades)
+
+    def iniciar_recuperacion(self, usando_carpetas=False):
+        # Determinar objetivo: unidad o carpetas
+        if usando_carpetas and getattr(self, '_carpetas_seleccionadas', None):
+            rutas = self._carpetas_seleccionadas
+            usar_carpetas = True
+        else:
+            unidad = self.combo_unidades.currentData()
+            usar_carpetas = False
+            if not unidad:
+                QMessageBox.warning(self, "Error", "Seleccione una unidad válida")
+                return
+
+        # Confirmación
+        if usar_carpetas:
+            lista_texto = "\n".join(rutas[:5]) + ("..." if len(rutas) > 5 else "")
+            respuesta = QMessageBox.question(self, 'Confirmación', f'¿Está seguro de escanear las siguientes carpetas?\n{lista_texto}\n\nEsta operación puede tomar varios minutos.', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            argumento = rutas
+        else:
+            nombre = f"la unidad {unidad}:" if isinstance(unidad, str) else "las unidades " + ", ".join(f"{u}:" for u in unidad)
+            respuesta = QMessageBox.question(self, 'Confirmación', f'¿Está seguro de realizar la recuperación en {nombre}?\n\nEsta operación puede tomar varios minutos.', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            argumento = unidad
+
+        if respuesta != QMessageBox.Yes:
+            if hasattr(self, '_carpetas_seleccionadas'):
+                del self._carpetas_seleccionadas
+            return
+
+        punto_control = PuntoControl(argumento)
+        if punto_control.existe():
+            continuar = QMessageBox.question(self, 'Escaneo interrumpido',
+                                             'Un escaneo anterior de este destino no llegó a terminar.\n\n'
+                                             '¿Continuar desde donde se quedó? (No: empezar de nuevo)',
+                                             QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            if continuar != QMessageBox.Yes:
+                punto_control.borrar()
+
+        # Deshabilitar controles
+        self.boton_escanear.setEnabled(False)
+        self.boton_tallar.setEnabled(False)
+        self.boton_borrados.setEnabled(False)
+        self.combo_unidades.setEnabled(False)
+        self.boton_cancelar.setEnabled(True)
+        self.boton_pausar.setChecked(False)
+        self.boton_pausar.setEnabled(True)
+        self.boton_exportar.setEnabled(False)
+        self.barra_progreso.setValue(0)
+        self.barra_progreso.setToolTip("")
+
+        # Los resultados se van mostrando por lotes mientras dura el escaneo
+        self._detener_busquedas()
+        if self.trabajador_tipos and self.trabajador_tipos.isRunning():
+            self.trabajador_tipos.cancelar()
+        if self.trabajador_duplicados and self.trabajador_duplicados.isRunning():
+            self.trabajador_duplicados.cancelar()
+        self.gestor_archivos.limpiar_archivos()
+        self.diagnostico = Diagnostico()
+        self.gestor_archivos.generador_miniaturas.diagnostico = self.diagnostico
+        self.panel_diagnostico.mostrar(self.diagnostico)
+
+        # Iniciar hilo
+        self.trabajador_recuperacion = TrabajadorRecuperacion(argumento, "rapida", streaming=True,
+                                                              indice=self.indice_escaneo,
+                                                              diagnostico=self.diagnostico,
+                                                              punto_control=punto_control)
+        self.trabajador_recuperacion.progreso_actualizado.connect(self.actualizar_progreso)
+        self.trabajador_recuperacion.lote_encontrado.connect(self.anexar_lote)
+        self.trabajador_recuperacion.desglose_actualizado.connect(self.mostrar_desglose)
+        self.trabajador_recuperacion.escaneo_terminado.connect(self.escaneo_finalizado)
+        self.trabajador_recuperacion.recuperacion_completada.connect(self.recuperacion_finalizada)
+        self.trabajador_recuperacion.error_ocurrido.connect(self.error_recuperacion)
+        self.trabajador_recuperacion.start()
+
+    def iniciar_tallado(self):
+        # Un dispositivo (p. ej. /dev/sdb) se puede escribir a mano en el diálogo
+        ruta, _ = QFileDialog.getOpenFileName(self, "Imagen de disco o dispositivo a tallar")
+        if not ruta:
+            return
+        respuesta = QMessageBox.question(self, 'Confirmación', f'¿Buscar archivos por firma en {ruta}?\n\n'
+                                         'Se lee todo su contenido, lo que puede tardar bastante. Los archivos '
+                                         'encontrados se añaden a la lista actual.',
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if respuesta != QMessageBox.Yes:
+            return
+        motor = MotorTallado(diagnostico=self.diagnostico)
+        self._iniciar_crudo(ruta, motor.tallar, "Buscando archivos por firma...", "Tallado completado")
+
+    def iniciar_borrados(self):
+        # En Windows se propone el volumen de la unidad elegida; un
+        # dispositivo se puede escribir a mano en el diálogo
+        unidad = self.combo_unidades.currentData()
+        sugerida = f"\\\\.\\{unidad}:" if os.name == 'nt' and isinstance(unidad, str) else "/dev"
+        ruta, _ = QFileDialog.getOpenFileName(self, "Volumen FAT/exFAT o imagen de disco", sugerida)
+        if not ruta:
+            return
+        respuesta = QMessageBox.question(self, 'Confirmación', f'¿Buscar archivos borrados en {ruta}?\n\n'
+                                         'Solo se leen la FAT y las carpetas; el volumen no se modifica. Los '
+                                         'archivos encontrados se añaden a la lista actual.',
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if respuesta != QMessageBox.Yes:
+            return
+        lector = LectorFat(diagnostico=self.diagnostico)
+        self._iniciar_crudo(ruta, lector.borrados, "Buscando archivos borrados...", "Búsqueda de borrados completada")
+
+    def _iniciar_crudo(self, ruta, buscar, mensaje_inicio, mensaje_fin):
+        self.boton_escanear.setEnabled(False)
+        self.boton_tallar.setEnabled(False)
+        self.boton_borrados.setEnabled(False)
+        self.combo_unidades.setEnabled(False)
+        self.boton_cancelar.setEnabled(True)
+        self.barra_progreso.setValue(0)
+
+        self._detener_busquedas()
+        self.trabajador_tallado = TrabajadorCrudo(ruta, buscar, mensaje_inicio, mensaje_fin)
+        self.trabajador_tallado.progreso_actualizado.connect(self.actualizar_progreso)
+        self.trabajador_tallado.lote_encontrado.connect(self.anexar_lote)
+        self.trabajador_tallado.escaneo_terminado.connect(self.tallado_finalizado)
+        self.trabajador_tallado.error_ocurrido.connect(self.error_recuperacion)
+        self.trabajador_tallado.start()
+
+    def _detener_busquedas(self):
+        # Un escaneo o tallado cancelado sigue vivo hasta que ve la marca; se
+        # espera a que acabe (y a que cierre su punto de control) y se suelta,
+        # para que sus lotes aún en cola no pasen el filtro de anexar_lote
+        for trabajador in (self.trabajador_recuperacion, self.trabajador_tallado):
+            if trabajador and trabajador.isRunning():
+                trabajador.cancelar()
+                trabajador.wait()
+        self.trabajador_recuperacion = None
+        self.trabajador_tallado = None
+
+    def _es_busqueda_actual(self):
+        emisor = self.sender()
+        return emisor is not None and (emisor is self.trabajador_recuperacion or emisor is self.trabajador_tallado)
+
+    def tallado_finalizado(self, total):
+        if self.sender() is not self.trabajador_tallado:
+            return
+        self.gestor_archivos.reordenar()
+        self.gestor_archivos.preparar_busqueda()
+        self.etiqueta_estado.setText(f"{self.trabajador_tallado.mensaje_fin}: {total} archivos recuperados")
+        self.barra_progreso.setValue(100)
+        self.boton_escanear.setEnabled(True)
+        self.boton_tallar.setEnabled(True)
+        self.boton_borrados.setEnabled(True)
+        self.combo_unidades.setEnabled(True)
+        self.boton_cancelar.setEnabled(False)
+        self.actualizar_boton_exportar()
+        self.panel_diagnostico.actualizar()
+
+    def pausar_escaneo(self, pausado):
+        if self.trabajador_recuperacion and self.trabajador_recuperacion.isRunning():
+            self.trabajador_recuperacion.pausar(pausado)
+            self.boton_pausar.setText(" Reanudar" if pausado else " Pausar")
+            if pausado:
+                self.etiqueta_estado.setText("Escaneo en pausa (el avance queda guardado)")
+
+    def cancelar_recuperacion(self):
+        if self.trabajador_recuperacion and self.trabajador_recuperacion.isRunning():
+            self.trabajador_recuperacion.cancelar()
+            self.etiqueta_estado.setText("Escaneo detenido: se podrá continuar al volver a escanear el mismo destino")
+            self.barra_progreso.setValue(0)
+        if self.trabajador_tallado and self.trabajador_tallado.isRunning():
+            self.trabajador_tallado.cancelar()
+            self.etiqueta_estado.setText("Búsqueda en crudo cancelada por el usuario")
+            self.barra_progreso.setValue(0)
+        if self.trabajador_tipos and self.trabajador_tipos.isRunning():
+            self.trabajador_tipos.cancelar()
+            self.etiqueta_estado.setText("Comprobación de tipos cancelada por el usuario")
+        if self.trabajador_duplicados and self.trabajador_duplicados.isRunning():
+            self.trabajador_duplicados.cancelar()
+            self.etiqueta_estado.setText("Búsqueda de duplicados cancelada por el usuario")
+        if self.trabajador_exportacion and self.trabajador_exportacion.isRunning():
+            self.trabajador_exportacion.cancelar()
+            self.etiqueta_estado.setText("Exportación cancelada por el usuario")
+        self.boton_escanear.setEnabled(True)
+        self.boton_tallar.setEnabled(True)
+        self.boton_borrados.setEnabled(True)
+        self.combo_unidades.setEnabled(True)
+        self.boton_cancelar.setEnabled(False)
+        self._desactivar_pausa()
+
+    def _desactivar_pausa(self):
+        self.boton_pausar.setChecked(False)
+        self.boton_pausar.setEnabled(False)
+
+    def alternar_vista_previa(self, visible):
+        self.panel_vista_previa.setVisible(visible)
+        self.gestor_archivos.activar_vista_previa(PanelVistaPrevia.LADO if visible else 0)
+
+    def actualizar_vista_previa(self):
+        self.panel_vista_previa.mostrar(*self.gestor_archivos.vista_previa())
+
+    def closeEvent(self, evento):
+        self.gestor_archivos.detener_miniaturas()
+        # Se espera al escaneo para que su punto de control quede escrito
+        if self.trabajador_recuperacion and self.trabajador_recuperacion.isRunning():
+            self.trabajador_recuperacion.cancelar()
+            self.trabajador_recuperacion.wait(5000)
+        super().closeEvent(evento)
+
+    def olvidar_indice(self):
+        # El próximo escaneo volverá a listar todos los directorios
+        if self.indice_escaneo is None:
+            return
+        try:
+            self.indice_escaneo.invalidar()
+            self.etiqueta_estado.setText("Índice de escaneo borrado")
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "Error", f"No se pudo borrar el índice:\n{e}")
+
+    def actualizar_progreso(self, valor, mensaje):
+        self.barra_progreso.setValue(valor)
+        self.etiqueta_estado.setText(mensaje)
+
+    def mostrar_desglose(self, lineas):
+        self.barra_progreso.setToolTip("\n".join(lineas))
+
+    def seleccionar_carpetas(self):
+        ruta = QFileDialog.getExistingDirectory(self, "Seleccionar carpeta (OK para añadir)")
+        if not ruta:
+            return
+        carpetas = [ruta]
+        añadir = QMessageBox.question(self, 'Añadir más', '¿Desea añadir otra carpeta a escanear?', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        while añadir == QMessageBox.Yes:
+            ruta_extra = QFileDialog.getExistingDirectory(self, "Seleccionar carpeta adicional")
+            if ruta_extra:
+                carpetas.append(ruta_extra)
+            añadir = QMessageBox.question(self, 'Añadir más', '¿Desea añadir otra carpeta a escanear?', QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        self._carpetas_seleccionadas = carpetas
+        self.iniciar_recuperacion(usando_carpetas=True)
+
+    def _toggle_marcar_todo(self):
+        if self.gestor_archivos.contar_marcados() == 0:
+            self.gestor_archivos.marcar_todo(True)
+        else:
+            self.gestor_archivos.marcar_todo(False)
+
+    def _toggle_marcar_coincidentes(self):
+        self.aplicar_filtro()
+        modelo = self.gestor_archivos.modelo
+        self.gestor_archivos.marcar_coincidentes(not modelo.coincidentes_marcados())
+
+    def aplicar_filtro(self):
+        self.temporizador_filtro.stop()
+        texto = self.campo_filtro.text()
+        try:
+            consulta = Consulta(texto)
+        except ValueError as e:
+            self.campo_filtro.setStyleSheet("border: 1px solid #D9534F;")
+            self.campo_filtro.setToolTip(str(e))
+            self.etiqueta_estado.setText(f"Filtro no válido: {e}")
+            return
+        self.campo_filtro.setStyleSheet("")
+        self.campo_filtro.setToolTip("")
+        if texto == self._texto_filtro:
+            return
+        self._texto_filtro = texto
+        # Las primeras filas salen ya; el resto llega en pasos y
+        # filtro_terminado pone el resultado
+        self._filtro_en_curso = (consulta, time.perf_counter())
+        if not consulta.vacia():
+            self.etiqueta_estado.setText("Filtrando…")
+        with self.diagnostico.fase("filtrar", "interfaz"):
+            self.gestor_archivos.filtrar_por_pasos(consulta)
+
+    def filtro_terminado(self, visibles):
+        if self._filtro_en_curso is None:
+            # Filtro rehecho por un escaneo o reordenación, no escrito ahora
+            return
+        consulta, inicio = self._filtro_en_curso
+        self._filtro_en_curso = None
+        if consulta.vacia():
+            self.etiqueta_estado.setText("Filtro quitado")
+        else:
+            total = len(self.gestor_archivos.modelo.almacen)
+            self.etiqueta_estado.setText(f"Filtro: {visibles} de {total} archivos "
+                                         f"({(time.perf_counter() - inicio) * 1000:.0f} ms)")
+
+    def anexar_lote(self, lote):
+        # Ignorar lotes de un escaneo o tallado ya sustituido por otro
+        if not self._es_busqueda_actual():
+            return
+        with self.diagnostico.fase("poblado árbol", "interfaz"):
+            self.gestor_archivos.anexar_archivos(lote)
+        self.diagnostico.contar('interfaz.lotes_recibidos')
+
+    def recuperacion_finalizada(self, lista_archivos):
+        if self.sender() is not self.trabajador_recuperacion:
+            return
+        self.gestor_archivos.agregar_archivos(lista_archivos)
+        self.escaneo_finalizado(len(lista_archivos))
+
+    def escaneo_finalizado(self, total):
+        # También se llama desde recuperacion_finalizada, con el mismo emisor
+        if self.sender() is not self.trabajador_recuperacion:
+            return
+        # Los lotes llegados durante el escaneo se añadieron al final
+        self.gestor_archivos.reordenar()
+        self.gestor_archivos.preparar_busqueda()
+        destinos = self.trabajador_recuperacion.planificador.destinos if self.trabajador_recuperacion else []
+        en_destinos = f" en {len(destinos)} destinos (detalle en la barra de progreso)" if len(destinos) > 1 else ""
+        self.etiqueta_estado.setText(f"Recuperación completada: {total} archivos encontrados{en_destinos}")
+        self.barra_progreso.setValue(100)
+        self.boton_escanear.setEnabled(True)
+        self.boton_tallar.setEnabled(True)
+        self.boton_borrados.setEnabled(True)
+        self.combo_unidades.setEnabled(True)
+        self.boton_cancelar.setEnabled(False)
+        self._desactivar_pausa()
+        self.boton_exportar.setEnabled(total > 0)
+        self.panel_diagnostico.actualizar()
+        if total > 0:
+            self.iniciar_tipos()
+
+    def iniciar_tipos(self):
+        # Lee solo la cabecera de los archivos sin extensión útil; después
+        # se buscan los duplicados
+        detector = DetectorTipos(cache=self.cache_tipos, diagnostico=self.diagnostico)
+        self.trabajador_tipos = TrabajadorTipos(self.gestor_archivos.modelo.almacen, detector)
+        self.trabajador_tipos.progreso_actualizado.connect(self.actualizar_progreso)
+        self.trabajador_tipos.tipos_detectados.connect(self.tipos_finalizados)
+        self.trabajador_tipos.error_ocurrido.connect(self.error_recuperacion)
+        self.boton_cancelar.setEnabled(True)
+        self.trabajador_tipos.start()
+
+    def tipos_finalizados(self, cambios):
+        if self.sender() is not self.trabajador_tipos:
+            return
+        with self.diagnostico.fase("reclasificar", "interfaz"):
+            self.gestor_archivos.reclasificar(cambios)
+        self.etiqueta_estado.setText(f"Tipo corregido por su contenido en {len(cambios)} archivos")
+        self.boton_cancelar.setEnabled(False)
+        self.panel_diagnostico.actualizar()
+        if len(self.gestor_archivos.modelo.almacen) > 1:
+            self.iniciar_duplicados()
+
+    def iniciar_duplicados(self):
+        # Comparación por contenido en segundo plano; la lista ya es utilizable
+        modelo = self.gestor_archivos.modelo
+        self.trabajador_duplicados = TrabajadorDuplicados(modelo.almacen.rutas, array('q', modelo.almacen.tamanos),
+                                                          diagnostico=self.diagnostico)
+        self.trabajador_duplicados.progreso_actualizado.connect(self.actualizar_progreso)
+        self.trabajador_duplicados.duplicados_encontrados.connect(self.duplicados_finalizados)
+        self.trabajador_duplicados.error_ocurrido.connect(self.error_recuperacion)
+        self.boton_cancelar.setEnabled(True)
+        self.trabajador_duplicados.start()
+
+    def duplicados_finalizados(self, grupos):
+        # Ignorar resultados de una búsqueda anterior a un nuevo escaneo
+        if self.sender() is not self.trabajador_duplicados:
+            return
+        with self.diagnostico.fase("agrupar duplicados", "interfaz"):
+            self.gestor_archivos.aplicar_duplicados(grupos)
+        self.etiqueta_estado.setText(f"Duplicados: {len(grupos)} grupos de archivos idénticos")
+        self.boton_cancelar.setEnabled(False)
+        self.panel_diagnostico.actualizar()
+
+    def error_recuperacion(self, mensaje_error):
+        QMessageBox.critical(self, "Error", f"Ocurrió un error durante la recuperación:\n{mensaje_error}")
+        self.etiqueta_estado.setText("Error durante la recuperación")
+        self.barra_progreso.setValue(0)
+        self.boton_escanear.setEnabled(True)
+        self.boton_tallar.setEnabled(True)
+        self.boton_borrados.setEnabled(True)
+        self.combo_unidades.setEnabled(True)
+        self.boton_cancelar.setEnabled(False)
+        self._desactivar_pausa()
+
+    def actualizar_boton_exportar(self):
+        # Habilitar si hay selección visible o checkboxes marcados
+        seleccionado = self.gestor_archivos.selectionModel().hasSelection()
+        marcados = self.gestor_archivos.contar_marcados() > 0
+        self.boton_exportar.setEnabled(seleccionado or marcados)
+
+    def exportar_archivos(self):
+        if self.gestor_archivos.contar_marcados() == 0:
+            registros = self.gestor_archivos.obtener_registros_seleccionados()
+        else:
+            registros = self.gestor_archivos.obtener_registros_marcados()
+
+        if not registros:
+            QMessageBox.information(self, "Exportar", "No hay archivos seleccionados para exportar")
+            return
+
+        destino_archivo = self.combo_destino.currentData()
+        if destino_archivo:
+            formato, comprimir = destino_archivo
+            extension = {('zip', False): 'zip', ('zip', True): 'zip', ('tar', False): 'tar', ('tar', True): 'tar.gz'}[destino_archivo]
+            carpeta_destino, _ = QFileDialog.getSaveFileName(self, "Guardar como", f"recuperados.{extension}",
+                                                             f"{extension.upper()} (*.{extension})")
+        else:
+            formato, comprimir = None, False
+            carpeta_destino = QFileDialog.getExistingDirectory(self, "Seleccionar carpeta destino")
+        if not carpeta_destino:
+            return
+
+        sin_hash = self.check_sin_hash.isChecked()
+        motor = MotorExportacion(algoritmo_hash=None if sin_hash else 'sha256',
+                                 verificar=self.check_verificar.isChecked() and not sin_hash,
+                                 diagnostico=self.diagnostico)
+        self.trabajador_exportacion = TrabajadorExportacion(registros, carpeta_destino, motor, formato, comprimir)
+        self.trabajador_exportacion.progreso_actualizado.connect(self.actualizar_progreso)
+        self.trabajador_exportacion.exportacion_completada.connect(self.exportacion_finalizada)
+        self.trabajador_exportacion.error_ocurrido.connect(self.error_exportacion)
+        self.boton_exportar.setEnabled(False)
+        self.boton_cancelar.setEnabled(True)
+        self.barra_progreso.setValue(0)
+        self.trabajador_exportacion.start()
+
+    def exportacion_finalizada(self, informe):
+        self.boton_cancelar.setEnabled(False)
+        self.actualizar_boton_exportar()
+        self.panel_diagnostico.actualizar()
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Information)
+        msg.setWindowTitle("Exportación cancelada" if informe.cancelado else "Exportación completada")
+        velocidad = GestorArchivos.formato_tamano(informe.bytes_copiados / max(informe.segundos, 1e-6))
+        msg.setText(f"Se exportaron {informe.exitos} archivos correctamente "
+                    f"({GestorArchivos.formato_tamano(informe.bytes_copiados)}, {velocidad}/s)")
+        avisos = []
+        if informe.ya_exportados:
+            avisos.append(f"{informe.ya_exportados} archivos ya estaban exportados y verificados")
+        if informe.errores:
+            avisos.append(f"{len(informe.errores)} archivos no pudieron exportarse (ver detalles)")
+        if avisos:
+            msg.setInformativeText("\n".join(avisos))
+        if informe.errores:
+            msg.setDetailedText("\n".join(f"{ruta}: {mensaje}" for ruta, mensaje in informe.errores))
+        msg.exec_()
+
+    def error_exportacion(self, mensaje_error):
+        QMessageBox.critical(self, "Error", f"Ocurrió un error durante la exportación:\n{mensaje_error}")
+        self.etiqueta_estado.setText("Error durante la exportación")
+        self.barra_progreso.setValue(0)
+        self.boton_cancelar.setEnabled(False)
+        self.actualizar_boton_exportar()
+
+def main():
+    app = QApplication(sys.argv)
+    app.setStyle('Fusion')
+    # Configurar estilos para QMessageBox
+    app.setStyleSheet("""
+        QMessageBox {
+            background-color: palette(window);
+        }
+        QMessageBox QLabel {
+            color: palette(window-text);
+        }
+        QMessageBox QPushButton {
+                    background-color: #6B4C3B;
+            color: white;
+            border: none;
+            padding: 5px 10px;
+            border-radius: 4px;
+            min-width: 80px;
+        }
+        QMessageBox QPushButton:hover {
+            background-color: #8C6A57;
+        }
+    """)
+    ventana = VentanaPrincipal()
+    ventana.show()
+    return app.exec_()
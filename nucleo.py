@@ -0,0 +1,2280 @@
+"""Núcleo de Pick & Restore: escaneo, duplicados y exportación sin interfaz.
+
+No importa Qt ni psutil al cargarse, de modo que puede usarse desde scripts
+o desde la línea de órdenes (python -m pick_restore). El progreso se informa
+con funciones de retorno y los resultados se entregan por iteradores.
+"""
+import os
+import re
+import queue
+import threading
+import time
+import json
+import hashlib
+import sqlite3
+import subprocess
+import shutil
+import errno
+import tarfile
+import zipfile
+import heapq
+import sys
+import locale
+import operator
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from array import array
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+
+class RegistroArchivo:
+    """Metadatos de un archivo encontrado, tomados una sola vez del escaneo."""
+    __slots__ = ('ruta', 'tamano', 'fecha', 'tipo')
+
+    def __init__(self, ruta, tamano, fecha, tipo=None):
+        self.ruta = ruta
+        self.tamano = tamano
+        self.fecha = fecha
+        # Tipo = extensión en minúsculas ('' si no tiene)
+        self.tipo = os.path.splitext(ruta)[1].lower() if tipo is None else tipo
+
+    def __repr__(self):
+        return f"RegistroArchivo({self.ruta!r}, {self.tamano}, {self.fecha}, {self.tipo!r})"
+
+    def existe(self):
+        return os.path.isfile(self.ruta)
+
+    def abrir(self):
+        return open(self.ruta, 'rb')
+
+    def copiar_a(self, destino, algoritmo_hash=None):
+        return copiar_archivo(self.ruta, destino, algoritmo_hash)
+
+    def como_dict(self):
+        return {'ruta': self.ruta, 'tamano': self.tamano, 'fecha': self.fecha, 'tipo': self.tipo}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        if 'tramos' in datos:
+            return RegistroBorrado(datos['origen'], datos['ruta'], [tuple(tramo) for tramo in datos['tramos']],
+                                   datos['tamano'], datos['fecha'], datos.get('integro', True))
+        if 'origen' in datos:
+            return RegistroTallado(datos['origen'], datos['desplazamiento'], datos['tamano'], datos['fecha'],
+                                   datos['tipo'])
+        return cls(datos['ruta'], datos['tamano'], datos['fecha'], datos.get('tipo'))
+
+
+class RegistroTallado(RegistroArchivo):
+    """Archivo recuperado por firma: tamano bytes de origen desde desplazamiento.
+
+    No existe como archivo; su ruta es virtual (una carpeta «<origen>.tallado»
+    con el desplazamiento en hexadecimal como nombre) y sirve para mostrarlo y
+    para darle un nombre al exportarlo.
+    """
+    __slots__ = ('origen', 'desplazamiento')
+    estado = "Tallado"
+
+    def __init__(self, origen, desplazamiento, tamano, fecha, tipo):
+        ruta = os.path.join(origen + ".tallado", f"{desplazamiento:012x}{tipo}")
+        super().__init__(ruta, tamano, fecha, tipo)
+        self.origen = origen
+        self.desplazamiento = desplazamiento
+
+    def __repr__(self):
+        return (f"RegistroTallado({self.origen!r}, {self.desplazamiento}, {self.tamano}, "
+                f"{self.fecha}, {self.tipo!r})")
+
+    def existe(self):
+        return os.path.exists(self.origen)
+
+    def abrir(self):
+        return _Tramo(self.origen, ((self.desplazamiento, self.tamano),))
+
+    def copiar_a(self, destino, algoritmo_hash=None):
+        resumen = hashlib.new(algoritmo_hash) if algoritmo_hash else None
+        with self.abrir() as fuente, open(destino, 'wb') as sumidero:
+            for bloque in iter(lambda: fuente.read(TAMANO_BUFER_COPIA), b''):
+                sumidero.write(bloque)
+                if resumen is not None:
+                    resumen.update(bloque)
+        os.utime(destino, (self.fecha, self.fecha))
+        return resumen.hexdigest() if resumen is not None else None
+
+    def como_dict(self):
+        datos = super().como_dict()
+        datos['origen'] = self.origen
+        datos['desplazamiento'] = self.desplazamiento
+        return datos
+
+
+class RegistroBorrado(RegistroTallado):
+    """Archivo borrado recuperado de las estructuras de su sistema de archivos.
+
+    Conserva su nombre y carpeta originales (bajo una ruta virtual
+    «<origen>.borrados») y sus datos son la lista de tramos (desplazamiento,
+    longitud) de origen. integro es False si parte de esos clústeres ya está
+    asignada a otro archivo, es decir, probablemente sobrescrita.
+    """
+    __slots__ = ('tramos', 'integro')
+
+    def __init__(self, origen, ruta, tramos, tamano, fecha, integro=True):
+        RegistroArchivo.__init__(self, ruta, tamano, fecha)
+        self.origen = origen
+        self.tramos = tramos
+        self.desplazamiento = tramos[0][0] if tramos else 0
+        self.integro = integro
+
+    def __repr__(self):
+        return f"RegistroBorrado({self.origen!r}, {self.ruta!r}, {len(self.tramos)} tramos, {self.tamano})"
+
+    @property
+    def estado(self):
+        return "Borrado" if self.integro else "Borrado (sobrescrito)"
+
+    def abrir(self):
+        return _Tramo(self.origen, self.tramos)
+
+    def como_dict(self):
+        datos = RegistroArchivo.como_dict(self)
+        datos['origen'] = self.origen
+        datos['tramos'] = [list(tramo) for tramo in self.tramos]
+        datos['integro'] = self.integro
+        return datos
+
+
+def leer_alineado(archivo, desplazamiento, n, alineacion=4096):
+    """Lee n bytes (menos al final) con lecturas alineadas a alineacion.
+
+    Los dispositivos crudos de Windows solo admiten lecturas alineadas a
+    sector; con os.pread las lecturas desde varios hilos no se pisan.
+    """
+    inicio = desplazamiento - desplazamiento % alineacion
+    fin = -(-(desplazamiento + n) // alineacion) * alineacion
+    if hasattr(os, 'pread'):
+        datos = os.pread(archivo.fileno(), fin - inicio, inicio)
+    else:
+        archivo.seek(inicio)
+        datos = archivo.read(fin - inicio)
+    return datos[desplazamiento - inicio:desplazamiento - inicio + n]
+
+
+class _Tramo:
+    """Archivo de solo lectura formado por tramos (desplazamiento, longitud) de ruta."""
+
+    def __init__(self, ruta, tramos):
+        self._archivo = open(ruta, 'rb', buffering=0)
+        self._tramos = deque(tramos)
+        self._posicion, self._restantes = self._tramos.popleft() if self._tramos else (0, 0)
+
+    def read(self, n=-1):
+        # Como mucho hasta el final del tramo actual; read() vacío = fin
+        while self._restantes == 0 and self._tramos:
+            self._posicion, self._restantes = self._tramos.popleft()
+        if n < 0 or n > self._restantes:
+            n = self._restantes
+        if n <= 0:
+            return b''
+        datos = leer_alineado(self._archivo, self._posicion, n)
+        if not datos:
+            raise OSError(f"El origen terminó antes de lo esperado: faltan {self._restantes} bytes")
+        self._posicion += len(datos)
+        self._restantes -= len(datos)
+        return datos
+
+    def close(self):
+        self._archivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.close()
+
+
+def escribir_registros(registros, flujo):
+    """Escribe registros como JSON Lines (un objeto por línea) en flujo."""
+    for registro in registros:
+        flujo.write(json.dumps(registro.como_dict(), ensure_ascii=False))
+        flujo.write('\n')
+
+
+def leer_registros(flujo):
+    """Generador de RegistroArchivo leídos de un flujo JSON Lines."""
+    for linea in flujo:
+        linea = linea.strip()
+        if linea:
+            yield RegistroArchivo.desde_dict(json.loads(linea))
+
+
+class AlmacenResultados:
+    """Resultados de un escaneo en columnas compactas, sin un objeto por archivo.
+
+    Cada archivo es un número (su orden de llegada). Las carpetas se guardan
+    una sola vez en una tabla y cada archivo apunta a la suya; los nombres van
+    en UTF-8 en un único bytearray, cada uno terminado en NUL (que no puede
+    aparecer en un nombre de archivo); tamaños, fechas y tipos son
+    arrays de C. Las rutas completas y los RegistroArchivo se construyen solo
+    cuando se piden, así que un archivo ocupa unos 50-70 bytes en vez de
+    varios objetos str (ruta, nombre, extensión) y un registro.
+
+    Los arrays solo crecen por el final, de modo que otro hilo puede leer los
+    archivos ya añadidos mientras se siguen añadiendo más.
+    """
+    # Archivos por trozo al buscar en los nombres
+    BLOQUE_BUSQUEDA = 1 << 16
+
+    def __init__(self):
+        self.carpetas = []
+        self._numero_carpeta = {}
+        self.extensiones = []
+        self._numero_extension = {}
+        self.padres = array('I')
+        self.tipos = array('I')
+        self._nombres = bytearray()
+        self._fin_nombres = array('q')
+        # Trozos de nombres en casefold (trozo_plegado), creados al buscar
+        self._plegados = {}
+        self.fechas = array('d')
+        self.tamanos = array('q')
+        # Registros sin archivo propio (tallados, borrados), por número de archivo
+        self.tallados = {}
+        self.rutas = _VistaRutas(self)
+        self._ultima_carpeta = self._ultimo_padre = None
+
+    def __len__(self):
+        return len(self.tamanos)
+
+    def anadir(self, registro):
+        """Añade un RegistroArchivo y devuelve su número de archivo."""
+        archivo = len(self.tamanos)
+        carpeta, nombre = os.path.split(registro.ruta)
+        # Los lotes del escaneo llegan agrupados por carpeta
+        if carpeta != self._ultima_carpeta:
+            padre = self._numero_carpeta.get(carpeta)
+            if padre is None:
+                padre = self._numero_carpeta[carpeta] = len(self.carpetas)
+                self.carpetas.append(carpeta)
+            self._ultima_carpeta, self._ultimo_padre = carpeta, padre
+        padre = self._ultimo_padre
+        tipo = self._numero_extension.get(registro.tipo)
+        if tipo is None:
+            tipo = self._numero_extension[registro.tipo] = len(self.extensiones)
+            self.extensiones.append(registro.tipo)
+        # surrogatepass conserva los nombres que no son UTF-8 válido
+        self._nombres += nombre.encode('utf-8', 'surrogatepass')
+        self._fin_nombres.append(len(self._nombres))
+        self._nombres.append(0)
+        self.padres.append(padre)
+        self.tipos.append(tipo)
+        self.fechas.append(registro.fecha)
+        if isinstance(registro, RegistroTallado):
+            self.tallados[archivo] = registro
+        # El último: len() solo cuenta el archivo cuando ya está completo
+        self.tamanos.append(registro.tamano)
+        return archivo
+
+    def nombre(self, archivo):
+        return self.nombre_utf8(archivo).decode('utf-8', 'surrogatepass')
+
+    def nombre_utf8(self, archivo):
+        inicio = self._fin_nombres[archivo - 1] + 1 if archivo else 0
+        return bytes(self._nombres[inicio:self._fin_nombres[archivo]])
+
+    def carpeta(self, archivo):
+        return self.carpetas[self.padres[archivo]]
+
+    def nombre_plegado(self, archivo):
+        """Nombre en casefold y UTF-8, para comparar sin distinguir mayúsculas."""
+        return self.nombre(archivo).casefold().encode('utf-8', 'surrogatepass')
+
+    def trozo_plegado(self, primero, ultimo):
+        """Nombres de los archivos [primero, ultimo) en casefold y UTF-8, separados por NUL.
+
+        Los trozos completos (BLOQUE_BUSQUEDA archivos desde un múltiplo de
+        BLOQUE_BUSQUEDA) se guardan: sus nombres ya no cambian. Los trozos
+        ASCII solo necesitan bytes.lower(); los demás, decodificar y casefold.
+        """
+        completo = ultimo - primero == self.BLOQUE_BUSQUEDA and primero % self.BLOQUE_BUSQUEDA == 0
+        if completo:
+            trozo = self._plegados.get(primero)
+            if trozo is not None:
+                return trozo
+        inicio = self._fin_nombres[primero - 1] + 1 if primero else 0
+        trozo = bytes(self._nombres[inicio:self._fin_nombres[ultimo - 1]])
+        if trozo.isascii():
+            trozo = trozo.lower()
+        else:
+            trozo = trozo.decode('utf-8', 'surrogatepass').casefold().encode('utf-8', 'surrogatepass')
+        if completo:
+            self._plegados[primero] = trozo
+        return trozo
+
+    def trozos_plegados(self, hasta=None, cancelado=lambda: False, desde=0):
+        """(primero, ultimo, trozo_plegado) de los archivos [0, hasta), por trozos.
+
+        Con desde se empieza por el trozo que contiene ese archivo.
+        """
+        hasta = len(self) if hasta is None else hasta
+        for primero in range(desde - desde % self.BLOQUE_BUSQUEDA, hasta, self.BLOQUE_BUSQUEDA):
+            if cancelado():
+                return
+            ultimo = min(hasta, primero + self.BLOQUE_BUSQUEDA)
+            yield primero, ultimo, self.trozo_plegado(primero, ultimo)
+
+    def buscar_en_nombres(self, texto, hasta=None):
+        """Máscara (1 = sí) de los archivos [0, hasta) cuyo nombre contiene texto (ver marcar_nombres)."""
+        mascara = bytearray(len(self) if hasta is None else hasta)
+        for _ in self.marcar_nombres(texto, mascara):
+            pass
+        return mascara
+
+    def marcar_nombres(self, texto, mascara, desde=0):
+        """Pone a 1 en mascara los archivos [desde, len(mascara)) cuyo nombre contiene texto.
+
+        Es un generador que avanza un trozo de BLOQUE_BUSQUEDA nombres por
+        paso, para poder repartir la búsqueda entre otras tareas. No distingue
+        mayúsculas de minúsculas (casefold: también Ñ/ñ, Á/á). Se busca en los
+        nombres plegados sin crear un objeto por nombre: si el texto aparece
+        poco se salta de aparición en aparición con find y se cuentan los NUL
+        anteriores; si aparece mucho, cada aparición pasa a ser un byte 0x01
+        y translate borra todo lo que no es NUL ni 0x01. Juntando las marcas
+        seguidas y cambiando 0x01 0x00 por 0x01 queda un byte por nombre: la
+        propia máscara.
+        """
+        hasta = len(mascara)
+        aguja = texto.casefold().encode('utf-8', 'surrogatepass')
+        if not aguja:
+            mascara[desde:] = b'\x01' * (hasta - desde)
+            return
+        if b'\0' in aguja:
+            return
+        # Para translate: qué bytes borrar y, si el texto es un solo byte, la
+        # tabla que lo convierte en la marca
+        if len(aguja) == 1:
+            borrar = bytes(range(1, 256)).replace(aguja, b'')
+            tabla = bytes(range(256)).replace(aguja, b'\x01')
+        else:
+            borrar, tabla = bytes(range(2, 256)), None
+        for primero, ultimo, bloque in self.trozos_plegados(hasta, desde=desde):
+            yield
+            if len(aguja) == 1:
+                apariciones = bloque.count(aguja)
+            else:
+                marcado = bloque.replace(aguja, b'\x01')
+                apariciones = (len(bloque) - len(marcado)) // (len(aguja) - 1)
+            if not apariciones:
+                continue
+            if apariciones * 16 < ultimo - primero:
+                archivo, corte = primero, 0
+                posicion = bloque.find(aguja)
+                while posicion >= 0:
+                    archivo += bloque.count(b'\0', corte, posicion)
+                    mascara[archivo] = 1
+                    corte = bloque.find(b'\0', posicion)
+                    if corte < 0:
+                        break
+                    archivo += 1
+                    corte += 1
+                    posicion = bloque.find(aguja, corte)
+            elif b'\x01' in bloque:
+                # Un nombre con 0x01 (casi nunca) confundiría las marcas
+                posiciones = map(bytes.find, bloque.split(b'\0'), repeat(aguja))
+                mascara[primero:ultimo] = bytes(map(operator.ge, posiciones, repeat(0)))
+            else:
+                marcas = bloque.translate(tabla, borrar) if tabla else marcado.translate(None, borrar)
+                while b'\x01\x01' in marcas:
+                    marcas = marcas.replace(b'\x01\x01', b'\x01')
+                mascara[primero:ultimo] = (marcas + b'\0').replace(b'\x01\0', b'\x01')
+
+    def ruta(self, archivo):
+        return os.path.join(self.carpetas[self.padres[archivo]], self.nombre(archivo))
+
+    def tipo(self, archivo):
+        return self.extensiones[self.tipos[archivo]]
+
+    def cambiar_tipo(self, archivo, tipo):
+        """Cambia el tipo de un archivo (p. ej. el detectado por su contenido)."""
+        numero = self._numero_extension.get(tipo)
+        if numero is None:
+            numero = self._numero_extension[tipo] = len(self.extensiones)
+            self.extensiones.append(tipo)
+        self.tipos[archivo] = numero
+
+    def registro(self, archivo):
+        tallado = self.tallados.get(archivo)
+        if tallado is not None:
+            return tallado
+        return RegistroArchivo(self.ruta(archivo), self.tamanos[archivo], self.fechas[archivo],
+                               self.extensiones[self.tipos[archivo]])
+
+    def ordenar(self, archivos, claves, descendente=False, cancelado=lambda: False):
+        """Posiciones de archivos en el orden dado por claves, o None si se cancela.
+
+        claves es una secuencia de 'nombre', 'tamano', 'fecha', 'ruta',
+        'tipo' o 'estado', de más a menos significativa. Es un orden estable:
+        se ordena por cada clave empezando por la última, siempre con la
+        función de clave en C (__getitem__ de una lista de valores).
+        """
+        orden = list(range(len(archivos)))
+        for clave in reversed(claves):
+            if cancelado():
+                return None
+            valores = self._valores(clave, archivos)
+            orden.sort(key=valores.__getitem__, reverse=descendente)
+        return orden
+
+    def _valores(self, clave, archivos):
+        if clave == 'tamano':
+            return list(map(self.tamanos.__getitem__, archivos))
+        if clave == 'fecha':
+            return list(map(self.fechas.__getitem__, archivos))
+        if clave == 'tipo':
+            return [self.extensiones[self.tipos[archivo]] for archivo in archivos]
+        if clave == 'nombre':
+            return [self.nombre(archivo).casefold() for archivo in archivos]
+        if clave == 'ruta':
+            return [self.ruta(archivo).casefold() for archivo in archivos]
+        if clave == 'estado':
+            return [self.tallados[archivo].estado if archivo in self.tallados else '' for archivo in archivos]
+        raise ValueError(f"Clave de orden desconocida: {clave!r}")
+
+    def memoria(self):
+        """Bytes aproximados que ocupan los datos del almacén."""
+        columnas = (self.padres, self.tipos, self._nombres, self._fin_nombres, self.fechas, self.tamanos)
+        tablas = sum(sys.getsizeof(carpeta) for carpeta in self.carpetas)
+        tablas += sys.getsizeof(self.carpetas) + sys.getsizeof(self._numero_carpeta)
+        tablas += sum(len(trozo) for trozo in list(self._plegados.values()))
+        return sum(sys.getsizeof(columna) for columna in columnas) + tablas
+
+
+class _VistaRutas:
+    """Secuencia de solo lectura con las rutas de un AlmacenResultados."""
+    __slots__ = ('_almacen',)
+
+    def __init__(self, almacen):
+        self._almacen = almacen
+
+    def __len__(self):
+        return len(self._almacen)
+
+    def __getitem__(self, archivo):
+        if archivo < 0:
+            archivo += len(self._almacen)
+        if not 0 <= archivo < len(self._almacen):
+            raise IndexError(archivo)
+        return self._almacen.ruta(archivo)
+
+
+def ruta_datos_app():
+    """Carpeta de datos locales de la aplicación (índices, cachés)."""
+    base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'PickRestore')
+
+
+class TablaPersistente:
+    """Base de las tablas persistentes (SQLite) en ruta_datos_app().
+
+    Una conexión por hilo; las filas nuevas se acumulan y se escriben por
+    lotes de LOTE_ESCRITURA con INSERT OR REPLACE. Cada subclase da NOMBRE
+    (el archivo), TABLA, COLUMNAS (lo que va dentro de CREATE TABLE) y
+    VERSION: si la versión guardada es otra, la tabla se descarta entera.
+    """
+    VERSION = 1
+    LOTE_ESCRITURA = 2000
+    NOMBRE = TABLA = COLUMNAS = None
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or os.path.join(ruta_datos_app(), self.NOMBRE)
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        self._local = threading.local()
+        self._cerrojo = threading.Lock()
+        self._pendientes = []
+        self._preparar()
+
+    def _conexion(self):
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexion = conexion
+        return conexion
+
+    def _preparar(self):
+        conexion = self._conexion()
+        with conexion:
+            conexion.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)')
+            fila = conexion.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()
+            if fila is None or fila[0] != str(self.VERSION):
+                # Formato distinto: se descarta lo guardado
+                conexion.execute(f'DROP TABLE IF EXISTS {self.TABLA}')
+                conexion.execute(f'CREATE TABLE {self.TABLA} ({self.COLUMNAS}) WITHOUT ROWID')
+                conexion.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(self.VERSION),))
+
+    def _anotar(self, fila):
+        with self._cerrojo:
+            self._pendientes.append(fila)
+            lleno = len(self._pendientes) >= self.LOTE_ESCRITURA
+        if lleno:
+            self.guardar()
+
+    def guardar(self):
+        """Escribe en disco las filas pendientes."""
+        with self._cerrojo:
+            pendientes, self._pendientes = self._pendientes, []
+        if pendientes:
+            conexion = self._conexion()
+            with conexion:
+                marcas = ','.join('?' * len(pendientes[0]))
+                conexion.executemany(f'INSERT OR REPLACE INTO {self.TABLA} VALUES ({marcas})', pendientes)
+
+    def _borrar(self, condicion='', parametros=()):
+        """Descarta lo pendiente y borra las filas que cumplen condicion (todas si no hay)."""
+        with self._cerrojo:
+            self._pendientes = []
+        conexion = self._conexion()
+        with conexion:
+            conexion.execute(f'DELETE FROM {self.TABLA} {condicion}', parametros)
+
+
+class IndiceEscaneo(TablaPersistente):
+    """Índice persistente (SQLite) de listados de directorio.
+
+    Cada directorio se guarda con clave (volumen, ruta), donde el volumen es
+    el st_dev del directorio, junto a su mtime. Si al volver a escanear el
+    mtime no ha cambiado, se reutiliza el listado sin leer el directorio.
+    Solo se detectan altas, bajas y renombrados: un archivo modificado en su
+    sitio no cambia el mtime del directorio y conserva el tamaño guardado.
+    """
+    NOMBRE = 'indice_escaneo.sqlite'
+    TABLA = 'directorios'
+    COLUMNAS = 'volumen TEXT, ruta TEXT, mtime REAL, listado TEXT, PRIMARY KEY (volumen, ruta)'
+
+    def consultar(self, volumen, ruta, mtime):
+        """Devuelve (subdirectorios, registros) guardados si el mtime coincide, si no None."""
+        fila = self._conexion().execute('SELECT mtime, listado FROM directorios WHERE volumen = ? AND ruta = ?',
+                                        (volumen, ruta)).fetchone()
+        if fila is None or fila[0] != mtime:
+            return None
+        nombres_dir, archivos = json.loads(fila[1])
+        return ([os.path.join(ruta, nombre) for nombre in nombres_dir],
+                [RegistroArchivo(os.path.join(ruta, nombre), tamano, fecha) for nombre, tamano, fecha in archivos])
+
+    def registrar(self, volumen, ruta, mtime, subdirectorios, archivos):
+        listado = json.dumps([[os.path.basename(d) for d in subdirectorios],
+                              [[os.path.basename(r.ruta), r.tamano, r.fecha] for r in archivos]])
+        self._anotar((volumen, ruta, mtime, listado))
+
+    def invalidar(self, volumen=None):
+        """Olvida los listados de un volumen (st_dev) o de todos."""
+        if volumen is None:
+            self._borrar()
+        else:
+            self._borrar('WHERE volumen = ?', (str(volumen),))
+
+
+class PuntoControl:
+    """Diario en disco de un escaneo, para continuarlo si se corta.
+
+    Cada directorio listado añade una línea JSON con sus subdirectorios y sus
+    archivos, así que la línea dice a la vez qué queda por recorrer y qué se
+    ha encontrado. Las líneas se acumulan en memoria y se escriben juntas
+    como mucho cada INTERVALO segundos; el archivo solo crece por el final.
+    Al reanudar se releen: los archivos se entregan de nuevo y la frontera
+    (raíces y subdirectorios vistos menos los ya listados) es lo que queda.
+    Una última línea a medias, de un cierre brusco, se descarta.
+
+    clave identifica el escaneo (la letra de unidad o la lista de rutas).
+    """
+    VERSION = 1
+    INTERVALO = 1.0
+
+    def __init__(self, clave, ruta=None, diagnostico=None):
+        self.clave = clave
+        if ruta is None:
+            nombre = hashlib.sha1(json.dumps(clave, ensure_ascii=False).encode('utf-8', 'surrogatepass')).hexdigest()
+            ruta = os.path.join(ruta_datos_app(), 'puntos_control', f"{nombre}.jsonl")
+        self.ruta = ruta
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+        # Directorios que quedan por listar tras reanudar (None: empezar de cero)
+        self.pendientes = None
+        self._fin_valido = 0
+        self._archivo = None
+        self._lineas = []
+        self._ultima_escritura = time.monotonic()
+        self._cerrojo = threading.Lock()
+        self._cerrojo_escritura = threading.Lock()
+
+    def existe(self):
+        return os.path.isfile(self.ruta)
+
+    def reanudar(self):
+        """Generador de los lotes de RegistroArchivo ya guardados.
+
+        Al terminar deja en pendientes la frontera guardada, o None si no
+        hay un diario válido para esta clave.
+        """
+        self.pendientes = None
+        self._fin_valido = 0
+        try:
+            archivo = open(self.ruta, 'rb')
+        except FileNotFoundError:
+            return
+        listados = set()
+        vistos = []
+        with archivo:
+            try:
+                cabecera = json.loads(archivo.readline())
+            except ValueError:
+                return
+            if cabecera.get('version') != self.VERSION or cabecera.get('clave') != self.clave:
+                return
+            raices = cabecera['raices']
+            self._fin_valido = archivo.tell()
+            with self.diagnostico.fase("reanudar punto de control"):
+                for linea in archivo:
+                    if not linea.endswith(b'\n'):
+                        break
+                    try:
+                        ruta, subdirectorios, archivos = json.loads(linea)
+                    except ValueError:
+                        break
+                    self._fin_valido += len(linea)
+                    listados.add(ruta)
+                    vistos.extend(os.path.join(ruta, nombre) for nombre in subdirectorios)
+                    self.diagnostico.contar('punto_control.directorios')
+                    if archivos:
+                        yield [RegistroArchivo(os.path.join(ruta, nombre), tamano, fecha)
+                               for nombre, tamano, fecha in archivos]
+        self.pendientes = [ruta for ruta in raices + vistos if ruta not in listados]
+
+    def abrir(self, raices):
+        """Prepara el diario para añadir líneas, tras reanudar() si lo había."""
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        if self.pendientes is None:
+            self._archivo = open(self.ruta, 'wb')
+            self._archivo.write(json.dumps({'version': self.VERSION, 'clave': self.clave, 'raices': list(raices)},
+                                           ensure_ascii=False).encode('utf-8', 'surrogatepass') + b'\n')
+        else:
+            self._archivo = open(self.ruta, 'r+b')
+            # Lo que siga a la última línea completa se sobrescribe
+            self._archivo.truncate(self._fin_valido)
+            self._archivo.seek(self._fin_valido)
+        self._archivo.flush()
+
+    def anotar(self, ruta, subdirectorios, archivos):
+        """Añade un directorio listado; se puede llamar desde varios hilos."""
+        linea = json.dumps([ruta, [os.path.basename(d) for d in subdirectorios],
+                            [[os.path.basename(r.ruta), r.tamano, r.fecha] for r in archivos]],
+                           ensure_ascii=False)
+        with self._cerrojo:
+            self._lineas.append(linea)
+            toca = time.monotonic() - self._ultima_escritura >= self.INTERVALO
+        if toca:
+            self.guardar()
+
+    def guardar(self):
+        """Escribe las líneas acumuladas."""
+        with self._cerrojo:
+            lineas, self._lineas = self._lineas, []
+            self._ultima_escritura = time.monotonic()
+        if not lineas:
+            return
+        with self._cerrojo_escritura:
+            if self._archivo is None:
+                return
+            with self.diagnostico.fase("punto de control", "escritura"):
+                self._archivo.write(('\n'.join(lineas) + '\n').encode('utf-8', 'surrogatepass'))
+                self._archivo.flush()
+
+    def cerrar(self):
+        self.guardar()
+        with self._cerrojo_escritura:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+    def borrar(self):
+        """Cierra y elimina el diario (el escaneo ha terminado o se descarta)."""
+        self.cerrar()
+        with self._cerrojo:
+            self._lineas = []
+        try:
+            os.remove(self.ruta)
+        except FileNotFoundError:
+            pass
+        self.pendientes = None
+
+
+class Diagnostico:
+    """Tiempos por fase, contadores y rutas más lentas de una operación.
+
+    Se puede usar desde varios hilos a la vez. Cada fase queda como evento de
+    una traza en formato Chrome (chrome://tracing, Perfetto) además de sumarse
+    a su total; los contadores y las rutas más lentas van al final de la traza.
+    """
+    MAX_EVENTOS = 20000
+
+    def __init__(self, max_lentos=20):
+        self.max_lentos = max_lentos
+        self.tiempos = {}
+        self.contadores = {}
+        self._lentos = {}
+        self._eventos = []
+        self._hilos = {}
+        self._t0 = time.perf_counter()
+        self._cerrojo = threading.Lock()
+
+    @contextmanager
+    def fase(self, nombre, categoria='fase'):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.anotar_fase(nombre, inicio, time.perf_counter(), categoria)
+
+    def anotar_fase(self, nombre, inicio, fin, categoria='fase'):
+        """Registra una fase medida con time.perf_counter()."""
+        hilo = threading.current_thread()
+        with self._cerrojo:
+            self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + (fin - inicio)
+            if len(self._eventos) < self.MAX_EVENTOS:
+                self._hilos.setdefault(hilo.ident, hilo.name)
+                self._eventos.append((nombre, categoria, inicio, fin, hilo.ident))
+
+    def contar(self, nombre, cantidad=1):
+        with self._cerrojo:
+            self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def error(self, ambito, excepcion):
+        """Cuenta un error por su código errno (o por su tipo si no tiene)."""
+        codigo = getattr(excepcion, 'errno', None)
+        self.contar(f"{ambito}.errores.{errno.errorcode.get(codigo, type(excepcion).__name__)}")
+
+    def anotar_lento(self, categoria, ruta, inicio, fin):
+        """Conserva las max_lentos rutas que más han tardado en cada categoría."""
+        segundos = fin - inicio
+        lentos = self._lentos.get(categoria)
+        # Descarte rápido sin cerrojo: la gran mayoría no entra en la lista
+        if lentos is not None and len(lentos) >= self.max_lentos and segundos <= lentos[0][0]:
+            return
+        elemento = (segundos, ruta, inicio, threading.get_ident())
+        with self._cerrojo:
+            lentos = self._lentos.setdefault(categoria, [])
+            if len(lentos) < self.max_lentos:
+                heapq.heappush(lentos, elemento)
+            elif segundos > lentos[0][0]:
+                heapq.heapreplace(lentos, elemento)
+
+    def mas_lentos(self, categoria):
+        """[(segundos, ruta), ...] de la categoría, del más lento al más rápido."""
+        with self._cerrojo:
+            lentos = sorted(self._lentos.get(categoria, ()), reverse=True)
+        return [(segundos, ruta) for segundos, ruta, _, _ in lentos]
+
+    def resumen(self):
+        with self._cerrojo:
+            categorias = list(self._lentos)
+            resumen = {'tiempos': dict(self.tiempos), 'contadores': dict(self.contadores)}
+        resumen['lentos'] = {categoria: self.mas_lentos(categoria) for categoria in categorias}
+        return resumen
+
+    def traza(self):
+        """Diccionario en formato Chrome trace (tiempos en microsegundos)."""
+        pid = os.getpid()
+        resumen = self.resumen()
+        with self._cerrojo:
+            eventos = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': nombre}}
+                       for tid, nombre in self._hilos.items()]
+            for nombre, categoria, inicio, fin, tid in self._eventos:
+                eventos.append({'name': nombre, 'cat': categoria, 'ph': 'X', 'pid': pid, 'tid': tid,
+                                'ts': (inicio - self._t0) * 1e6, 'dur': (fin - inicio) * 1e6})
+            for categoria, lentos in self._lentos.items():
+                for segundos, ruta, inicio, tid in lentos:
+                    eventos.append({'name': ruta, 'cat': categoria, 'ph': 'X', 'pid': pid, 'tid': tid,
+                                    'ts': (inicio - self._t0) * 1e6, 'dur': segundos * 1e6})
+            eventos.append({'name': 'contadores', 'ph': 'C', 'pid': pid, 'tid': 0,
+                            'ts': (time.perf_counter() - self._t0) * 1e6,
+                            'args': dict(self.contadores)})
+        return {'traceEvents': eventos, 'displayTimeUnit': 'ms', 'otherData': resumen}
+
+    def exportar_traza(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(self.traza(), f, ensure_ascii=False)
+
+
+class _SinDiagnostico:
+    """Diagnostico que no anota nada, para cuando nadie lo va a consultar."""
+
+    def fase(self, nombre, categoria='fase'):
+        return nullcontext()
+
+    def anotar_fase(self, nombre, inicio, fin, categoria='fase'):
+        pass
+
+    def contar(self, nombre, cantidad=1):
+        pass
+
+    def error(self, ambito, excepcion):
+        pass
+
+    def anotar_lento(self, categoria, ruta, inicio, fin):
+        pass
+
+
+SIN_DIAGNOSTICO = _SinDiagnostico()
+
+
+class MotorEscaneo:
+    """Motor de escaneo basado en os.scandir.
+
+    Reparte los directorios pendientes entre varios hilos. Cada hilo tiene su
+    propia cola (toma del final) y, cuando se queda sin trabajo, roba
+    directorios del principio de las colas de los demás hilos. Los archivos
+    encontrados se entregan por lotes (uno por directorio) como RegistroArchivo,
+    reutilizando los datos de stat de DirEntry. Con un IndiceEscaneo, los
+    directorios cuyo mtime no ha cambiado se toman del índice sin listarlos.
+    Con un Diagnostico se cuentan directorios, stat y errores y se anotan los
+    directorios más lentos.
+    """
+
+    def __init__(self, num_hilos=None, max_lotes_pendientes=64, indice=None, diagnostico=None):
+        self.num_hilos = num_hilos or min(32, (os.cpu_count() or 1) * 4)
+        self.max_lotes_pendientes = max_lotes_pendientes
+        self.indice = indice
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+
+    def escanear(self, rutas, cancelado=lambda: False, punto_control=None, pausado=lambda: False):
+        """Generador de lotes de RegistroArchivo de archivos con tamaño > 0.
+
+        Se detiene en cuanto cancelado() devuelve True o el consumidor deja de
+        iterar. Mientras pausado() es True los hilos no empiezan directorios
+        nuevos. Con un PuntoControl se entregan primero los lotes guardados,
+        se sigue desde donde se quedó y se anota cada directorio listado; el
+        diario se borra solo si el recorrido termina.
+        """
+        if punto_control is not None:
+            yield from punto_control.reanudar()
+            if cancelado():
+                return
+            punto_control.abrir(rutas)
+            if punto_control.pendientes is not None:
+                rutas = punto_control.pendientes
+        lotes = self.recorrer(rutas, cancelado, punto_control, pausado)
+        completo = False
+        try:
+            yield from lotes
+            completo = not cancelado()
+        finally:
+            lotes.close()
+            if punto_control is not None:
+                if completo:
+                    punto_control.borrar()
+                else:
+                    punto_control.cerrar()
+
+    def recorrer(self, rutas, cancelado=lambda: False, diario=None, pausado=lambda: False, hilos=None):
+        """Recorre rutas con hilos hilos (por defecto num_hilos) y entrega sus lotes.
+
+        Es el recorrido de escanear() sin reanudar ni cerrar el diario: con
+        un PuntoControl ya abierto solo se anotan en él los directorios.
+        """
+        n = max(1, hilos or self.num_hilos)
+        colas = [deque() for _ in range(n)]
+        condicion = threading.Condition()
+        estado = {'pendientes': 0}
+        detener = threading.Event()
+        resultados = queue.Queue(maxsize=self.max_lotes_pendientes)
+        fin = object()
+        diagnostico = self.diagnostico
+
+        for i, ruta in enumerate(rutas):
+            colas[i % n].append(ruta)
+            estado['pendientes'] += 1
+
+        def debe_parar():
+            return detener.is_set() or cancelado()
+
+        def tomar(idx):
+            try:
+                return colas[idx].pop()
+            except IndexError:
+                pass
+            for desplazamiento in range(1, n):
+                try:
+                    return colas[(idx + desplazamiento) % n].popleft()
+                except IndexError:
+                    continue
+            return None
+
+        def entregar(elemento):
+            while not debe_parar():
+                try:
+                    resultados.put(elemento, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def trabajador(idx):
+            try:
+                while not debe_parar():
+                    if pausado():
+                        if diario is not None:
+                            diario.guardar()
+                        time.sleep(0.1)
+                        continue
+                    ruta = tomar(idx)
+                    if ruta is None:
+                        with condicion:
+                            if estado['pendientes'] == 0:
+                                return
+                            condicion.wait(0.05)
+                        continue
+                    inicio = time.perf_counter()
+                    subdirectorios, lote = self._listar_indexado(ruta)
+                    diagnostico.anotar_lento('directorios', ruta, inicio, time.perf_counter())
+                    if diario is not None:
+                        diario.anotar(ruta, subdirectorios, lote)
+                    with condicion:
+                        # Se cuentan antes de publicarlos para que ningún hilo
+                        # vea el contador a cero mientras aún hay trabajo.
+                        estado['pendientes'] += len(subdirectorios)
+                    colas[idx].extend(subdirectorios)
+                    with condicion:
+                        estado['pendientes'] -= 1
+                        if subdirectorios or estado['pendientes'] == 0:
+                            condicion.notify_all()
+                    if lote:
+                        entregar(lote)
+            finally:
+                # El centinela debe llegar siempre, salvo si ya nadie consume
+                while not detener.is_set():
+                    try:
+                        resultados.put(fin, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+
+        hilos = [threading.Thread(target=trabajador, args=(i,), daemon=True) for i in range(n)]
+        for hilo in hilos:
+            hilo.start()
+        activos = n
+        try:
+            while activos:
+                try:
+                    elemento = resultados.get(timeout=0.1)
+                except queue.Empty:
+                    if cancelado():
+                        return
+                    continue
+                if elemento is fin:
+                    activos -= 1
+                    continue
+                if cancelado():
+                    return
+                yield elemento
+        finally:
+            detener.set()
+            with condicion:
+                condicion.notify_all()
+            if self.indice is not None:
+                self.indice.guardar()
+            if diario is not None:
+                # Los hilos pueden estar aún anotando su último directorio
+                limite = time.monotonic() + 2.0
+                for hilo in hilos:
+                    hilo.join(max(0.0, limite - time.monotonic()))
+
+    def _listar_indexado(self, ruta):
+        if self.indice is None:
+            return self._listar(ruta, self.diagnostico) or ([], [])
+        try:
+            st = os.stat(ruta)
+        except OSError as e:
+            self.diagnostico.error('escaneo', e)
+            return [], []
+        volumen = str(st.st_dev)
+        guardado = self.indice.consultar(volumen, ruta, st.st_mtime)
+        if guardado is not None:
+            self.diagnostico.contar('escaneo.indice_aciertos')
+            return guardado
+        listado = self._listar(ruta, self.diagnostico)
+        if listado is None:
+            return [], []
+        # Se guarda el mtime leído antes de listar: un cambio durante el
+        # listado dejará el directorio como modificado en el próximo escaneo
+        self.indice.registrar(volumen, ruta, st.st_mtime, *listado)
+        return listado
+
+    @staticmethod
+    def _listar(ruta, diagnostico=SIN_DIAGNOSTICO):
+        """Lista un directorio devolviendo (subdirectorios, [RegistroArchivo, ...]).
+
+        Devuelve None si el directorio no se puede leer.
+        """
+        subdirectorios = []
+        archivos = []
+        llamadas_stat = 0
+        try:
+            with os.scandir(ruta) as entradas:
+                for entrada in entradas:
+                    try:
+                        es_directorio = entrada.is_dir()
+                    except OSError:
+                        es_directorio = False
+                    if es_directorio:
+                        # Igual que os.walk: no se siguen enlaces a directorios
+                        if not entrada.is_symlink():
+                            subdirectorios.append(entrada.path)
+                        continue
+                    llamadas_stat += 1
+                    try:
+                        st = entrada.stat()
+                    except OSError as e:
+                        diagnostico.error('escaneo.stat', e)
+                        continue
+                    if st.st_size > 0:
+                        archivos.append(RegistroArchivo(entrada.path, st.st_size, st.st_mtime))
+        except OSError as e:
+            diagnostico.error('escaneo', e)
+            return None
+        finally:
+            diagnostico.contar('escaneo.directorios')
+            diagnostico.contar('escaneo.stat', llamadas_stat)
+        return subdirectorios, archivos
+
+
+def _contiene(carpeta, ruta):
+    """True si ruta es carpeta o está dentro de ella (ambas normalizadas)."""
+    return ruta == carpeta or ruta.startswith(carpeta.rstrip('/' + os.sep) + os.sep)
+
+
+def sin_solapar(rutas):
+    """rutas sin repetidas ni contenidas en otra de la lista, en su orden.
+
+    Recorrer una carpeta y otra que está dentro de ella daría sus archivos dos
+    veces.
+    """
+    normalizadas = [os.path.normcase(os.path.abspath(ruta)) for ruta in rutas]
+    resultado = []
+    for i, (ruta, normal) in enumerate(zip(rutas, normalizadas)):
+        if any(_contiene(otra, normal) and (otra != normal or j < i) for j, otra in enumerate(normalizadas) if j != i):
+            continue
+        resultado.append(ruta)
+    return resultado
+
+
+def _disco_de_particion(dispositivo):
+    """Disco físico de una partición según /sys (/dev/sda1 -> sda); fuera de Linux, el propio dispositivo."""
+    bloque = os.path.realpath(os.path.join('/sys/class/block', os.path.basename(os.path.realpath(dispositivo))))
+    if not os.path.isdir(bloque):
+        return dispositivo
+    if os.path.exists(os.path.join(bloque, 'partition')):
+        return os.path.basename(os.path.dirname(bloque))
+    return os.path.basename(bloque)
+
+
+def agrupar_por_disco(rutas):
+    """Reparte rutas por disco físico: [(disco, [rutas...]), ...] en orden de aparición.
+
+    El volumen de cada ruta (st_dev) se busca entre las particiones montadas
+    de psutil y, en Linux, se sube de la partición a su disco. Sin psutil, o
+    si el volumen no aparece (p. ej. una red), cada volumen cuenta como un
+    disco; en Windows también, porque las letras no dicen qué disco las
+    contiene. Una ruta que no se puede leer va sola en su grupo.
+    """
+    volumenes = {}
+    try:
+        import psutil
+        particiones = psutil.disk_partitions()
+    except (ImportError, OSError):
+        particiones = []
+    for particion in particiones:
+        try:
+            volumenes.setdefault(os.stat(particion.mountpoint).st_dev, particion.device)
+        except OSError:
+            continue
+    grupos = {}
+    for ruta in rutas:
+        try:
+            volumen = os.stat(ruta).st_dev
+        except OSError:
+            disco = ruta
+        else:
+            dispositivo = volumenes.get(volumen)
+            disco = _disco_de_particion(dispositivo) if dispositivo else f"volumen {volumen}"
+        grupos.setdefault(disco, []).append(ruta)
+    return list(grupos.items())
+
+
+def disco_lento(disco):
+    """True si /sys dice que el disco es giratorio o extraíble (solo Linux)."""
+    for atributo in ('queue/rotational', 'removable'):
+        try:
+            with open(os.path.join('/sys/block', disco, atributo)) as f:
+                if f.read().strip() == '1':
+                    return True
+        except (OSError, ValueError):
+            continue
+    return False
+
+
+class DestinoEscaneo:
+    """Lo encontrado en uno de los destinos de un PlanificadorEscaneo."""
+    __slots__ = ('ruta', 'disco', 'estado', 'archivos', 'bytes')
+
+    def __init__(self, ruta, disco):
+        self.ruta = ruta
+        self.disco = disco
+        # 'pendiente', 'escaneando', 'terminado' o 'detenido'
+        self.estado = 'pendiente'
+        self.archivos = 0
+        self.bytes = 0
+
+    def __repr__(self):
+        return f"DestinoEscaneo({self.ruta!r}, {self.disco!r}, {self.estado!r}, {self.archivos}, {self.bytes})"
+
+
+class PlanificadorEscaneo:
+    """Recorre varios destinos a la vez, un recorrido por disco físico.
+
+    Los destinos se agrupan con agrupar_por_disco. Cada disco tiene su propio
+    recorrido, en paralelo con los de los demás discos, y sus destinos se
+    recorren uno tras otro: dos recorridos sobre el mismo disco mecánico o la
+    misma memoria USB se estorban más de lo que se ayudan. Los discos lentos
+    (disco_lento) usan HILOS_DISCO_LENTO hilos y el resto los del motor. Los
+    lotes de todos llegan mezclados por un solo iterador y destinos lleva la
+    cuenta de cada uno.
+    """
+    HILOS_DISCO_LENTO = 2
+
+    def __init__(self, motor=None, max_lotes_pendientes=64):
+        self.motor = motor or MotorEscaneo()
+        self.max_lotes_pendientes = max_lotes_pendientes
+        self.destinos = []
+
+    def escanear(self, rutas, cancelado=lambda: False, punto_control=None, pausado=lambda: False):
+        """Generador de (DestinoEscaneo, lote de RegistroArchivo).
+
+        cancelado, punto_control y pausado funcionan como en
+        MotorEscaneo.escanear; el punto de control es uno para todos los
+        destinos.
+        """
+        rutas = sin_solapar(rutas)
+        disco_de = {ruta: disco for disco, grupo in agrupar_por_disco(rutas) for ruta in grupo}
+        self.destinos = [DestinoEscaneo(ruta, disco_de[ruta]) for ruta in rutas]
+        raices = {destino.ruta: [destino.ruta] for destino in self.destinos}
+        if punto_control is not None:
+            for lote in punto_control.reanudar():
+                destino = self._destino_de(lote[0].ruta)
+                self._sumar(destino, lote)
+                yield destino, lote
+            if cancelado():
+                return
+            punto_control.abrir(rutas)
+            if punto_control.pendientes is not None:
+                raices = {destino.ruta: [] for destino in self.destinos}
+                for ruta in punto_control.pendientes:
+                    raices[self._destino_de(ruta).ruta].append(ruta)
+
+        discos = {}
+        for destino in self.destinos:
+            discos.setdefault(destino.disco, []).append(destino)
+        resultados = queue.Queue(maxsize=self.max_lotes_pendientes)
+        detener = threading.Event()
+        fin = object()
+
+        def debe_parar():
+            return detener.is_set() or cancelado()
+
+        def entregar(elemento):
+            while not detener.is_set():
+                try:
+                    resultados.put(elemento, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def recorrer_disco(disco, destinos):
+            hilos = self.HILOS_DISCO_LENTO if disco_lento(disco) else None
+            try:
+                for destino in destinos:
+                    if debe_parar():
+                        break
+                    destino.estado = 'escaneando'
+                    lotes = self.motor.recorrer(raices[destino.ruta], debe_parar, punto_control, pausado, hilos)
+                    try:
+                        for lote in lotes:
+                            if not entregar((destino, lote)):
+                                break
+                    finally:
+                        lotes.close()
+                    destino.estado = 'detenido' if debe_parar() else 'terminado'
+            except Exception as e:
+                # Se relanza en el hilo que consume
+                entregar(e)
+            finally:
+                entregar(fin)
+
+        hilos = [threading.Thread(target=recorrer_disco, args=grupo, daemon=True, name=f"disco {grupo[0]}")
+                 for grupo in discos.items()]
+        for hilo in hilos:
+            hilo.start()
+        activos = len(hilos)
+        completo = False
+        try:
+            while activos:
+                try:
+                    elemento = resultados.get(timeout=0.1)
+                except queue.Empty:
+                    if cancelado():
+                        return
+                    continue
+                if elemento is fin:
+                    activos -= 1
+                    continue
+                if isinstance(elemento, Exception):
+                    raise elemento
+                if cancelado():
+                    return
+                destino, lote = elemento
+                self._sumar(destino, lote)
+                yield elemento
+            completo = not cancelado()
+        finally:
+            detener.set()
+            # Cada recorrido espera a sus hilos al cerrarse
+            limite = time.monotonic() + 3.0
+            for hilo in hilos:
+                hilo.join(max(0.0, limite - time.monotonic()))
+            if punto_control is not None:
+                if completo:
+                    punto_control.borrar()
+                else:
+                    punto_control.cerrar()
+
+    def _destino_de(self, ruta):
+        normal = os.path.normcase(os.path.abspath(ruta))
+        for destino in self.destinos:
+            if _contiene(os.path.normcase(os.path.abspath(destino.ruta)), normal):
+                return destino
+        return self.destinos[0]
+
+    @staticmethod
+    def _sumar(destino, lote):
+        destino.archivos += len(lote)
+        destino.bytes += sum(registro.tamano for registro in lote)
+
+    def desglose(self):
+        """Una línea por destino con lo encontrado y su estado."""
+        return [f"{destino.ruta}: {destino.archivos} archivos, {formato_tamano(destino.bytes)} ({destino.estado})"
+                for destino in self.destinos]
+
+
+def _sumar_estimacion(total, parcial):
+    return None if total is None or parcial is None else total + parcial
+
+
+def _estimar_volumen(ruta):
+    """(archivos, bytes) usados en el volumen montado en ruta; cualquiera puede ser None."""
+    try:
+        import psutil
+        usados = psutil.disk_usage(ruta).used
+    except Exception:
+        usados = None
+    try:
+        vfs = os.statvfs(ruta)
+        archivos = vfs.f_files - vfs.f_ffree
+    except (AttributeError, OSError):
+        archivos = None
+    return archivos, usados
+
+
+def _preconteo(ruta, limite, cancelado):
+    """(archivos, bytes) bajo ruta sin stat por archivo, o (None, None) si se agota el tiempo.
+
+    En Windows el tamaño viene ya en el listado del directorio y se suma;
+    en el resto haría falta un stat por archivo y queda en None.
+    """
+    archivos = 0
+    bytes_ = 0 if os.name == 'nt' else None
+    pendientes = [ruta]
+    while pendientes:
+        if cancelado() or time.monotonic() > limite:
+            return None, None
+        try:
+            with os.scandir(pendientes.pop()) as entradas:
+                for entrada in entradas:
+                    try:
+                        if entrada.is_dir(follow_symlinks=False):
+                            pendientes.append(entrada.path)
+                            continue
+                        if bytes_ is not None:
+                            bytes_ += entrada.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+                    archivos += 1
+        except OSError:
+            continue
+    return archivos, bytes_
+
+
+def estimar_totales(rutas, limite_segundos=2.0, cancelado=lambda: False):
+    """Estima (archivos, bytes) a recorrer en rutas; cualquiera puede ser None.
+
+    Para raíces de volumen se usa el uso del sistema de archivos (bytes usados
+    de psutil e inodos ocupados de statvfs cuando existe). Para carpetas se hace
+    un preconteo rápido sin stat, abandonado si supera limite_segundos. Cada
+    total se da solo si se conoce para todas las rutas.
+    """
+    total_archivos = 0
+    total_bytes = 0
+    limite = time.monotonic() + limite_segundos
+    for ruta in rutas:
+        if os.path.ismount(ruta):
+            archivos, bytes_ = _estimar_volumen(ruta)
+        else:
+            archivos, bytes_ = _preconteo(ruta, limite, cancelado)
+        total_archivos = _sumar_estimacion(total_archivos, archivos)
+        total_bytes = _sumar_estimacion(total_bytes, bytes_)
+        if total_archivos is None and total_bytes is None:
+            return None, None
+    return total_archivos, total_bytes
+
+
+class ReportadorProgreso:
+    """Agrupa el progreso del escaneo y lo publica a una frecuencia fija.
+
+    Calcula el porcentaje contra los totales estimados (bytes si se conocen,
+    si no número de archivos), la velocidad en archivos/s y bytes/s y el tiempo
+    restante. El porcentaje se reparte en el tramo [inicio, fin] de la barra.
+    """
+
+    def __init__(self, total_archivos=None, total_bytes=None, frecuencia=10.0, inicio=50, fin=99,
+                 descripcion="Encontrados"):
+        self.total_archivos = total_archivos
+        self.total_bytes = total_bytes
+        self.intervalo = 1.0 / frecuencia
+        self.inicio = inicio
+        self.fin = fin
+        self.descripcion = descripcion
+        self.archivos = 0
+        self.bytes = 0
+        self._t0 = time.monotonic()
+        self._ultimo = 0.0
+
+    def registrar(self, archivos, bytes_):
+        """Suma un lote; devuelve (valor, mensaje) si toca publicar, si no None."""
+        self.archivos += archivos
+        self.bytes += bytes_
+        ahora = time.monotonic()
+        if ahora - self._ultimo < self.intervalo:
+            return None
+        self._ultimo = ahora
+        return self.estado(ahora)
+
+    def fraccion(self):
+        if self.total_bytes:
+            return min(self.bytes / self.total_bytes, 1.0)
+        if self.total_archivos:
+            return min(self.archivos / self.total_archivos, 1.0)
+        return None
+
+    def estado(self, ahora=None):
+        transcurrido = max((ahora or time.monotonic()) - self._t0, 1e-6)
+        por_segundo = self.archivos / transcurrido
+        bytes_por_segundo = self.bytes / transcurrido
+        fraccion = self.fraccion()
+        if fraccion is None:
+            valor = self.inicio
+            eta = "--:--:--"
+        else:
+            valor = min(self.inicio + int((self.fin - self.inicio) * fraccion), self.fin)
+            eta = formato_duracion(transcurrido * (1 - fraccion) / fraccion) if fraccion > 0 else "--:--:--"
+        mensaje = (f"{self.descripcion} {self.archivos} archivos · {por_segundo:.0f} arch/s · "
+                   f"{formato_tamano(bytes_por_segundo)}/s · ETA {eta}")
+        return valor, mensaje
+
+
+def formato_duracion(segundos):
+    segundos = int(segundos)
+    return f"{segundos // 3600:02d}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+def formato_tamano(tamano_bytes):
+    for unidad in ['B', 'KB', 'MB', 'GB']:
+        if tamano_bytes < 1024.0:
+            return f"{tamano_bytes:.2f} {unidad}"
+        tamano_bytes /= 1024.0
+    return f"{tamano_bytes:.2f} TB"
+
+
+def formato_fecha(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def porcentaje_en_linea(linea):
+    """Porcentaje que anuncia una línea de salida (chkdsk y similares), o None.
+
+    Entiende "Total: 30%" de las versiones recientes de chkdsk y, si no,
+    se queda con el último "NN %", "NN percent" o "NN por ciento".
+    """
+    total = re.search(r'Total:\s*(\d{1,3})\s*%', linea)
+    if total:
+        return min(int(total.group(1)), 100)
+    porcentajes = re.findall(r'(\d{1,3})\s*(?:%|percent|por ciento)', linea, re.IGNORECASE)
+    return min(int(porcentajes[-1]), 100) if porcentajes else None
+
+
+class PasoExterno:
+    """Orden externa que prepara una unidad antes de escanearla (p. ej. chkdsk).
+
+    argumentos es la lista para subprocess (sin shell). La salida se lee
+    mientras se produce y se parte en líneas también por '\\r', que es como
+    chkdsk reescribe su porcentaje; interpretar(linea) puede convertir cada
+    línea en un avance 0-100. La orden se mata al cancelar o al pasar
+    tiempo_limite segundos, y no recibe entrada: una pregunta (S/N) se
+    responde sola con fin de archivo en vez de esperar para siempre.
+    """
+    # Cada cuánto se comprueba la cancelación si la orden no escribe nada
+    INTERVALO = 0.1
+
+    def __init__(self, nombre, argumentos, mensaje, interpretar=porcentaje_en_linea, tiempo_limite=None,
+                 codificacion=None):
+        self.nombre = nombre
+        self.argumentos = list(argumentos)
+        self.mensaje = mensaje
+        self.interpretar = interpretar
+        self.tiempo_limite = tiempo_limite
+        # La consola de Windows escribe en la página de códigos OEM
+        self.codificacion = codificacion or ('oem' if os.name == 'nt' else locale.getpreferredencoding(False))
+
+    def __repr__(self):
+        return f"PasoExterno({self.nombre!r}, {self.argumentos!r})"
+
+    def ejecutar(self, cancelado=lambda: False, avance=None):
+        """Ejecuta la orden y devuelve su código de salida, o None si se canceló.
+
+        avance(porcentaje, linea) recibe cada línea de salida (porcentaje es
+        None si la línea no dice cuánto lleva). Lanza OSError si la orden no
+        se puede lanzar y subprocess.TimeoutExpired si agota su tiempo.
+        """
+        avance = avance or (lambda porcentaje, linea: None)
+        opciones = {'creationflags': subprocess.CREATE_NO_WINDOW} if os.name == 'nt' else {}
+        proceso = subprocess.Popen(self.argumentos, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, **opciones)
+        lineas = queue.Queue()
+        lector = threading.Thread(target=self._leer, args=(proceso.stdout, lineas), daemon=True,
+                                  name=f"salida {self.nombre}")
+        lector.start()
+        limite = None if self.tiempo_limite is None else time.monotonic() + self.tiempo_limite
+        agotado = False
+        try:
+            while True:
+                try:
+                    linea = lineas.get(timeout=self.INTERVALO)
+                except queue.Empty:
+                    linea = ''
+                if linea is None:
+                    break
+                if linea:
+                    avance(self.interpretar(linea) if self.interpretar else None, linea)
+                if cancelado():
+                    return None
+                if limite is not None and time.monotonic() > limite:
+                    agotado = True
+                    break
+        finally:
+            if proceso.poll() is None:
+                proceso.kill()
+            codigo = proceso.wait()
+            # Un nieto que herede la salida podría mantenerla abierta
+            lector.join(1.0)
+        if agotado:
+            raise subprocess.TimeoutExpired(self.argumentos, self.tiempo_limite)
+        return codigo
+
+    def _leer(self, flujo, lineas):
+        pendiente = b''
+        try:
+            for trozo in iter(lambda: flujo.read1(65536), b''):
+                partes = re.split(rb'[\r\n]', pendiente + trozo)
+                pendiente = partes.pop()
+                for parte in partes:
+                    if parte.strip():
+                        lineas.put(parte.decode(self.codificacion, 'replace').strip())
+            if pendiente.strip():
+                lineas.put(pendiente.decode(self.codificacion, 'replace').strip())
+        except (OSError, ValueError):
+            pass
+        finally:
+            flujo.close()
+            lineas.put(None)
+
+
+def pasos_reparacion(unidad, tiempo_limite=3600):
+    """Pasos previos al escaneo de una letra de unidad: chkdsk /f."""
+    return [PasoExterno('chkdsk', ['chkdsk', f'{unidad}:', '/f'], "Reparando sistema de archivos...",
+                        tiempo_limite=tiempo_limite)]
+
+
+def ejecutar_pasos(pasos, cancelado=lambda: False, progreso=None, diagnostico=None, inicio=10, fin=45):
+    """Ejecuta los pasos en orden repartiendo entre ellos el tramo [inicio, fin] de la barra.
+
+    Un paso que no se puede lanzar, termina con error o agota su tiempo se
+    anota en diagnostico y no detiene a los siguientes; al cancelar se mata
+    el que esté en marcha y no se lanzan más. Devuelve [(nombre, resultado)]
+    con el código de salida, 'cancelado', 'tiempo agotado' o el error.
+    """
+    progreso = progreso or (lambda valor, mensaje: None)
+    diagnostico = diagnostico or SIN_DIAGNOSTICO
+    resultados = []
+    ancho = (fin - inicio) / max(len(pasos), 1)
+    for numero, paso in enumerate(pasos):
+        if cancelado():
+            break
+        base = inicio + numero * ancho
+        ultimo = [0.0, None]
+
+        def avance(porcentaje, linea, paso=paso, base=base, ultimo=ultimo):
+            # Como mucho diez mensajes por segundo, salvo que cambie el porcentaje
+            ahora = time.monotonic()
+            if (porcentaje is not None and porcentaje != ultimo[1]) or ahora - ultimo[0] >= 0.1:
+                if porcentaje is not None:
+                    ultimo[1] = porcentaje
+                ultimo[0] = ahora
+                progreso(int(base + ancho * (ultimo[1] or 0) / 100), f"{paso.mensaje} {linea}")
+
+        progreso(int(base), paso.mensaje)
+        diagnostico.contar('reparacion.pasos')
+        try:
+            with diagnostico.fase(paso.nombre, "reparación"):
+                codigo = paso.ejecutar(cancelado, avance)
+        except subprocess.TimeoutExpired:
+            diagnostico.contar('reparacion.tiempo_agotado')
+            resultados.append((paso.nombre, 'tiempo agotado'))
+            continue
+        except OSError as e:
+            diagnostico.error('reparacion', e)
+            resultados.append((paso.nombre, e))
+            continue
+        if codigo is None:
+            resultados.append((paso.nombre, 'cancelado'))
+            break
+        if codigo:
+            diagnostico.contar('reparacion.fallidos')
+        resultados.append((paso.nombre, codigo))
+    return resultados
+
+
+# FILE_ATTRIBUTE_READONLY | FILE_ATTRIBUTE_HIDDEN | FILE_ATTRIBUTE_SYSTEM
+ATRIBUTOS_OCULTANTES = 0x1 | 0x2 | 0x4
+_atributos_windows = None
+
+
+def restablecer_atributos(rutas, diagnostico=None):
+    """Quita los atributos oculto, sistema y solo lectura de rutas (solo Windows).
+
+    Sustituye a `attrib -h -r -s /s /d` sobre la unidad entera: solo se tocan
+    las rutas que ha devuelto el escaneo y solo si tienen alguno de esos
+    atributos. Devuelve cuántas se han cambiado.
+    """
+    global _atributos_windows
+    if os.name != 'nt':
+        return 0
+    diagnostico = diagnostico or SIN_DIAGNOSTICO
+    if _atributos_windows is None:
+        import ctypes
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.GetFileAttributesW.restype = ctypes.c_uint32
+        kernel32.GetFileAttributesW.argtypes = [ctypes.c_wchar_p]
+        kernel32.SetFileAttributesW.argtypes = [ctypes.c_wchar_p, ctypes.c_uint32]
+        _atributos_windows = (kernel32.GetFileAttributesW, kernel32.SetFileAttributesW)
+    leer, fijar = _atributos_windows
+    cambiados = 0
+    for ruta in rutas:
+        atributos = leer(ruta)
+        # 0xFFFFFFFF = INVALID_FILE_ATTRIBUTES
+        if atributos == 0xFFFFFFFF or not atributos & ATRIBUTOS_OCULTANTES:
+            continue
+        if fijar(ruta, atributos & ~ATRIBUTOS_OCULTANTES):
+            cambiados += 1
+        else:
+            diagnostico.contar('atributos.errores')
+    diagnostico.contar('atributos.restablecidos', cambiados)
+    return cambiados
+
+
+def escanear_unidad(unidad, motor=None, cancelado=lambda: False, progreso=None, diagnostico=None, pasos=None,
+                    punto_control=None, pausado=lambda: False, planificador=None):
+    """Generador de lotes de RegistroArchivo encontrados en unidad.
+
+    unidad puede ser una letra (str) o una lista de letras y rutas, que se
+    recorren a la vez si están en discos distintos (PlanificadorEscaneo).
+    Antes de recorrer una letra entera se ejecutan los pasos de
+    pasos_reparacion (chkdsk), y a lo que se va encontrando en ella se le
+    quitan los atributos oculto, sistema y solo lectura; las rutas se
+    recorren tal cual. pasos sustituye a los pasos previos por defecto (p. ej.
+    [] para no reparar). Con un PuntoControl de un escaneo interrumpido no se
+    repite la reparación y se continúa por donde se quedó (ver
+    MotorEscaneo.escanear); pausado() detiene el recorrido. planificador
+    permite consultar el desglose por destino mientras dura.
+    progreso(valor, mensaje) recibe el avance en la escala 0-100 de la barra.
+    Cada etapa se anota como fase en diagnostico (por defecto, el del motor).
+    """
+    motor = motor or MotorEscaneo(diagnostico=diagnostico)
+    diagnostico = diagnostico or motor.diagnostico
+    progreso = progreso or (lambda valor, mensaje: None)
+    planificador = planificador or PlanificadorEscaneo(motor)
+    unidades = [unidad] if isinstance(unidad, str) else list(unidad)
+    letras = [u for u in unidades if len(u) == 1 and u.isalpha()]
+    rutas_a_escanear = [f"{u}:\\" if u in letras else u for u in unidades]
+    if pasos is None:
+        pasos = [paso for letra in letras for paso in pasos_reparacion(letra)]
+    if pasos and not (punto_control is not None and punto_control.existe()):
+        ejecutar_pasos(pasos, cancelado, progreso, diagnostico)
+        if cancelado():
+            return
+
+    # Estimar el trabajo para poder dar porcentaje y tiempo restante
+    progreso(45, "Estimando tamaño del escaneo...")
+    with diagnostico.fase("estimación"):
+        total_archivos, total_bytes = estimar_totales(rutas_a_escanear, cancelado=cancelado)
+    if cancelado():
+        return
+    reportador = ReportadorProgreso(total_archivos, total_bytes)
+
+    # Buscar archivos recuperables
+    progreso(50, "Buscando archivos recuperables...")
+    # El recorrido incluye el tiempo que el consumidor tarda en procesar cada lote
+    with diagnostico.fase("recorrido"):
+        restablecer = {f"{letra}:\\" for letra in letras} if os.name == 'nt' else set()
+        carpetas = set(rutas_a_escanear)
+        for destino, lote in planificador.escanear(rutas_a_escanear, cancelado, punto_control, pausado):
+            if destino.ruta in restablecer:
+                # Las carpetas ocultas también: attrib /d las incluía
+                rutas = [registro.ruta for registro in lote]
+                nuevas = {os.path.dirname(ruta) for ruta in rutas} - carpetas
+                carpetas |= nuevas
+                with diagnostico.fase("atributos"):
+                    restablecer_atributos(sorted(nuevas) + rutas, diagnostico)
+            yield lote
+            estado = reportador.registrar(len(lote), sum(registro.tamano for registro in lote))
+            if estado:
+                progreso(*estado)
+    if not cancelado():
+        progreso(100, "Recuperación completada")
+
+
+def en_paralelo(funcion, elementos, hilos, cancelado=lambda: False):
+    """Aplica funcion a elementos en un grupo de hilos, con pocas tareas en vuelo.
+
+    Produce (elemento, resultado) en el orden de entrada. Deja de enviar
+    trabajo en cuanto cancelado() devuelve True; las tareas ya empezadas se
+    esperan y se entregan igualmente.
+    """
+    en_vuelo = deque()
+    maximo = hilos * 4
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        for elemento in elementos:
+            if cancelado():
+                break
+            en_vuelo.append((elemento, ejecutor.submit(funcion, elemento)))
+            if len(en_vuelo) >= maximo:
+                elemento_listo, futuro = en_vuelo.popleft()
+                yield elemento_listo, futuro.result()
+        while en_vuelo and not cancelado():
+            elemento_listo, futuro = en_vuelo.popleft()
+            yield elemento_listo, futuro.result()
+        for elemento_listo, futuro in en_vuelo:
+            if not futuro.cancel():
+                yield elemento_listo, futuro.result()
+
+
+def en_paralelo_por_grupos(funcion, grupos, hilos, por_grupo, cancelado=lambda: False):
+    """Como en_paralelo, pero con a lo sumo por_grupo tareas en vuelo de cada grupo.
+
+    grupos es una lista de listas de elementos (p. ej. los archivos de cada
+    disco). Los hilos libres se reparten por turnos entre los grupos y los
+    resultados se producen según terminan, así un grupo lento ocupa como
+    mucho por_grupo hilos y no retiene a los demás.
+    """
+    colas = [deque(grupo) for grupo in grupos if grupo]
+    activos = [0] * len(colas)
+    en_vuelo = {}
+    turno = 0
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        while True:
+            while len(en_vuelo) < hilos and not cancelado():
+                for paso in range(len(colas)):
+                    numero = (turno + paso) % len(colas)
+                    if colas[numero] and activos[numero] < por_grupo:
+                        break
+                else:
+                    break
+                turno = numero + 1
+                activos[numero] += 1
+                elemento = colas[numero].popleft()
+                en_vuelo[ejecutor.submit(funcion, elemento)] = (numero, elemento)
+            if not en_vuelo:
+                return
+            hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                numero, elemento = en_vuelo.pop(futuro)
+                activos[numero] -= 1
+                yield elemento, futuro.result()
+
+
+class BuscadorDuplicados:
+    """Detecta archivos con el mismo contenido.
+
+    Filtra en tres pasadas, cada una solo sobre los candidatos de la anterior:
+    mismo tamaño, mismo hash del principio y el final del archivo y mismo hash
+    completo. Las lecturas se reparten en un grupo fijo de hilos, que limita
+    cuántos archivos se leen a la vez.
+    """
+
+    def __init__(self, hilos_lectura=4, bytes_parciales=8192, tamano_bloque=1 << 20, diagnostico=None):
+        self.hilos_lectura = hilos_lectura
+        self.bytes_parciales = bytes_parciales
+        self.tamano_bloque = tamano_bloque
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+
+    def agrupar(self, rutas, tamanos, cancelado=lambda: False, progreso=None):
+        """Devuelve listas de índices (de rutas/tamanos) con contenido idéntico.
+
+        progreso(fase, hechos, total) se llama periódicamente si se indica.
+        """
+        por_tamano = {}
+        for indice, tamano in enumerate(tamanos):
+            if tamano > 0:
+                por_tamano.setdefault(tamano, []).append(indice)
+        grupos = [grupo for grupo in por_tamano.values() if len(grupo) > 1]
+        del por_tamano
+
+        with self.diagnostico.fase("hash parcial"):
+            grupos = self._refinar(grupos, rutas, tamanos, self._hash_parcial, "parcial", cancelado, progreso)
+        # Si el tramo inicial y final cubren todo el archivo, el hash parcial ya es completo
+        limite = 2 * self.bytes_parciales
+        resueltos = [grupo for grupo in grupos if tamanos[grupo[0]] <= limite]
+        pendientes = [grupo for grupo in grupos if tamanos[grupo[0]] > limite]
+        with self.diagnostico.fase("hash completo"):
+            resueltos += self._refinar(pendientes, rutas, tamanos, self._hash_completo, "completo", cancelado, progreso)
+        if cancelado():
+            return []
+        for grupo in resueltos:
+            grupo.sort()
+        resueltos.sort()
+        return resueltos
+
+    def _refinar(self, grupos, rutas, tamanos, funcion_hash, fase, cancelado, progreso):
+        indices = [indice for grupo in grupos for indice in grupo]
+        claves = {}
+        hechos = 0
+        ultimo_aviso = 0.0
+        for indice, resumen in en_paralelo(lambda i: funcion_hash(rutas[i], tamanos[i]), indices,
+                                        self.hilos_lectura, cancelado):
+            hechos += 1
+            self.diagnostico.contar(f"duplicados.hash_{fase}")
+            if resumen is not None:
+                claves.setdefault((tamanos[indice], resumen), []).append(indice)
+            if progreso and time.monotonic() - ultimo_aviso > 0.1:
+                ultimo_aviso = time.monotonic()
+                progreso(fase, hechos, len(indices))
+        return [grupo for grupo in claves.values() if len(grupo) > 1]
+
+    def _hash_parcial(self, ruta, tamano):
+        try:
+            with open(ruta, 'rb') as f:
+                resumen = hashlib.blake2b(f.read(self.bytes_parciales))
+                if tamano > self.bytes_parciales:
+                    f.seek(max(self.bytes_parciales, tamano - self.bytes_parciales))
+                    resumen.update(f.read(self.bytes_parciales))
+            return resumen.digest()
+        except OSError as e:
+            self.diagnostico.error('duplicados', e)
+            return None
+
+    def _hash_completo(self, ruta, tamano):
+        try:
+            resumen = hashlib.blake2b()
+            with open(ruta, 'rb') as f:
+                for bloque in iter(lambda: f.read(self.tamano_bloque), b''):
+                    resumen.update(bloque)
+            return resumen.digest()
+        except OSError as e:
+            self.diagnostico.error('duplicados', e)
+            return None
+
+
+# ioctl de Linux para clonar un archivo (reflink) en btrfs/XFS
+FICLONE = 0x40049409
+TAMANO_BUFER_COPIA = 8 * 1024 * 1024
+
+
+def copiar_archivo(origen, destino, algoritmo_hash=None):
+    """Copia contenido y metadatos (como shutil.copy2) por la vía más directa.
+
+    Prueba en orden: clonado reflink, os.copy_file_range, os.sendfile y, si el
+    sistema no admite ninguno, lectura/escritura con un búfer grande. Con
+    algoritmo_hash los datos pasan por el búfer para calcular el hash al vuelo
+    y se devuelve su hexdigest (si no, None).
+    """
+    resumen = hashlib.new(algoritmo_hash) if algoritmo_hash else None
+    with open(origen, 'rb') as fuente, open(destino, 'wb') as sumidero:
+        entrada, salida = fuente.fileno(), sumidero.fileno()
+        if resumen is not None or not _copiar_en_nucleo(entrada, salida):
+            bufer = bytearray(TAMANO_BUFER_COPIA)
+            vista = memoryview(bufer)
+            while True:
+                leidos = fuente.readinto(bufer)
+                if not leidos:
+                    break
+                sumidero.write(vista[:leidos])
+                if resumen is not None:
+                    resumen.update(vista[:leidos])
+    shutil.copystat(origen, destino)
+    return resumen.hexdigest() if resumen is not None else None
+
+
+def calcular_hash(ruta, algoritmo='sha256'):
+    resumen = hashlib.new(algoritmo)
+    bufer = bytearray(TAMANO_BUFER_COPIA)
+    vista = memoryview(bufer)
+    with open(ruta, 'rb') as f:
+        while True:
+            leidos = f.readinto(bufer)
+            if not leidos:
+                break
+            resumen.update(vista[:leidos])
+    return resumen.hexdigest()
+
+
+def _copiar_en_nucleo(entrada, salida):
+    """Intenta copiar sin pasar los datos por Python; False si no es posible.
+
+    Solo se renuncia si el primer intento falla: un error a mitad de copia se
+    propaga. Un primer intento que no copia nada tampoco cuenta, porque
+    procfs/sysfs y algunos montajes FUSE devuelven 0 aunque haya datos: se
+    prueba la vía siguiente (la última es el búfer, que también sirve para un
+    archivo vacío).
+    """
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(salida, FICLONE, entrada)
+            return True
+        except OSError:
+            pass
+    for funcion in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if funcion is None:
+            continue
+        copiados = 0
+        try:
+            while True:
+                if funcion is os.sendfile:
+                    n = funcion(salida, entrada, copiados, TAMANO_BUFER_COPIA)
+                else:
+                    n = funcion(entrada, salida, TAMANO_BUFER_COPIA)
+                if n == 0:
+                    if copiados:
+                        return True
+                    break
+                copiados += n
+        except OSError as e:
+            if copiados or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP,
+                                           errno.EOPNOTSUPP, errno.EBADF, errno.EPERM):
+                raise
+    return False
+
+
+def ruta_comun(registros):
+    """Prefijo común de las rutas de los registros ('' si están en unidades distintas)."""
+    try:
+        return os.path.commonpath([registro.ruta for registro in registros])
+    except ValueError:
+        return ''
+
+
+def planificar_destinos(registros, carpeta_destino, reservados=(), common_prefix=None, consultar_disco=True):
+    """Calcula en memoria el destino final de cada registro.
+
+    Mantiene la estructura relativa a la ruta común y resuelve las colisiones
+    con sufijos _dupN en una sola pasada: cada carpeta destino se lista como
+    mucho una vez en lugar de consultar os.path.exists por candidato.
+    reservados son nombres de la carpeta destino que no deben usarse y
+    common_prefix, si se indica, sustituye a la ruta común de registros. Sin
+    consultar_disco (destino dentro de un zip/tar) solo se evitan colisiones
+    entre los propios registros.
+    Devuelve (lista de (registro, destino), carpetas destino).
+    """
+    if not registros:
+        return [], []
+    if common_prefix is None:
+        common_prefix = ruta_comun(registros)
+    ocupados = {os.path.normpath(carpeta_destino): {os.path.normcase(nombre) for nombre in reservados}}
+    listadas = set()
+    siguiente_sufijo = {}
+    plan = []
+    for registro in registros:
+        try:
+            relativa = os.path.relpath(registro.ruta, common_prefix)
+        except Exception:
+            relativa = os.path.basename(registro.ruta)
+        if relativa == os.curdir:
+            # Un único archivo: su ruta común es él mismo
+            relativa = os.path.basename(registro.ruta)
+        carpeta, nombre = os.path.split(os.path.normpath(os.path.join(carpeta_destino, relativa)))
+        nombres = ocupados.get(carpeta)
+        if nombres is None:
+            nombres = set()
+            ocupados[carpeta] = nombres
+        if consultar_disco and carpeta not in listadas:
+            listadas.add(carpeta)
+            try:
+                with os.scandir(carpeta) as entradas:
+                    nombres.update(os.path.normcase(entrada.name) for entrada in entradas)
+            except OSError:
+                pass
+        final = nombre
+        if os.path.normcase(final) in nombres:
+            base, ext = os.path.splitext(nombre)
+            clave = (carpeta, os.path.normcase(nombre))
+            contador = siguiente_sufijo.get(clave, 1)
+            while os.path.normcase(final) in nombres:
+                final = f"{base}_dup{contador}{ext}"
+                contador += 1
+            siguiente_sufijo[clave] = contador
+        nombres.add(os.path.normcase(final))
+        plan.append((registro, os.path.join(carpeta, final)))
+    return plan, list(ocupados)
+
+
+class ManifiestoExportacion:
+    """Manifiesto JSON Lines de una carpeta de exportación.
+
+    Cada línea describe un archivo copiado: ruta de origen, destino relativo,
+    tamaño, fecha, hash y si la copia se verificó releyéndola. Solo se añaden
+    líneas; al leerlo, la última entrada de cada origen es la que cuenta.
+    """
+    NOMBRE = "pickrestore_manifiesto.jsonl"
+
+    def __init__(self, carpeta_destino):
+        self.carpeta_destino = carpeta_destino
+        self.ruta = os.path.join(carpeta_destino, self.NOMBRE)
+        self._archivo = None
+
+    def cargar(self):
+        """Devuelve {ruta de origen: entrada} de exportaciones anteriores."""
+        entradas = {}
+        try:
+            with open(self.ruta, encoding='utf-8') as f:
+                for linea in f:
+                    try:
+                        entrada = json.loads(linea)
+                        entradas[entrada['ruta']] = entrada
+                    except (ValueError, KeyError, TypeError):
+                        # Línea incompleta de una exportación interrumpida
+                        continue
+        except OSError:
+            pass
+        return entradas
+
+    def ya_exportado(self, entrada, registro):
+        """True si la entrada verificada corresponde al registro y la copia sigue ahí."""
+        if not entrada or not entrada.get('verificado'):
+            return False
+        if entrada.get('tamano') != registro.tamano or entrada.get('fecha') != registro.fecha:
+            return False
+        try:
+            return os.path.getsize(os.path.join(self.carpeta_destino, entrada['destino'])) == registro.tamano
+        except (OSError, KeyError):
+            return False
+
+    def anotar(self, registro, destino, resumen, verificado):
+        if self._archivo is None:
+            self._archivo = open(self.ruta, 'a', encoding='utf-8')
+        self._archivo.write(json.dumps({
+            'ruta': registro.ruta,
+            'destino': os.path.relpath(destino, self.carpeta_destino),
+            'tamano': registro.tamano,
+            'fecha': registro.fecha,
+            'hash': resumen,
+            'verificado': verificado,
+        }) + "\n")
+
+    def cerrar(self):
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = None
+
+
+class InformeExportacion:
+    """Resultado de una exportación: totales y errores por archivo."""
+
+    def __init__(self):
+        self.exitos = 0
+        self.omitidos = 0
+        # Archivos saltados por figurar ya verificados en el manifiesto
+        self.ya_exportados = 0
+        self.bytes_copiados = 0
+        # Lista de (ruta de origen, mensaje de error)
+        self.errores = []
+        self.cancelado = False
+        self.segundos = 0.0
+
+
+class MotorExportacion:
+    """Copia archivos a una carpeta destino con un grupo de hilos acotado.
+
+    Cada dispositivo de origen tiene su cola y a lo sumo hilos_origen copias
+    en curso; el grupo tiene hilos_origen hilos por dispositivo, sin pasar de
+    hilos_destino, que acota las escrituras en el destino común. Así un disco
+    lento de origen no frena las copias de los demás.
+
+    Con algoritmo_hash cada copia se resume al vuelo y se anota en el
+    manifiesto de la carpeta destino; verificar relee además la copia y la
+    compara. Los archivos verificados en una exportación anterior se saltan.
+    Con algoritmo_hash=None no hay manifiesto ni verificación, pero la copia
+    puede usar la vía rápida del sistema (reflink, copy_file_range, sendfile).
+    """
+
+    def __init__(self, hilos_origen=4, hilos_destino=4, algoritmo_hash='sha256', verificar=False,
+                 diagnostico=None):
+        self.hilos_origen = hilos_origen
+        self.hilos_destino = hilos_destino
+        self.algoritmo_hash = algoritmo_hash
+        self.verificar = verificar
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+
+    def exportar(self, registros, carpeta_destino, cancelado=lambda: False, progreso=None):
+        """Copia los registros manteniendo la estructura relativa a su ruta común.
+
+        progreso(archivos, bytes_) se llama en el hilo que invoca por cada
+        archivo terminado. Devuelve un InformeExportacion.
+        """
+        informe = InformeExportacion()
+        inicio = time.monotonic()
+        diagnostico = self.diagnostico
+
+        with diagnostico.fase("manifiesto"):
+            manifiesto = ManifiestoExportacion(carpeta_destino)
+            anteriores = manifiesto.cargar()
+            pendientes = []
+            for registro in registros:
+                if manifiesto.ya_exportado(anteriores.get(registro.ruta), registro):
+                    informe.ya_exportados += 1
+                else:
+                    pendientes.append(registro)
+            del anteriores
+
+        # La ruta común es la de toda la selección, para que la estructura no
+        # cambie aunque parte de ella ya estuviera exportada
+        with diagnostico.fase("planificación"):
+            plan, carpetas = planificar_destinos(pendientes, carpeta_destino,
+                                                 reservados=(ManifiestoExportacion.NOMBRE,),
+                                                 common_prefix=ruta_comun(registros))
+            por_dispositivo = self._agrupar_por_dispositivo(plan)
+        with diagnostico.fase("crear carpetas"):
+            for carpeta in carpetas:
+                try:
+                    os.makedirs(carpeta, exist_ok=True)
+                except OSError as e:
+                    # El error se informará por archivo al copiar
+                    diagnostico.error('exportación.carpetas', e)
+
+        def copiar(paso):
+            registro, destino = paso
+            ruta_archivo = registro.ruta
+            try:
+                if not registro.existe():
+                    return 'omitido', None
+                if cancelado():
+                    return 'cancelado', None
+                inicio_copia = time.perf_counter()
+                resumen = registro.copiar_a(destino, self.algoritmo_hash)
+                diagnostico.anotar_lento('exportación', ruta_archivo, inicio_copia, time.perf_counter())
+                verificado = False
+                if self.verificar and resumen is not None:
+                    if calcular_hash(destino, self.algoritmo_hash) != resumen:
+                        diagnostico.contar('exportación.verificación_fallida')
+                        return 'error', "La copia no coincide con el origen (hash distinto)"
+                    verificado = True
+                return 'ok', (destino, resumen, verificado)
+            except Exception as e:
+                diagnostico.error('exportación', e)
+                return 'error', str(e)
+
+        if progreso and informe.ya_exportados:
+            progreso(informe.ya_exportados, 0)
+        try:
+            por_origen = max(1, self.hilos_origen)
+            hilos = max(1, min(self.hilos_destino, por_origen * len(por_dispositivo)))
+            with diagnostico.fase("copia"):
+                for (registro, _), (estado, valor) in en_paralelo_por_grupos(copiar, list(por_dispositivo.values()),
+                                                                             hilos, por_origen, cancelado):
+                    if estado == 'ok':
+                        informe.exitos += 1
+                        informe.bytes_copiados += registro.tamano
+                        if self.algoritmo_hash:
+                            manifiesto.anotar(registro, *valor)
+                    elif estado == 'omitido':
+                        informe.omitidos += 1
+                    elif estado == 'error':
+                        informe.errores.append((registro.ruta, valor))
+                    if progreso:
+                        progreso(1, registro.tamano if estado == 'ok' else 0)
+        finally:
+            manifiesto.cerrar()
+        self._contar_informe(informe)
+        informe.cancelado = cancelado()
+        informe.segundos = time.monotonic() - inicio
+        return informe
+
+    @staticmethod
+    def _agrupar_por_dispositivo(plan):
+        """Reparte los pasos (registro, destino) del plan según el dispositivo del que se leen.
+
+        Los tallados y borrados se leen de su origen (imagen o disco), que es
+        su propio grupo; el resto, del dispositivo de su carpeta.
+        """
+        dispositivos = {}
+        por_dispositivo = {}
+        for paso in plan:
+            registro = paso[0]
+            if isinstance(registro, RegistroTallado):
+                clave = registro.origen
+            else:
+                carpeta = os.path.dirname(registro.ruta)
+                if carpeta not in dispositivos:
+                    try:
+                        dispositivos[carpeta] = os.stat(carpeta).st_dev
+                    except OSError:
+                        # Sin carpeta la copia se omitirá; van todas juntas
+                        dispositivos[carpeta] = None
+                clave = dispositivos[carpeta]
+            por_dispositivo.setdefault(clave, []).append(paso)
+        return por_dispositivo
+
+    def _contar_informe(self, informe):
+        self.diagnostico.contar('exportación.archivos', informe.exitos)
+        self.diagnostico.contar('exportación.bytes_copiados', informe.bytes_copiados)
+        self.diagnostico.contar('exportación.omitidos', informe.omitidos)
+        self.diagnostico.contar('exportación.ya_exportados', informe.ya_exportados)
+
+    def exportar_a_archivo(self, registros, ruta_archivo, formato='zip', comprimir=False,
+                           cancelado=lambda: False, progreso=None):
+        """Vuelca los registros en un único archivo zip o tar.
+
+        Los nombres internos mantienen la estructura relativa a la ruta común.
+        Cada archivo se lee por bloques y se escribe directamente en el
+        contenedor, con memoria constante. Devuelve un InformeExportacion.
+        """
+        informe = InformeExportacion()
+        inicio = time.monotonic()
+        plan, _ = planificar_destinos(registros, '', consultar_disco=False)
+        if formato == 'zip':
+            contenedor = zipfile.ZipFile(ruta_archivo, 'w', zipfile.ZIP_DEFLATED if comprimir else zipfile.ZIP_STORED)
+            anadir = self._anadir_zip
+        else:
+            contenedor = tarfile.open(ruta_archivo, 'w:gz' if comprimir else 'w')
+            anadir = self._anadir_tar
+        diagnostico = self.diagnostico
+        with contenedor, diagnostico.fase(f"volcado {formato}"):
+            for registro, nombre in plan:
+                if cancelado():
+                    break
+                copiados = 0
+                if not registro.existe():
+                    informe.omitidos += 1
+                else:
+                    inicio_copia = time.perf_counter()
+                    try:
+                        copiados = anadir(contenedor, registro, nombre.replace(os.sep, '/'))
+                        informe.exitos += 1
+                        informe.bytes_copiados += copiados
+                    except Exception as e:
+                        diagnostico.error('exportación', e)
+                        informe.errores.append((registro.ruta, str(e)))
+                    diagnostico.anotar_lento('exportación', registro.ruta, inicio_copia, time.perf_counter())
+                if progreso:
+                    progreso(1, copiados)
+        self._contar_informe(informe)
+        informe.cancelado = cancelado()
+        informe.segundos = time.monotonic() - inicio
+        return informe
+
+    @staticmethod
+    def _anadir_zip(contenedor, registro, nombre):
+        if isinstance(registro, RegistroTallado):
+            # ZIP no admite fechas anteriores a 1980
+            info = zipfile.ZipInfo(nombre, time.localtime(max(registro.fecha, 315532800))[:6])
+            info.file_size = registro.tamano
+        else:
+            info = zipfile.ZipInfo.from_file(registro.ruta, nombre, strict_timestamps=False)
+        info.compress_type = contenedor.compression
+        copiados = 0
+        with registro.abrir() as fuente:
+            # Si la lectura falla a mitad, la entrada queda truncada pero el zip es válido
+            with contenedor.open(info, 'w', force_zip64=info.file_size > 0x7FFFFFFF) as sumidero:
+                for bloque in iter(lambda: fuente.read(TAMANO_BUFER_COPIA), b''):
+                    sumidero.write(bloque)
+                    copiados += len(bloque)
+        return copiados
+
+    @staticmethod
+    def _anadir_tar(contenedor, registro, nombre):
+        with registro.abrir() as fuente:
+            if isinstance(registro, RegistroTallado):
+                info = tarfile.TarInfo(nombre)
+                info.size = registro.tamano
+                info.mtime = registro.fecha
+                info.mode = 0o644
+            else:
+                info = contenedor.gettarinfo(arcname=nombre, fileobj=fuente)
+            lector = _LectorTolerante(fuente, info.size)
+            contenedor.addfile(info, lector)
+        if lector.error is not None:
+            raise lector.error
+        return info.size
+
+
+class _LectorTolerante:
+    """Envuelve un archivo de origen para tarfile.addfile.
+
+    tar declara el tamaño en la cabecera antes de los datos: si la lectura
+    falla o el archivo se acorta, se rellena con ceros hasta ese tamaño para
+    que el contenedor siga siendo válido, y el error queda en `error`.
+    """
+
+    def __init__(self, fuente, tamano):
+        self.fuente = fuente
+        self.restantes = tamano
+        self.error = None
+
+    def read(self, n=-1):
+        if n < 0 or n > self.restantes:
+            n = self.restantes
+        datos = b''
+        if self.error is None:
+            # Un origen por tramos devuelve como mucho hasta el final del tramo
+            try:
+                while len(datos) < n:
+                    bloque = self.fuente.read(n - len(datos))
+                    if not bloque:
+                        break
+                    datos += bloque
+            except OSError as e:
+                self.error = e
+            if len(datos) < n and self.error is None:
+                self.error = OSError(f"El archivo se acortó durante la lectura: faltan {n - len(datos)} bytes")
+        datos += bytes(n - len(datos))
+        self.restantes -= n
+        return datos
@@ -0,0 +1,294 @@
+"""Recuperación de archivos por firma (file carving).
+
+Recorre una imagen de disco o un dispositivo de bloques en crudo buscando
+cabeceras conocidas (JPEG, PNG, PDF, ZIP/DOCX/XLSX) y, para cada una, el
+final del archivo según su formato. No depende del sistema de archivos, así
+que encuentra también datos de archivos borrados mientras no se hayan
+sobrescrito. Los resultados son RegistroTallado, que se muestran y exportan
+como cualquier otro archivo encontrado.
+"""
+import os
+import mmap
+import stat
+from nucleo import RegistroTallado, ReportadorProgreso, SIN_DIAGNOSTICO, en_paralelo, leer_alineado
+
+
+class FuenteCruda:
+    """Imagen o dispositivo abierto en solo lectura, accesible desde varios hilos.
+
+    Las imágenes (archivos normales) se proyectan en memoria con mmap. Los
+    dispositivos se leen con lecturas grandes y alineadas: en un disco dañado
+    un error de lectura a través de mmap mataría el proceso (SIGBUS), mientras
+    que así solo se pierde el bloque ilegible, que se sustituye por ceros.
+    """
+    ALINEACION = 4096
+    BLOQUE_REINTENTO = 64 * 1024
+
+    def __init__(self, ruta, diagnostico=None):
+        self.ruta = ruta
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+        self._archivo = open(ruta, 'rb', buffering=0)
+        self.tamano = self._archivo.seek(0, os.SEEK_END)
+        self._mapa = None
+        if stat.S_ISREG(os.fstat(self._archivo.fileno()).st_mode) and self.tamano:
+            try:
+                self._mapa = mmap.mmap(self._archivo.fileno(), self.tamano, access=mmap.ACCESS_READ)
+            except (OSError, ValueError, OverflowError):
+                # Sin espacio de direcciones suficiente (32 bits): lecturas normales
+                self._mapa = None
+
+    def leer(self, desplazamiento, n):
+        """Hasta n bytes desde desplazamiento (menos al final de la fuente)."""
+        fin = min(desplazamiento + n, self.tamano)
+        if desplazamiento >= fin:
+            return b''
+        if self._mapa is not None:
+            return self._mapa[desplazamiento:fin]
+        try:
+            return leer_alineado(self._archivo, desplazamiento, fin - desplazamiento, self.ALINEACION)
+        except OSError:
+            pass
+        # Sector dañado: se relee por bloques pequeños para salvar el resto
+        partes = []
+        for inicio in range(desplazamiento, fin, self.BLOQUE_REINTENTO):
+            n_parte = min(self.BLOQUE_REINTENTO, fin - inicio)
+            try:
+                partes.append(leer_alineado(self._archivo, inicio, n_parte, self.ALINEACION))
+            except OSError as e:
+                self.diagnostico.error('tallado.lectura', e)
+                partes.append(bytes(n_parte))
+        return b''.join(partes)
+
+    def buscar(self, patron, inicio, fin, bloque=1 << 20):
+        """Posición de patron contenido entero en [inicio, fin), o -1."""
+        fin = min(fin, self.tamano)
+        if self._mapa is not None:
+            return self._mapa.find(patron, inicio, fin)
+        posicion = inicio
+        while posicion < fin:
+            datos = self.leer(posicion, min(bloque, fin - posicion))
+            encontrado = datos.find(patron)
+            if encontrado >= 0:
+                return posicion + encontrado
+            if posicion + len(datos) >= fin or len(datos) < len(patron):
+                return -1
+            posicion += len(datos) - len(patron) + 1
+        return -1
+
+    def buscar_ultimo(self, patron, inicio, fin, bloque=1 << 20):
+        """Última posición de patron contenido entero en [inicio, fin), o -1."""
+        fin = min(fin, self.tamano)
+        if self._mapa is not None:
+            return self._mapa.rfind(patron, inicio, fin)
+        final = fin
+        while final > inicio:
+            comienzo = max(inicio, final - bloque)
+            encontrado = self.leer(comienzo, final - comienzo).rfind(patron)
+            if encontrado >= 0:
+                return comienzo + encontrado
+            if comienzo == inicio:
+                return -1
+            final = comienzo + len(patron) - 1
+        return -1
+
+    def cerrar(self):
+        if self._mapa is not None:
+            self._mapa.close()
+        self._archivo.close()
+
+
+def _medir_jpeg(fuente, inicio, limite):
+    """Recorre los segmentos hasta el primer SOS y busca después el EOI.
+
+    Saltar los segmentos evita cortar en el EOI de la miniatura EXIF; dentro
+    de los datos comprimidos FF D9 no puede aparecer (los FF van seguidos de
+    00 o de un RSTn).
+    """
+    posicion = inicio + 2
+    while True:
+        cabecera = fuente.leer(posicion, 4)
+        if len(cabecera) < 4 or cabecera[0] != 0xFF:
+            return None
+        marcador = cabecera[1]
+        if marcador == 0xFF:
+            posicion += 1
+            continue
+        if marcador == 0xD9 or marcador == 0xD8 or 0xD0 <= marcador <= 0xD7:
+            return None
+        longitud = int.from_bytes(cabecera[2:4], 'big')
+        if longitud < 2:
+            return None
+        posicion += 2 + longitud
+        if posicion >= limite:
+            return None
+        if marcador == 0xDA:
+            break
+    final = fuente.buscar(b'\xff\xd9', posicion, limite)
+    return (final + 2 - inicio, '.jpg') if final >= 0 else None
+
+
+def _medir_png(fuente, inicio, limite):
+    """Recorre los chunks (longitud, tipo, datos, CRC) hasta IEND."""
+    posicion = inicio + 8
+    primero = True
+    while posicion < limite:
+        cabecera = fuente.leer(posicion, 8)
+        if len(cabecera) < 8:
+            return None
+        longitud = int.from_bytes(cabecera[:4], 'big')
+        tipo = cabecera[4:8]
+        if longitud > 0x7FFFFFFF or not tipo.isalpha() or (primero and tipo != b'IHDR'):
+            return None
+        primero = False
+        posicion += 12 + longitud
+        if tipo == b'IEND':
+            return (posicion - inicio, '.png') if posicion <= limite else None
+    return None
+
+
+def _medir_pdf(fuente, inicio, limite):
+    """Hasta el último %%EOF antes de la siguiente cabecera PDF (o del límite).
+
+    Un PDF con actualizaciones incrementales o linealizado tiene varios %%EOF;
+    el último es el final del archivo.
+    """
+    version = fuente.leer(inicio + 5, 3)
+    if len(version) < 3 or not version[:1].isdigit() or version[1:2] != b'.':
+        return None
+    siguiente = fuente.buscar(b'%PDF-', inicio + 5, limite)
+    if siguiente >= 0:
+        limite = siguiente
+    final = fuente.buscar_ultimo(b'%%EOF', inicio, limite)
+    if final < 0:
+        return None
+    final += 5
+    cola = fuente.leer(final, 2)
+    if cola.startswith(b'\r\n'):
+        final += 2
+    elif cola[:1] in (b'\n', b'\r'):
+        final += 1
+    return final - inicio, '.pdf'
+
+
+def _medir_zip(fuente, inicio, limite):
+    """Hasta el registro de fin de directorio central que corresponde al archivo.
+
+    Se acepta el primer fin de directorio cuyo desplazamiento y tamaño del
+    directorio central cuadran con esta cabecera; el contenido del directorio
+    distingue DOCX, XLSX y PPTX de un ZIP cualquiera. ZIP64 no se reconoce.
+    """
+    cabecera = fuente.leer(inicio, 30)
+    if len(cabecera) < 30:
+        return None
+    version = int.from_bytes(cabecera[4:6], 'little')
+    longitud_nombre = int.from_bytes(cabecera[26:28], 'little')
+    if version > 63 or not 0 < longitud_nombre <= 1024:
+        return None
+    posicion = inicio + 30
+    while True:
+        final = fuente.buscar(b'PK\x05\x06', posicion, limite)
+        if final < 0:
+            return None
+        registro_final = fuente.leer(final, 22)
+        if len(registro_final) < 22:
+            return None
+        tamano_directorio = int.from_bytes(registro_final[12:16], 'little')
+        inicio_directorio = int.from_bytes(registro_final[16:20], 'little')
+        longitud_comentario = int.from_bytes(registro_final[20:22], 'little')
+        if inicio + inicio_directorio + tamano_directorio == final:
+            directorio = fuente.leer(inicio + inicio_directorio, min(tamano_directorio, 1 << 20))
+            if b'word/' in directorio:
+                extension = '.docx'
+            elif b'xl/' in directorio:
+                extension = '.xlsx'
+            elif b'ppt/' in directorio:
+                extension = '.pptx'
+            else:
+                extension = '.zip'
+            return final + 22 + longitud_comentario - inicio, extension
+        posicion = final + 4
+
+
+# (cabecera, tamaño máximo, función que mide el archivo y da su extensión)
+FIRMAS = (
+    (b'\xff\xd8\xff', 64 << 20, _medir_jpeg),
+    (b'\x89PNG\r\n\x1a\n', 64 << 20, _medir_png),
+    (b'%PDF-', 256 << 20, _medir_pdf),
+    (b'PK\x03\x04', 512 << 20, _medir_zip),
+)
+
+
+class MotorTallado:
+    """Busca archivos por firma en una imagen o dispositivo, en paralelo.
+
+    La fuente se divide en trozos de tamano_trozo bytes que se analizan en un
+    grupo de hilos. Cada trozo se lee con un pequeño solape para no perder
+    cabeceras partidas entre dos trozos; una cabecera pertenece al trozo en el
+    que empieza. Solo se consideran cabeceras alineadas a `alineacion` (los
+    archivos empiezan en un sector o clúster), lo que descarta la mayoría de
+    falsos positivos. Sin incluir_incrustados se descartan los hallazgos que
+    caen dentro de otro ya aceptado (miniaturas, imágenes dentro de un DOCX).
+    """
+
+    def __init__(self, hilos=4, tamano_trozo=16 << 20, alineacion=512, firmas=FIRMAS,
+                 incluir_incrustados=False, diagnostico=None):
+        self.hilos = hilos
+        self.tamano_trozo = tamano_trozo
+        self.alineacion = max(1, alineacion)
+        self.firmas = firmas
+        self.incluir_incrustados = incluir_incrustados
+        self.diagnostico = diagnostico or SIN_DIAGNOSTICO
+        self._solape = max(len(cabecera) for cabecera, _, _ in firmas) - 1
+
+    def tallar(self, ruta, cancelado=lambda: False, progreso=None):
+        """Generador de lotes de RegistroTallado, en orden de desplazamiento.
+
+        progreso(valor, mensaje) recibe el avance en la escala 0-100.
+        """
+        progreso = progreso or (lambda valor, mensaje: None)
+        fuente = FuenteCruda(ruta, self.diagnostico)
+        try:
+            try:
+                fecha = os.stat(ruta).st_mtime
+            except OSError:
+                fecha = 0.0
+            trozos = -(-fuente.tamano // self.tamano_trozo)
+            reportador = ReportadorProgreso(None, fuente.tamano, inicio=0, fin=99, descripcion="Tallados")
+            ocupado_hasta = 0
+            with self.diagnostico.fase("tallado"):
+                for numero, hallados in en_paralelo(lambda n: self._tallar_trozo(fuente, n), range(trozos),
+                                                    self.hilos, cancelado):
+                    lote = []
+                    for inicio, tamano, extension in hallados:
+                        if not self.incluir_incrustados and inicio < ocupado_hasta:
+                            continue
+                        ocupado_hasta = max(ocupado_hasta, inicio + tamano)
+                        lote.append(RegistroTallado(ruta, inicio, tamano, fecha, extension))
+                    self.diagnostico.contar('tallado.archivos', len(lote))
+                    if lote:
+                        yield lote
+                    leidos = min(self.tamano_trozo, fuente.tamano - numero * self.tamano_trozo)
+                    estado = reportador.registrar(len(lote), leidos)
+                    if estado:
+                        progreso(*estado)
+        finally:
+            fuente.cerrar()
+
+    def _tallar_trozo(self, fuente, numero):
+        """[(desplazamiento, tamaño, extensión), ...] de las cabeceras del trozo."""
+        inicio_trozo = numero * self.tamano_trozo
+        longitud = min(self.tamano_trozo, fuente.tamano - inicio_trozo)
+        datos = fuente.leer(inicio_trozo, longitud + self._solape)
+        hallados = []
+        for cabecera, maximo, medir in self.firmas:
+            posicion = datos.find(cabecera)
+            while 0 <= posicion < longitud:
+                inicio = inicio_trozo + posicion
+                if inicio % self.alineacion == 0:
+                    self.diagnostico.contar('tallado.cabeceras')
+                    medida = medir(fuente, inicio, min(inicio + maximo, fuente.tamano))
+                    if medida is not None:
+                        hallados.append((inicio, *medida))
+                posicion = datos.find(cabecera, posicion + 1)
+        hallados.sort()
+        return hallados
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+import pytest
+
+from busqueda import Consulta, IndiceBusqueda
+from nucleo import AlmacenResultados, RegistroArchivo
+
+AHORA = datetime(2024, 6, 1, 12, 0).timestamp()
+
+
+def test_tamanos():
+    consulta = Consulta(">1MB <=500,5KB")
+    assert consulta.tamano_min == 1024 ** 2 + 1
+    assert consulta.tamano_max == int(500.5 * 1024)
+    assert Consulta("tamaño:=10").tamano_min == Consulta("tamaño:=10").tamano_max == 10
+    assert Consulta(">=2kb").tamano_min == 2048
+
+
+def test_fechas_dias_completos():
+    consulta = Consulta("desde:2024-05-01 hasta:2024-05-31")
+    assert consulta.fecha_min == datetime(2024, 5, 1).timestamp()
+    assert datetime(2024, 5, 31, 23, 59, 59).timestamp() <= consulta.fecha_max < datetime(2024, 6, 1).timestamp()
+    assert Consulta("dias:7", ahora=AHORA).fecha_min == AHORA - 7 * 86400
+
+
+def test_ruta_entre_comillas_y_resto():
+    consulta = Consulta('factura* tipo:PDF,.docx en:"C:\\Users\\x\\Mis documentos\\" Ñandú')
+    assert consulta.carpetas == ["c:\\users\\x\\mis documentos"]
+    assert consulta.extensiones == {'.pdf', '.docx'}
+    assert consulta.prefijos == ['factura']
+    assert consulta.textos == ['Ñandú']
+    assert Consulta("").vacia()
+
+
+@pytest.mark.parametrize('texto', ['>1XB', 'desde:2024-13-01', 'hasta:ayer', 'dias:muchos', 'en:"sin cerrar'])
+def test_consultas_no_validas(texto):
+    with pytest.raises(ValueError):
+        Consulta(texto)
+
+
+NOMBRES = ['Árbol.jpg', 'árbol genealógico.pdf', 'ÑANDÚ.txt', 'ñandú.png', 'Straße.doc', 'arch1.txt', 'ARCH2.txt',
+           'otro.bin']
+
+
+def _almacen(repeticiones=1):
+    almacen = AlmacenResultados()
+    for i in range(repeticiones):
+        for j, nombre in enumerate(NOMBRES):
+            almacen.anadir(RegistroArchivo(f"/datos/d{i}/{nombre}", 1000 * (j + 1), AHORA - 86400 * j))
+    return almacen
+
+
+@pytest.mark.parametrize('texto, esperados', [
+    ('árbol', {'Árbol.jpg', 'árbol genealógico.pdf'}),
+    ('ÁRBOL*', {'Árbol.jpg', 'árbol genealógico.pdf'}),
+    ('ñandú', {'ÑANDÚ.txt', 'ñandú.png'}),
+    ('ñ*', {'ÑANDÚ.txt', 'ñandú.png'}),
+    ('STRASSE', {'Straße.doc'}),
+    ('arch*', {'arch1.txt', 'ARCH2.txt'}),
+])
+def test_nombres_sin_distinguir_mayusculas(texto, esperados):
+    almacen = _almacen()
+    indice = IndiceBusqueda(almacen)
+    consulta = Consulta(texto)
+    mascara = indice.filtrar(consulta)
+    assert {almacen.nombre(i) for i in range(len(almacen)) if mascara[i]} == esperados
+    assert all(mascara[i] == indice.coincide(consulta, i) for i in range(len(almacen)))
+
+
+@pytest.mark.parametrize('texto', ['arch* >2KB', '<=3000 dias:3', 'ñ* <5KB', 'árbol tipo:jpg,pdf', 'ss'])
+def test_indices_ordenados_dan_lo_mismo(texto, monkeypatch):
+    # Trozos pequeños para que haya trozos completos, mezcla y archivos añadidos tras indexar
+    monkeypatch.setattr(AlmacenResultados, 'BLOQUE_BUSQUEDA', 16)
+    monkeypatch.setattr(IndiceBusqueda, 'TROZO_ORDEN', 16)
+    monkeypatch.setattr(IndiceBusqueda, 'preparar_en_segundo_plano', lambda self: None)
+    almacen = _almacen(12)
+    indice = IndiceBusqueda(almacen)
+    consulta = Consulta(texto, ahora=AHORA)
+    sin_indices = indice.filtrar(consulta)
+    indice.preparar()
+    assert indice.filtrar(consulta) == sin_indices
+    for nombre in NOMBRES[:3]:
+        almacen.anadir(RegistroArchivo(f"/datos/nuevo/{nombre}", 2500, AHORA))
+    esperado = bytearray(indice.coincide(consulta, i) for i in range(len(almacen)))
+    assert indice.filtrar(consulta) == esperado
+
+
+def test_filtrar_por_pasos_y_textos_guardados(monkeypatch):
+    # Trozos pequeños para que la búsqueda se reparta en varios pasos
+    monkeypatch.setattr(AlmacenResultados, 'BLOQUE_BUSQUEDA', 16)
+    monkeypatch.setattr(IndiceBusqueda, 'TROZO_PASO', 16)
+    monkeypatch.setattr(IndiceBusqueda, 'preparar_en_segundo_plano', lambda self: None)
+    almacen = _almacen(12)
+    indice = IndiceBusqueda(almacen)
+    consulta = Consulta('a tipo:txt,pdf,png', ahora=AHORA)
+    pasos = indice.filtrar_por_pasos(consulta)
+    dados = 0
+    try:
+        while True:
+            next(pasos)
+            dados += 1
+    except StopIteration as fin:
+        mascara = fin.value
+    assert dados > 1
+    assert mascara == bytearray(indice.coincide(consulta, i) for i in range(len(almacen)))
+    # La máscara del texto guardada se amplía con los archivos nuevos
+    almacen.anadir(RegistroArchivo("/datos/nuevo/zeto.txt", 1, AHORA))
+    almacen.anadir(RegistroArchivo("/datos/nuevo/ñandú.txt", 1, AHORA))
+    mascara = indice.filtrar(consulta)
+    assert mascara[-2:] == b'\x00\x01'
+    assert mascara == bytearray(indice.coincide(consulta, i) for i in range(len(almacen)))
@@ -0,0 +1,139 @@
+import errno
+import hashlib
+import os
+import types
+
+import pytest
+
+import nucleo
+from nucleo import RegistroArchivo, copiar_archivo, planificar_destinos
+
+sin_copia_en_nucleo = pytest.mark.skipif(not hasattr(os, 'copy_file_range') or not hasattr(os, 'sendfile'),
+                                         reason="requiere os.copy_file_range y os.sendfile")
+
+
+@pytest.fixture
+def origen(tmp_path):
+    ruta = tmp_path / "origen.bin"
+    ruta.write_bytes(os.urandom(300000))
+    os.utime(ruta, (1000000000, 1000000000))
+    return ruta
+
+
+@pytest.fixture
+def llamadas(monkeypatch):
+    """Registra qué vías de copia se usan; por defecto el reflink no está disponible."""
+    usadas = []
+
+    def sin_reflink(salida, operacion, entrada):
+        usadas.append('reflink')
+        raise OSError(errno.EOPNOTSUPP, "sin reflink")
+
+    monkeypatch.setattr(nucleo, 'fcntl', types.SimpleNamespace(ioctl=sin_reflink))
+    for nombre in ('copy_file_range', 'sendfile'):
+        real = getattr(os, nombre, None)
+        if real is not None:
+            def registrada(*args, _real=real, _nombre=nombre):
+                usadas.append(_nombre)
+                return _real(*args)
+            monkeypatch.setattr(os, nombre, registrada)
+    return usadas
+
+
+def _copiar(origen, tmp_path, algoritmo_hash=None):
+    destino = tmp_path / "destino.bin"
+    resultado = copiar_archivo(str(origen), str(destino), algoritmo_hash)
+    assert destino.read_bytes() == origen.read_bytes()
+    assert os.stat(destino).st_mtime == os.stat(origen).st_mtime
+    return resultado
+
+
+def test_reflink_primero(origen, tmp_path, monkeypatch, llamadas):
+    def clonar(salida, operacion, entrada):
+        assert operacion == nucleo.FICLONE
+        llamadas.append('reflink')
+        os.write(salida, os.pread(entrada, 1 << 20, 0))
+
+    monkeypatch.setattr(nucleo, 'fcntl', types.SimpleNamespace(ioctl=clonar))
+    assert _copiar(origen, tmp_path) is None
+    assert llamadas == ['reflink']
+
+
+@sin_copia_en_nucleo
+def test_copy_file_range_sin_reflink(origen, tmp_path, llamadas):
+    _copiar(origen, tmp_path)
+    assert llamadas[0] == 'reflink' and set(llamadas[1:]) == {'copy_file_range'}
+
+
+@sin_copia_en_nucleo
+@pytest.mark.parametrize('fallo', [0, errno.EXDEV])
+def test_sendfile_si_copy_file_range_no_copia(origen, tmp_path, monkeypatch, llamadas, fallo):
+    # Devolver 0 al primer intento (procfs, FUSE) no es una copia terminada
+    def copy_file_range(*args):
+        llamadas.append('copy_file_range')
+        if fallo:
+            raise OSError(fallo, "entre sistemas de archivos")
+        return 0
+
+    monkeypatch.setattr(os, 'copy_file_range', copy_file_range)
+    _copiar(origen, tmp_path)
+    assert llamadas[:2] == ['reflink', 'copy_file_range'] and set(llamadas[2:]) == {'sendfile'}
+
+
+def test_bufer_si_ninguna_via_copia(origen, tmp_path, monkeypatch, llamadas):
+    for nombre in ('copy_file_range', 'sendfile'):
+        if hasattr(os, nombre):
+            monkeypatch.setattr(os, nombre, lambda *args, _nombre=nombre: llamadas.append(_nombre) or 0)
+    _copiar(origen, tmp_path)
+    assert llamadas == ['reflink'] + [nombre for nombre in ('copy_file_range', 'sendfile') if hasattr(os, nombre)]
+
+
+def test_archivo_vacio(tmp_path, llamadas):
+    vacio = tmp_path / "vacio.bin"
+    vacio.write_bytes(b'')
+    _copiar(vacio, tmp_path)
+
+
+def test_error_a_mitad_de_copia(origen, tmp_path, monkeypatch, llamadas):
+    if not hasattr(os, 'copy_file_range'):
+        pytest.skip("requiere os.copy_file_range")
+    real = os.copy_file_range
+
+    def falla_despues(*args):
+        if 'copy_file_range' in llamadas:
+            raise OSError(errno.EXDEV, "a mitad")
+        llamadas.append('copy_file_range')
+        return real(*args)
+
+    monkeypatch.setattr(os, 'copy_file_range', falla_despues)
+    with pytest.raises(OSError):
+        copiar_archivo(str(origen), str(tmp_path / "destino.bin"))
+
+
+def test_con_hash_pasa_por_el_bufer(origen, tmp_path, llamadas):
+    assert _copiar(origen, tmp_path, 'sha256') == hashlib.sha256(origen.read_bytes()).hexdigest()
+    assert llamadas == []
+
+
+def test_planificar_destinos_sufijos(tmp_path):
+    destino = tmp_path / "destino"
+    (destino / "sub").mkdir(parents=True)
+    (destino / "a.txt").write_bytes(b'')
+    (destino / "a_dup1.txt").write_bytes(b'')
+    registros = [RegistroArchivo(ruta, 1, 0.0) for ruta in
+                 ("/s/a.txt", "/s/a.txt", "/s/b.txt", "/s/sub/a.txt", "/s/sin_extension", "/s/sin_extension")]
+    plan, carpetas = planificar_destinos(registros, str(destino), reservados=("b.txt",))
+    assert [os.path.relpath(final, destino) for _, final in plan] == [
+        "a_dup2.txt", "a_dup3.txt", "b_dup1.txt", os.path.join("sub", "a.txt"), "sin_extension",
+        "sin_extension_dup1"]
+    assert [registro for registro, _ in plan] == registros
+    assert sorted(carpetas) == [str(destino), str(destino / "sub")]
+
+    # Dentro de un zip/tar solo chocan los propios registros
+    plan, _ = planificar_destinos(registros[:2], str(destino), consultar_disco=False)
+    assert [os.path.basename(final) for _, final in plan] == ["a.txt", "a_dup1.txt"]
+
+
+def test_planificar_destinos_un_archivo(tmp_path):
+    plan, _ = planificar_destinos([RegistroArchivo("/s/sub/foto.jpg", 1, 0.0)], str(tmp_path))
+    assert plan[0][1] == os.path.join(str(tmp_path), "foto.jpg")
@@ -0,0 +1,36 @@
+import os
+
+import nucleo
+from nucleo import estimar_totales
+
+
+def _carpeta(tmp_path, n):
+    for i in range(n):
+        (tmp_path / f"a{i}.txt").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b.txt").write_bytes(b"y")
+    return str(tmp_path)
+
+
+def test_carpeta_cuenta_archivos(tmp_path):
+    archivos, _ = estimar_totales([_carpeta(tmp_path, 3)])
+    assert archivos == 4
+
+
+def test_volumen_sin_statvfs_y_carpeta(tmp_path, monkeypatch):
+    # Como en Windows: el volumen no sabe cuántos archivos tiene
+    monkeypatch.delattr(os, 'statvfs', raising=False)
+    monkeypatch.setattr(nucleo, '_estimar_volumen', lambda ruta: (None, 1000))
+    monkeypatch.setattr(os.path, 'ismount', lambda ruta: ruta == 'C:\\')
+    archivos, bytes_ = estimar_totales(['C:\\', _carpeta(tmp_path, 2)])
+    assert archivos is None
+    # Fuera de Windows el preconteo no suma tamaños y no queda ningún total
+    assert bytes_ == (1000 + 21 if os.name == 'nt' else None)
+
+
+def test_volumen_y_carpeta_conservan_lo_conocido(tmp_path, monkeypatch):
+    monkeypatch.setattr(nucleo, '_estimar_volumen', lambda ruta: (50, 1000))
+    monkeypatch.setattr(os.path, 'ismount', lambda ruta: ruta == '/volumen')
+    archivos, bytes_ = estimar_totales(['/volumen', _carpeta(tmp_path, 2)])
+    assert archivos == 53
+    assert bytes_ == (1021 if os.name == 'nt' else None)
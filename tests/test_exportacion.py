@@ -0,0 +1,77 @@
+import tarfile
+import threading
+import zipfile
+
+from nucleo import MotorExportacion, RegistroBorrado, RegistroTallado, en_paralelo_por_grupos
+
+
+def _origen_fragmentado(tmp_path):
+    datos = bytes(range(256)) * 600
+    origen = tmp_path / "volumen.img"
+    origen.write_bytes(datos)
+    tramos = [(0, 20000), (100000, 30000)]
+    esperado = datos[0:20000] + datos[100000:130000]
+    return RegistroBorrado(str(origen), "/carpeta/foto.jpg", tramos, 50000, 0), esperado
+
+
+def test_tar_de_registro_en_varios_tramos(tmp_path):
+    registro, esperado = _origen_fragmentado(tmp_path)
+    destino = tmp_path / "salida.tar"
+    informe = MotorExportacion().exportar_a_archivo([registro], str(destino), 'tar')
+    assert informe.errores == []
+    with tarfile.open(destino) as contenedor:
+        miembro, = contenedor.getmembers()
+        assert contenedor.extractfile(miembro).read() == esperado
+
+
+def test_zip_de_registro_en_varios_tramos(tmp_path):
+    registro, esperado = _origen_fragmentado(tmp_path)
+    destino = tmp_path / "salida.zip"
+    informe = MotorExportacion().exportar_a_archivo([registro], str(destino), 'zip')
+    assert informe.errores == []
+    with zipfile.ZipFile(destino) as contenedor:
+        nombre, = contenedor.namelist()
+        assert contenedor.read(nombre) == esperado
+
+
+def test_grupo_lento_no_retiene_a_los_demas():
+    soltar = threading.Event()
+    en_curso = {'lento': 0, 'rapido': 0}
+    maximos = dict(en_curso)
+    cerrojo = threading.Lock()
+
+    def tarea(elemento):
+        grupo, _ = elemento
+        with cerrojo:
+            en_curso[grupo] += 1
+            maximos[grupo] = max(maximos[grupo], en_curso[grupo])
+        if grupo == 'lento':
+            assert soltar.wait(10)
+        with cerrojo:
+            en_curso[grupo] -= 1
+        return grupo
+
+    grupos = [[('lento', i) for i in range(5)], [('rapido', i) for i in range(20)]]
+    hechos = []
+    for elemento, resultado in en_paralelo_por_grupos(tarea, grupos, hilos=4, por_grupo=2):
+        hechos.append(elemento)
+        if len(hechos) == 20:
+            # Los rápidos terminan todos mientras los lentos siguen parados
+            assert all(grupo == 'rapido' for grupo, _ in hechos)
+            soltar.set()
+    assert sorted(hechos) == sorted(grupos[0] + grupos[1])
+    assert maximos['lento'] == 2 and maximos['rapido'] <= 2
+
+
+def test_exportar_de_varios_origenes(tmp_path):
+    registros = []
+    for numero in range(3):
+        imagen = tmp_path / f"disco{numero}.img"
+        imagen.write_bytes(bytes([numero]) * 4096)
+        registros += [RegistroTallado(str(imagen), desplazamiento, 1000, 0, '.bin') for desplazamiento in (0, 2048)]
+    destino = tmp_path / "salida"
+    informe = MotorExportacion(hilos_origen=1, hilos_destino=2).exportar(registros, str(destino))
+    assert informe.errores == [] and informe.exitos == 6
+    for numero in range(3):
+        for nombre in ("000000000000.bin", "000000000800.bin"):
+            assert (destino / f"disco{numero}.img.tallado" / nombre).read_bytes() == bytes([numero]) * 1000
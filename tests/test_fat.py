@@ -0,0 +1,129 @@
+import os
+import time
+
+import pytest
+
+from fat import LectorFat, VolumenFat, _suma_lfn
+from tallado import FuenteCruda
+
+BYTES_SECTOR = 512
+SECTORES_FAT = 17
+ENTRADAS_RAIZ = 512
+# Lo justo para que sea FAT16 (4085 clústeres o más), de un sector cada uno
+SECTORES_TOTAL = 1 + SECTORES_FAT + ENTRADAS_RAIZ * 32 // BYTES_SECTOR + 4100
+INICIO_FAT = BYTES_SECTOR
+INICIO_RAIZ = INICIO_FAT + SECTORES_FAT * BYTES_SECTOR
+INICIO_DATOS = INICIO_RAIZ + ENTRADAS_RAIZ * 32
+# 2024-03-15 10:20:30
+FECHA_DOS = ((2024 - 1980) << 9) | (3 << 5) | 15
+HORA_DOS = (10 << 11) | (20 << 5) | 15
+
+
+def _arranque():
+    sector = bytearray(BYTES_SECTOR)
+    sector[0:3] = b'\xeb\x3c\x90'
+    sector[3:11] = b'MSDOS5.0'
+    sector[11:13] = BYTES_SECTOR.to_bytes(2, 'little')
+    sector[13] = 1
+    sector[14:16] = (1).to_bytes(2, 'little')
+    sector[16] = 1
+    sector[17:19] = ENTRADAS_RAIZ.to_bytes(2, 'little')
+    sector[19:21] = SECTORES_TOTAL.to_bytes(2, 'little')
+    sector[22:24] = SECTORES_FAT.to_bytes(2, 'little')
+    sector[510:512] = b'\x55\xaa'
+    return sector
+
+
+def _entrada(corto, cluster, tamano, atributos=0x20):
+    entrada = bytearray(32)
+    entrada[0:11] = corto
+    entrada[11] = atributos
+    entrada[22:24] = HORA_DOS.to_bytes(2, 'little')
+    entrada[24:26] = FECHA_DOS.to_bytes(2, 'little')
+    entrada[26:28] = cluster.to_bytes(2, 'little')
+    entrada[28:32] = tamano.to_bytes(4, 'little')
+    return entrada
+
+
+def _entradas_lfn(nombre, corto):
+    """Entradas de nombre largo en el orden del disco (la última parte primero)."""
+    unidades = nombre.encode('utf-16-le') + b'\0\0'
+    unidades += b'\xff' * (-len(unidades) % 26)
+    partes = [unidades[i:i + 26] for i in range(0, len(unidades), 26)]
+    entradas = []
+    for numero, parte in enumerate(partes, 1):
+        entrada = bytearray(32)
+        entrada[0] = numero | (0x40 if numero == len(partes) else 0)
+        entrada[1:11] = parte[0:10]
+        entrada[11] = 0x0F
+        entrada[13] = _suma_lfn(corto)
+        entrada[14:26] = parte[10:22]
+        entrada[28:32] = parte[22:26]
+        entradas.append(entrada)
+    return list(reversed(entradas))
+
+
+def _cluster(numero):
+    return INICIO_DATOS + (numero - 2) * BYTES_SECTOR
+
+
+@pytest.fixture
+def imagen(tmp_path):
+    """FAT16 con un archivo vivo, uno borrado con nombre largo y otro borrado ya sobrescrito."""
+    contenido = os.urandom(1500)
+    ruta = tmp_path / "tarjeta.img"
+    with open(ruta, 'wb') as f:
+        f.truncate(SECTORES_TOTAL * BYTES_SECTOR)
+        f.write(_arranque())
+        # Solo el archivo vivo ocupa clústeres: el 10
+        f.seek(INICIO_FAT)
+        f.write(b'\xf8\xff\xff\xff' + bytes(8 * 2) + b'\xff\xff')
+        corto = b'FOTOGR~1JPG'
+        raiz = b''.join(_entradas_lfn('Fotografía de verano.jpg', corto))
+        # Al borrar, el primer byte de cada entrada pasa a ser 0xE5
+        raiz = b''.join(b'\xe5' + raiz[i + 1:i + 32] for i in range(0, len(raiz), 32))
+        raiz += b'\xe5' + _entrada(corto, 5, len(contenido))[1:]
+        raiz += _entrada(b'VIVO    TXT', 10, 10)
+        raiz += b'\xe5' + _entrada(b'VIEJO   TXT', 10, 10)[1:]
+        f.seek(INICIO_RAIZ)
+        f.write(raiz)
+        f.seek(_cluster(5))
+        f.write(contenido)
+        f.seek(_cluster(10))
+        f.write(b'nuevo!!!!!')
+    return str(ruta), contenido
+
+
+def test_geometria_fat16(imagen):
+    ruta, _ = imagen
+    fuente = FuenteCruda(ruta)
+    try:
+        volumen = VolumenFat(fuente)
+        assert volumen.tipo == 'FAT16'
+        assert volumen.raiz_fija == (INICIO_RAIZ, ENTRADAS_RAIZ * 32)
+        assert volumen.desplazamiento(2) == INICIO_DATOS
+        assert volumen.libres(5, 3) and not volumen.libres(9, 2)
+    finally:
+        fuente.cerrar()
+
+
+def test_borrados_con_nombre_largo(imagen):
+    ruta, contenido = imagen
+    registros = {os.path.basename(r.ruta): r for lote in LectorFat().borrados(ruta) for r in lote}
+    assert set(registros) == {'Fotografía de verano.jpg', '_IEJO.TXT'}
+    foto = registros['Fotografía de verano.jpg']
+    assert foto.ruta == os.path.join(ruta + ".borrados", 'Fotografía de verano.jpg')
+    assert foto.tramos == [(_cluster(5), 1500)] and foto.integro
+    assert foto.tipo == '.jpg'
+    assert foto.fecha == pytest.approx(time.mktime((2024, 3, 15, 10, 20, 30, 0, 0, -1)))
+    with foto.abrir() as datos:
+        assert datos.read() == contenido
+    # Sus clústeres los usa ya el archivo vivo
+    assert not registros['_IEJO.TXT'].integro
+
+
+def test_no_es_fat(tmp_path):
+    ruta = tmp_path / "ceros.img"
+    ruta.write_bytes(bytes(64 * 1024))
+    with pytest.raises(ValueError):
+        list(LectorFat().borrados(str(ruta)))
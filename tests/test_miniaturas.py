@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+from PyQt5.QtGui import QColor, QImage  # noqa: E402
+
+import interfaz  # noqa: E402
+from nucleo import Diagnostico, RegistroArchivo, RegistroTallado  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def _esperar(app, condicion, segundos=10):
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin and not condicion():
+        app.processEvents()
+        time.sleep(0.01)
+    return condicion()
+
+
+def _foto(tmp_path, nombre='foto.jpg'):
+    imagen = QImage(400, 300, QImage.Format_RGB32)
+    imagen.fill(QColor(200, 100, 50))
+    ruta = str(tmp_path / nombre)
+    assert imagen.save(ruta)
+    return ruta
+
+
+def test_decodifica_reducida_y_tallada(app, tmp_path):
+    ruta = _foto(tmp_path)
+    miniatura = interfaz.decodificar_miniatura(RegistroArchivo(ruta, os.path.getsize(ruta), 0), 64)
+    assert (miniatura.width(), miniatura.height()) == (64, 48)
+    datos = open(ruta, 'rb').read()
+    (tmp_path / 'disco.img').write_bytes(b'\0' * 512 + datos)
+    tallado = RegistroTallado(str(tmp_path / 'disco.img'), 512, len(datos), 0, '.jpg')
+    assert interfaz.decodificar_miniatura(tallado, 64).width() == 64
+    assert interfaz.decodificar_miniatura(tallado, 64, max_bytes=len(datos) - 1).isNull()
+
+
+def test_lru_limitado_en_bytes(app):
+    cache = interfaz.CacheMiniaturas(max_bytes=3 * 32 * 32 * 4)
+    for clave in range(4):
+        cache.guardar(clave, QImage(32, 32, QImage.Format_ARGB32))
+    assert 0 not in cache and len(cache) == 3 and cache.bytes <= cache.max_bytes
+    cache.obtener(1)
+    cache.guardar(9, QImage(32, 32, QImage.Format_ARGB32))
+    assert 1 in cache and 2 not in cache
+
+
+def test_un_fallo_no_detiene_el_generador(app, tmp_path, monkeypatch):
+    ruta = _foto(tmp_path)
+    registro = RegistroArchivo(ruta, os.path.getsize(ruta), 0)
+    decodificar = interfaz.decodificar_miniatura
+
+    def decodificar_fallando(registro, lado):
+        if lado == 1:
+            raise ValueError("registro dañado")
+        return decodificar(registro, lado)
+
+    monkeypatch.setattr(interfaz, 'decodificar_miniatura', decodificar_fallando)
+    diagnostico = Diagnostico()
+    generador = interfaz.GeneradorMiniaturas(interfaz.CacheMiniaturas(), hilos=1, diagnostico=diagnostico)
+    recibidas = {}
+    generador.miniatura_lista.connect(lambda clave, imagen: recibidas.__setitem__(clave, imagen))
+    try:
+        generador.pedir([((ruta, 0, 0, 1), registro), ((ruta, 0, 0, 32), registro)])
+        assert _esperar(app, lambda: len(recibidas) == 2)
+        assert recibidas[(ruta, 0, 0, 1)].isNull()
+        assert recibidas[(ruta, 0, 0, 32)].width() == 32
+        assert generador.pendientes() == 0
+        assert diagnostico.resumen()['contadores'] == {'miniaturas.errores.ValueError': 1}
+    finally:
+        generador.detener()
@@ -0,0 +1,57 @@
+import os
+
+from nucleo import MotorEscaneo, PuntoControl, RegistroArchivo
+
+
+def test_reanuda_desde_lo_escrito(tmp_path):
+    ruta = str(tmp_path / "diario.jsonl")
+    diario = PuntoControl(['/r'], ruta=ruta)
+    diario.abrir(['/r'])
+    diario.anotar('/r', ['/r/a', '/r/b'], [RegistroArchivo('/r/x.txt', 1, 2.0)])
+    diario.anotar('/r/a', [], [RegistroArchivo('/r/a/y.txt', 3, 4.0)])
+    diario.cerrar()
+    # Una línea a medias de un cierre brusco se descarta
+    with open(ruta, 'ab') as f:
+        f.write(b'["/r/b", [], [["z.txt"')
+
+    reanudado = PuntoControl(['/r'], ruta=ruta)
+    lotes = list(reanudado.reanudar())
+    assert [[(r.ruta, r.tamano, r.fecha) for r in lote] for lote in lotes] == [[('/r/x.txt', 1, 2.0)],
+                                                                             [('/r/a/y.txt', 3, 4.0)]]
+    assert reanudado.pendientes == ['/r/b']
+    reanudado.abrir(['/r'])
+    reanudado.anotar('/r/b', [], [])
+    reanudado.cerrar()
+    final = PuntoControl(['/r'], ruta=ruta)
+    assert len(list(final.reanudar())) == 2 and final.pendientes == []
+
+    # Otro escaneo (otra clave) no aprovecha el diario
+    otro = PuntoControl(['/otra'], ruta=ruta)
+    assert list(otro.reanudar()) == [] and otro.pendientes is None
+    otro.borrar()
+    assert not os.path.exists(ruta)
+
+
+def test_escaneo_cortado_y_continuado(tmp_path):
+    raiz = tmp_path / "datos"
+    esperados = set()
+    for i in range(6):
+        for j in range(4):
+            archivo = raiz / f"c{i}" / f"s{j}" / f"f{i}{j}.txt"
+            archivo.parent.mkdir(parents=True, exist_ok=True)
+            archivo.write_bytes(b'x' * (i + j + 1))
+            esperados.add(str(archivo))
+    ruta = str(tmp_path / "diario.jsonl")
+    motor = MotorEscaneo(num_hilos=2)
+
+    cortado = []
+    for lote in motor.escanear([str(raiz)], cancelado=lambda: len(cortado) >= 3,
+                               punto_control=PuntoControl([str(raiz)], ruta=ruta)):
+        cortado.extend(lote)
+    assert 0 < len(cortado) < len(esperados)
+    assert os.path.exists(ruta)
+
+    continuado = [r.ruta for lote in motor.escanear([str(raiz)], punto_control=PuntoControl([str(raiz)], ruta=ruta))
+                  for r in lote]
+    assert sorted(continuado) == sorted(esperados)
+    assert not os.path.exists(ruta)
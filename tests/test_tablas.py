@@ -0,0 +1,36 @@
+import sqlite3
+
+from deteccion import CacheTipos
+from nucleo import IndiceEscaneo, RegistroArchivo
+
+
+def test_indice_guarda_consulta_e_invalida(tmp_path):
+    ruta = str(tmp_path / "indice.sqlite")
+    indice = IndiceEscaneo(ruta)
+    indice.registrar('1', '/datos', 5.0, ['/datos/sub'], [RegistroArchivo('/datos/a.txt', 3, 4.0)])
+    indice.registrar('2', '/otros', 6.0, [], [])
+    indice.guardar()
+    # Otra instancia (otro proceso) ve lo guardado
+    subdirectorios, registros = IndiceEscaneo(ruta).consultar('1', '/datos', 5.0)
+    assert subdirectorios == ['/datos/sub']
+    assert [(r.ruta, r.tamano, r.fecha) for r in registros] == [('/datos/a.txt', 3, 4.0)]
+    assert indice.consultar('1', '/datos', 7.0) is None
+    indice.invalidar(1)
+    assert indice.consultar('1', '/datos', 5.0) is None
+    assert indice.consultar('2', '/otros', 6.0) == ([], [])
+
+
+def test_cache_tipos_por_lotes_y_version(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "tipos.sqlite")
+    monkeypatch.setattr(CacheTipos, 'LOTE_ESCRITURA', 2)
+    cache = CacheTipos(ruta)
+    cache.registrar('/a', 1, 1.0, '.jpg')
+    assert CacheTipos(ruta).consultar([('/a', 1, 1.0)]) == {}
+    cache.registrar('/b', 2, 2.0, None)
+    assert CacheTipos(ruta).consultar([('/a', 1, 1.0), ('/b', 2, 2.0), ('/c', 3, 3.0)]) == {'/a': '.jpg', '/b': ''}
+    assert cache.consultar([('/a', 1, 9.0)]) == {}
+    # Otra versión del formato descarta lo guardado
+    monkeypatch.setattr(CacheTipos, 'VERSION', 2)
+    assert CacheTipos(ruta).consultar([('/a', 1, 1.0)]) == {}
+    with sqlite3.connect(ruta) as conexion:
+        assert conexion.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone() == ('2',)
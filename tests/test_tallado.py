@@ -0,0 +1,78 @@
+import io
+import zipfile
+
+import pytest
+
+from tallado import FuenteCruda, _medir_jpeg, _medir_pdf, _medir_png, _medir_zip
+
+
+def _jpeg():
+    # APP1 con una miniatura cuyo EOI (FF D9) no es el final del archivo
+    app1 = b'Exif\0\0' + b'\xff\xd8\xff\xd9'
+    return (b'\xff\xd8' + b'\xff\xe1' + (len(app1) + 2).to_bytes(2, 'big') + app1
+            + b'\xff\xda\x00\x04\x01\x02' + b'\x12\xff\x00\x34\xff\xd0\x56' + b'\xff\xd9')
+
+
+def _chunk(tipo, datos=b''):
+    return len(datos).to_bytes(4, 'big') + tipo + datos + b'\0\0\0\0'
+
+
+def _png():
+    return b'\x89PNG\r\n\x1a\n' + _chunk(b'IHDR', bytes(13)) + _chunk(b'IDAT', b'x' * 20) + _chunk(b'IEND')
+
+
+def _medir(tmp_path, medidor, datos, delante=b'\0' * 100, detras=b'\0' * 300):
+    ruta = tmp_path / "imagen.bin"
+    ruta.write_bytes(delante + datos + detras)
+    fuente = FuenteCruda(str(ruta))
+    try:
+        return medidor(fuente, len(delante), fuente.tamano)
+    finally:
+        fuente.cerrar()
+
+
+def test_jpeg_salta_la_miniatura(tmp_path):
+    datos = _jpeg()
+    assert _medir(tmp_path, _medir_jpeg, datos) == (len(datos), '.jpg')
+
+
+@pytest.mark.parametrize('corte', [3, 10, 22, -2])
+def test_jpeg_truncado(tmp_path, corte):
+    assert _medir(tmp_path, _medir_jpeg, _jpeg()[:corte], detras=b'') is None
+
+
+def test_png(tmp_path):
+    datos = _png()
+    assert _medir(tmp_path, _medir_png, datos) == (len(datos), '.png')
+
+
+@pytest.mark.parametrize('datos', [_png()[:-12], _png()[:20], b'\x89PNG\r\n\x1a\n' + _chunk(b'IDAT', b'x')])
+def test_png_truncado_o_sin_ihdr(tmp_path, datos):
+    assert _medir(tmp_path, _medir_png, datos, detras=b'') is None
+
+
+def test_png_no_pasa_del_limite(tmp_path):
+    datos = _png()
+    ruta = tmp_path / "imagen.bin"
+    ruta.write_bytes(datos)
+    fuente = FuenteCruda(str(ruta))
+    try:
+        assert _medir_png(fuente, 0, len(datos) - 1) is None
+    finally:
+        fuente.cerrar()
+
+
+def test_pdf_con_actualizacion_incremental(tmp_path):
+    datos = b'%PDF-1.7\n1 0 obj\n%%EOF\n2 0 obj\n%%EOF\r\n'
+    assert _medir(tmp_path, _medir_pdf, datos) == (len(datos), '.pdf')
+    assert _medir(tmp_path, _medir_pdf, b'%PDF-1.7\n1 0 obj\n', detras=b'') is None
+
+
+def test_zip_y_docx(tmp_path):
+    for nombre, extension in (('word/document.xml', '.docx'), ('notas.txt', '.zip')):
+        memoria = io.BytesIO()
+        with zipfile.ZipFile(memoria, 'w') as contenedor:
+            contenedor.writestr(nombre, 'hola' * 50)
+        datos = memoria.getvalue()
+        assert _medir(tmp_path, _medir_zip, datos) == (len(datos), extension)
+        assert _medir(tmp_path, _medir_zip, datos[:-22], detras=b'') is None